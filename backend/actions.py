@@ -0,0 +1,394 @@
+"""
+First-step actions behind /api/execute.
+
+An action is a registered function (open a URL, compose a route search, schedule a reminder,
+call a webhook, ...) that runs on the ActionExecutor's bounded thread pool. Every run is an
+ActionRun row: submit() validates the params and inserts it as "queued", a worker moves it to
+"running" and then to "done"/"failed", and a watchdog timer moves it to "timeout" if it is still
+running after ACTION_TIMEOUT. Transitions are conditional updates on the current status, so
+whichever of worker and watchdog comes first wins. Each transition is published as an
+"action.run" event, so the client sees progress over the WebSocket or the streamed response.
+
+With dry_run the action validates and describes what it would do without side effects.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+import admission
+import events
+import reminders
+import sync
+import webhooks
+from db import engine
+from models import ActionRun, Task, TaskPlan
+
+logger = logging.getLogger("sista.actions")
+
+ACTION_WORKERS = int(os.environ.get("ACTION_WORKERS", "8"))
+# runs waiting for a worker beyond which new ones are refused with 503
+ACTION_MAX_QUEUE = int(os.environ.get("ACTION_MAX_QUEUE", "256"))
+ACTION_PER_USER = int(os.environ.get("ACTION_PER_USER", "4"))
+ACTION_TIMEOUT = float(os.environ.get("ACTION_TIMEOUT", "15"))
+
+TERMINAL = ("done", "failed", "timeout")
+
+
+class ActionError(ValueError):
+    """Invalid parameters; reported as 422 before anything is queued."""
+
+
+class ActionContext:
+    def __init__(self, run_id: int, user_id: int, task_id: Optional[int], dry_run: bool, deadline: float):
+        self.run_id = run_id
+        self.user_id = user_id
+        self.task_id = task_id
+        self.dry_run = dry_run
+        self.deadline = deadline
+        self.cancel = admission.CancelToken()
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class Action:
+    def __init__(self, name: str, description: str, params: Dict[str, str], run: Callable[[ActionContext, Dict[str, Any]], Dict[str, Any]],
+                 validate: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        self.name = name
+        self.description = description
+        self.params = params
+        self.run = run
+        self.validate = validate or (lambda params: params)
+
+
+REGISTRY: Dict[str, Action] = {}
+
+
+def register(name: str, description: str, params: Optional[Dict[str, str]] = None,
+             validate: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+    """Decorator: register fn(ctx, params) -> result dict as action `name`."""
+    def decorator(fn):
+        REGISTRY[name] = Action(name, description, params or {}, fn, validate)
+        return fn
+    return decorator
+
+
+def catalog() -> List[Dict[str, Any]]:
+    return [{"name": a.name, "description": a.description, "params": a.params} for a in REGISTRY.values()]
+
+
+def run_dict(run: ActionRun) -> Dict[str, Any]:
+    return {
+        "id": run.id,
+        "task_id": run.task_id,
+        "action": run.action,
+        "params": json.loads(run.params),
+        "dry_run": run.dry_run,
+        "status": run.status,
+        "result": json.loads(run.result) if run.result else None,
+        "error": run.error,
+        "created_at": run.created_at,
+        "started_at": run.started_at,
+        "finished_at": run.finished_at,
+    }
+
+
+class ActionExecutor:
+    def __init__(self, workers: int = ACTION_WORKERS, max_queue: int = ACTION_MAX_QUEUE, per_user: int = ACTION_PER_USER,
+                 timeout: float = ACTION_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.timeout = timeout
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._active: Dict[int, int] = {}
+        self._total = 0
+        self.completed = 0
+        self.timed_out = 0
+
+    def submit(self, user_id: int, name: str, params: Dict[str, Any], task_id: Optional[int] = None, dry_run: bool = False) -> ActionRun:
+        """Validate, persist as queued and hand to the pool. Raises 422 / 429 / 503 HTTPExceptions."""
+        action = REGISTRY.get(name)
+        if action is None:
+            raise HTTPException(status_code=422, detail=f"Unknown action '{name}'")
+        if not isinstance(params, dict):
+            raise HTTPException(status_code=422, detail="params must be an object")
+        try:
+            params = action.validate(dict(params))
+        except ActionError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        with self._lock:
+            if self._active.get(user_id, 0) >= self.per_user:
+                raise HTTPException(status_code=429, detail=f"At most {self.per_user} actions per user at a time",
+                                    headers={"Retry-After": "1"})
+            if self._total >= self.workers + self.max_queue:
+                raise admission.overloaded("Too many actions queued", self.timeout)
+            self._active[user_id] = self._active.get(user_id, 0) + 1
+            self._total += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="actions")
+        try:
+            with Session(engine) as session:
+                run = ActionRun(user_id=user_id, task_id=task_id, action=name, dry_run=dry_run,
+                                params=json.dumps(params, ensure_ascii=False, default=str))
+                session.add(run)
+                session.commit()
+                session.refresh(run)
+            self._publish(run)
+            self._pool.submit(self._execute, run.id, user_id, task_id, name, params, dry_run)
+        except Exception:
+            self._release(user_id)
+            raise
+        return run
+
+    def _release(self, user_id: int):
+        with self._lock:
+            self._total -= 1
+            left = self._active.get(user_id, 1) - 1
+            if left > 0:
+                self._active[user_id] = left
+            else:
+                self._active.pop(user_id, None)
+
+    def _transition(self, run_id: int, expected, **values) -> Optional[ActionRun]:
+        """Apply `values` only if the run is still in one of the `expected` states."""
+        with Session(engine) as session:
+            changed = session.exec(
+                update(ActionRun).where(ActionRun.id == run_id, ActionRun.status.in_(expected)).values(**values)
+            ).rowcount
+            session.commit()
+            run = session.get(ActionRun, run_id) if changed else None
+        if run is not None:
+            self._publish(run)
+        return run
+
+    def _publish(self, run: ActionRun):
+        events.bus.publish(run.user_id, {"type": "action.run", "id": run.id, "status": run.status, "data": _plain(run)})
+
+    def _execute(self, run_id: int, user_id: int, task_id: Optional[int], name: str, params: Dict[str, Any], dry_run: bool):
+        ctx = ActionContext(run_id, user_id, task_id, dry_run, time.monotonic() + self.timeout)
+        watchdog = threading.Timer(self.timeout, self._expire, args=(ctx,))
+        watchdog.daemon = True
+        try:
+            if self._transition(run_id, ("queued",), status="running", started_at=datetime.utcnow()) is None:
+                return
+            watchdog.start()
+            try:
+                result = REGISTRY[name].run(ctx, params)
+                values = {"status": "done", "result": json.dumps(result, ensure_ascii=False, default=str)}
+            except Exception as e:
+                if not isinstance(e, (ActionError, HTTPException)):
+                    logger.exception("action %s (run %s) failed", name, run_id)
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                values = {"status": "failed", "error": detail or type(e).__name__}
+            if self._transition(run_id, ("running",), finished_at=datetime.utcnow(), **values) is not None:
+                self.completed += 1
+        except Exception:
+            logger.exception("action run %s could not be recorded", run_id)
+        finally:
+            watchdog.cancel()
+            self._release(user_id)
+
+    def _expire(self, ctx: ActionContext):
+        ctx.cancel.cancel()
+        try:
+            if self._transition(ctx.run_id, ("running",), status="timeout", finished_at=datetime.utcnow(),
+                                error=f"timed out after {self.timeout:g}s") is not None:
+                self.timed_out += 1
+        except Exception:
+            logger.exception("could not expire action run %s", ctx.run_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            active = self._total
+        return {"active": active, "workers": self.workers, "completed": self.completed, "timed_out": self.timed_out}
+
+
+executor = ActionExecutor()
+
+
+# --- built-in actions ---
+
+def _http_url(value: Any, field: str) -> str:
+    url = str(value or "").strip()
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ActionError(f"{field} must be an http(s) URL")
+    return url
+
+
+def _task_for(ctx: ActionContext, session: Session, task_id: Any) -> Task:
+    task = session.get(Task, task_id) if task_id else None
+    if task is None or task.user_id != ctx.user_id:
+        raise ActionError("task not found")
+    return task
+
+
+def _validate_first_step(params):
+    if not params.get("task"):
+        raise ActionError("task is required")
+    return {"task": str(params["task"])}
+
+
+@register("first_step", "Show the task's first step (precomputed when available).", {"task": "task title"},
+          validate=_validate_first_step)
+def first_step(ctx: ActionContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    plan = None
+    if ctx.task_id:
+        with Session(engine) as session:
+            plan = session.get(TaskPlan, ctx.task_id)
+    if plan is not None and plan.user_id == ctx.user_id and plan.status == "ready":
+        return {"message": f"『{params['task']}』の最初の一歩: {plan.first_step}（妹が先に考えておいたよ）", "first_step": plan.first_step}
+    return {"message": f"『{params['task']}』の最初の一歩を実行しました！（妹が代行）"}
+
+
+@register("open_url", "Open a page in the user's browser.", {"url": "http(s) URL"},
+          validate=lambda params: {"url": _http_url(params.get("url"), "url")})
+def open_url(ctx: ActionContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    # the client opens it; the server only vets and records the URL
+    return {"open_url": params["url"], "message": f"{params['url']} を開いてね"}
+
+
+_TRAVEL_MODES = ("transit", "walking", "driving", "bicycling")
+
+
+def _validate_route(params):
+    if not params.get("destination"):
+        raise ActionError("destination is required")
+    mode = params.get("mode") or "transit"
+    if mode not in _TRAVEL_MODES:
+        raise ActionError(f"mode must be one of {', '.join(_TRAVEL_MODES)}")
+    return {"origin": str(params.get("origin") or ""), "destination": str(params["destination"]), "mode": mode}
+
+
+@register("route_search", "Compose a route search (Google Maps directions link).",
+          {"destination": "place or address", "origin": "optional, defaults to current location", "mode": "/".join(_TRAVEL_MODES)},
+          validate=_validate_route)
+def route_search(ctx: ActionContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    query = {"api": 1, "destination": params["destination"], "travelmode": params["mode"]}
+    if params["origin"]:
+        query["origin"] = params["origin"]
+    url = "https://www.google.com/maps/dir/?" + urlencode(query)
+    return {"open_url": url, "message": f"{params['destination']}までの行き方を調べたよ"}
+
+
+def _validate_reminder(params):
+    out: Dict[str, Any] = {"task_id": params.get("task_id")}
+    if params.get("at"):
+        at = reminders.parse_due(params["at"])
+        if at is None:
+            raise ActionError("at is not a recognised date/time")
+        out["at"] = at
+    elif params.get("in_minutes") is not None:
+        try:
+            minutes = int(params["in_minutes"])
+        except (TypeError, ValueError):
+            raise ActionError("in_minutes must be an integer")
+        if not 1 <= minutes <= 525600:
+            raise ActionError("in_minutes must be between 1 and 525600")
+        out["in_minutes"] = minutes
+    else:
+        raise ActionError("either at or in_minutes is required")
+    return out
+
+
+@register("schedule_reminder", "Set the task's due time so the 鬼電 alarm fires then.",
+          {"task_id": "defaults to the task being executed", "at": "date/time (UTC)", "in_minutes": "alternative to at"},
+          validate=_validate_reminder)
+def schedule_reminder(ctx: ActionContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    fire_at = params.get("at") or datetime.utcnow() + timedelta(minutes=params["in_minutes"])
+    with Session(engine) as session:
+        task = _task_for(ctx, session, params.get("task_id") or ctx.task_id)
+        alarm = reminders.get_settings(session, ctx.user_id).alarm_enabled
+        result = {"task_id": task.id, "due_at": fire_at, "alarm_enabled": alarm,
+                  "message": f"『{task.title}』を{fire_at:%m/%d %H:%M}(UTC)にお知らせするね" + ("" if alarm else "（鬼電モードがオフだよ）")}
+        if ctx.dry_run or ctx.cancel.cancelled:
+            return result
+        task.due_at = fire_at
+        sync.stamp(session, task, ctx.user_id)
+        session.add(task)
+        reminders.schedule_task(session, task)
+        session.commit()
+        session.refresh(task)
+        events.publish_change(ctx.user_id, "task", task)
+    return result
+
+
+def _validate_webhook(params):
+    out: Dict[str, Any] = {"url": _http_url(params["url"], "url") if params.get("url") else None}
+    event = params.get("event")
+    if event is not None and not isinstance(event, dict):
+        raise ActionError("event must be an object")
+    out["event"] = event
+    return out
+
+
+@register("call_webhook", "Send an event to a webhook (the user's configured one by default).",
+          {"url": "optional http(s) URL", "event": "optional JSON object"}, validate=_validate_webhook)
+def call_webhook(ctx: ActionContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    with Session(engine) as session:
+        url = params["url"] or reminders.get_settings(session, ctx.user_id).webhook_url
+        if not url:
+            raise ActionError("no url given and no webhook configured")
+        event = params["event"] or {"type": "sista.first_step", "task_id": ctx.task_id}
+        if ctx.dry_run or ctx.cancel.cancelled:
+            return {"destination": webhooks.destination_of(url), "event": event, "message": "送信内容を確認したよ"}
+        # through the outbox: delivery (and its retries) happen on the webhook dispatcher
+        delivery = webhooks.enqueue(session, ctx.user_id, url, event)
+        session.commit()
+        return {"delivery_id": delivery.id, "destination": delivery.destination, "message": "Webhookに送ったよ"}
+
+
+async def watch(user_id: int, sub, run_id: int, timeout: float) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield the run on every transition, from a bus subscription taken before submit(), until it
+    is terminal or `timeout` passes.
+    """
+    _, queue = sub
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        try:
+            event = await asyncio.wait_for(queue.get(), remaining)
+        except asyncio.TimeoutError:
+            return
+        if event.get("type") == "resync":
+            # our subscription overflowed; read the current state instead
+            data = await run_in_threadpool(_load, user_id, run_id)
+        elif event.get("type") == "action.run" and event.get("id") == run_id:
+            data = event["data"]
+        else:
+            continue
+        if data is None:
+            return
+        yield data
+        if data["status"] in TERMINAL:
+            return
+
+
+def _load(user_id: int, run_id: int) -> Optional[Dict[str, Any]]:
+    with Session(engine) as session:
+        run = session.get(ActionRun, run_id)
+        if run is None or run.user_id != user_id:
+            return None
+        return _plain(run)
+
+
+def _plain(run: ActionRun) -> Dict[str, Any]:
+    # JSON-safe (datetimes as strings), as it also goes through NOTIFY and the WebSocket
+    return json.loads(json.dumps(run_dict(run), default=str))
@@ -0,0 +1,133 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from llm_scheduler import scheduler, PRIORITY_NAMES
+from shared_state import RateLimiter
+
+# Shed a request when this many calls are already waiting at its priority or above
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "32"))
+# ...or when the estimated queue wait exceeds this (or the client's own deadline)
+LLM_MAX_QUEUE_WAIT = float(os.environ.get("LLM_MAX_QUEUE_WAIT", "60"))
+# how often a running request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.25
+# LLM requests per user (or client address) per LLM_RATE_WINDOW seconds, counted across all
+# workers through shared_state; 0 disables the limit
+LLM_RATE_LIMIT = int(os.environ.get("LLM_RATE_LIMIT", "0"))
+LLM_RATE_WINDOW = int(os.environ.get("LLM_RATE_WINDOW", "60"))
+
+rate_limiter = RateLimiter("llm", LLM_RATE_LIMIT, LLM_RATE_WINDOW) if LLM_RATE_LIMIT > 0 else None
+
+
+class CancelToken:
+    """Set when the client went away; callbacks abort work already in progress (e.g. close sockets)."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def add_callback(self, fn: Callable[[], None]):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception:
+                pass
+
+
+def deadline_from_headers(request: Request) -> Optional[float]:
+    """
+    Client deadline as a time.monotonic() value. Clients send either X-Request-Timeout (seconds
+    they are willing to wait) or X-Request-Deadline (absolute unix time).
+    """
+    timeout = request.headers.get("x-request-timeout")
+    if timeout:
+        try:
+            return time.monotonic() + float(timeout)
+        except ValueError:
+            pass
+    deadline = request.headers.get("x-request-deadline")
+    if deadline:
+        try:
+            return time.monotonic() + (float(deadline) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+def rate_subject(request: Request, user_id: Optional[int]) -> str:
+    """Who a request counts against for LLM_RATE_LIMIT: the user, or the client address if anonymous."""
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def overloaded(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def admit(priority: int, deadline: Optional[float], subject: Any = None):
+    """
+    Reject up front: 429 + Retry-After once `subject` (user id or client address) is over
+    LLM_RATE_LIMIT, 503 + Retry-After if the request would queue too long to be useful.
+    """
+    if rate_limiter is not None and subject is not None:
+        allowed, reset = rate_limiter.hit(subject)
+        if not allowed:
+            scheduler.record_rejected(priority)
+            raise HTTPException(status_code=429, detail=f"LLM rate limit of {LLM_RATE_LIMIT} requests per {LLM_RATE_WINDOW}s exceeded",
+                                headers={"Retry-After": str(max(1, reset))})
+    ahead = scheduler.queue_depth_at_or_above(priority)
+    estimate = scheduler.estimate_wait(priority)
+    name = PRIORITY_NAMES[priority]
+    if ahead >= LLM_MAX_QUEUE:
+        scheduler.record_rejected(priority)
+        raise overloaded(f"LLM queue full ({ahead} waiting for {name})", estimate)
+    budget = LLM_MAX_QUEUE_WAIT
+    if deadline is not None:
+        budget = min(budget, deadline - time.monotonic())
+    if estimate > budget:
+        scheduler.record_rejected(priority)
+        raise overloaded(f"Estimated LLM wait {estimate:.1f}s exceeds budget {max(budget, 0):.1f}s", estimate)
+
+
+async def run_until_disconnect(request: Request, fn: Callable[[], object], cancel: CancelToken):
+    """
+    Run blocking fn in the threadpool while watching the client connection. On disconnect the
+    cancel token fires so queued work is withdrawn and in-flight upstream calls are aborted.
+    """
+    task = asyncio.ensure_future(run_in_threadpool(fn))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                cancel.cancel()
+                # 499-style: nobody is listening, the status is only for logs
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        if not task.done():
+            cancel.cancel()
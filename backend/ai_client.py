@@ -1,6 +1,64 @@
 import os
+import socket
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Optional, Any, Dict, List
+from llm_scheduler import scheduler, cluster_slots, INTERACTIVE, PRIORITY_NAMES
+from hedging import hedger
+import llm_profiles
+from model_router import router
+
+
+def _abortable(connection_cls, cancel):
+    """connection_cls whose socket is shut down when `cancel` fires."""
+    class AbortableConnection(connection_cls):
+        def connect(self):
+            super().connect()
+            cancel.add_callback(self.abort)
+
+        def abort(self):
+            # shutdown (unlike close) wakes a recv blocked in another thread, so the request fails at once
+            sock = self.sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+    return AbortableConnection
+
+
+class _CancellableAdapter(HTTPAdapter):
+    def __init__(self, cancel):
+        self._cancel = cancel
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(pool.__name__, (pool,), {"ConnectionCls": _abortable(pool.ConnectionCls, self._cancel)})
+            for scheme, pool in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+
+class _CancellableSession(requests.Session):
+    """
+    A session whose in-flight requests are aborted when `cancel` fires. Once cancelled, every
+    further attempt fails fast instead of trying the next endpoint/shape.
+    """
+
+    def __init__(self, cancel):
+        super().__init__()
+        self.cancel = cancel
+        adapter = _CancellableAdapter(cancel)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, *args, **kwargs):
+        if self.cancel.cancelled:
+            raise requests.exceptions.ConnectionError("cancelled: client disconnected")
+        return super().request(*args, **kwargs)
 
 
 def call_llm(
@@ -11,12 +69,111 @@ def call_llm(
     over_hallucination: bool = False,
     compressed_memory: Optional[Dict[str, Any]] = None,
     timeout: int = 30,
+    priority: int = INTERACTIVE,
+    deadline: Optional[float] = None,
+    cancel=None,
+    profile: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Centralized LLM call. Waits for a slot in the priority scheduler (interactive > decomposition >
+    background, fair across users), and for a cluster-wide slot if LLM_MAX_INFLIGHT_TOTAL is set,
+    before hitting the upstream. Queue wait is reported in debug_info.
+    `deadline` (time.monotonic()) drops the call if it is still queued when the client stops waiting;
+    `cancel` (admission.CancelToken) withdraws it or aborts the upstream request on disconnect.
+    Dropped calls return {"error": ..., "dropped": True}.
+    `profile` (see llm_profiles) adds per-operation instructions, output format and limits.
+    The model is picked per call by model_router (small/large tier).
+    """
+    model, reason = router.choose(text, history, priority, profile)
+    enqueued = time.monotonic()
+    queue_timeout = None if deadline is None else deadline - enqueued
+    if not scheduler.acquire(priority, user_id if user_id is not None else "anonymous", cost=router.cost(model),
+                             timeout=queue_timeout, cancel=cancel):
+        reason = "client disconnected" if cancel is not None and cancel.cancelled else "deadline passed while queued"
+        return {"error": f"LLM request dropped: {reason}", "dropped": True}
+    slot = None
+    if cluster_slots is not None:
+        # other workers' calls count against LLM_MAX_INFLIGHT_TOTAL too
+        slot = cluster_slots.acquire(None if deadline is None else deadline - time.monotonic(), cancel)
+        if slot is None:
+            scheduler.release()
+            reason = "client disconnected" if cancel is not None and cancel.cancelled else "deadline passed while queued"
+            return {"error": f"LLM request dropped: {reason}", "dropped": True}
+    waited = time.monotonic() - enqueued
+    if deadline is not None:
+        timeout = max(1, min(timeout, int(deadline - time.monotonic()) + 1))
+
+    def attempt(lmstudio_url, token):
+        http = _CancellableSession(token) if token is not None else None
+        try:
+            return _call_llm_upstream(text, history, role_sheet, user_id, over_hallucination, compressed_memory, timeout, http=http, lmstudio_url=lmstudio_url, profile=profile, model=model)
+        finally:
+            if http is not None:
+                http.close()
+
+    started = time.monotonic()
+    released = threading.Lock()
+
+    def release(service_seconds=None):
+        # once: on cancellation the slot goes back right away (aborted calls don't count as service time)
+        if released.acquire(blocking=False):
+            scheduler.release(service_seconds)
+            if slot is not None:
+                cluster_slots.release(slot)
+
+    if cancel is not None:
+        cancel.add_callback(release)
+    try:
+        if hedger.enabled:
+            result = hedger.run(attempt, cancel)
+        else:
+            result = attempt(None, cancel)
+    finally:
+        release(time.monotonic() - started)
+    if cancel is not None and cancel.cancelled:
+        return {"error": "LLM request cancelled: client disconnected", "dropped": True}
+    if isinstance(result.get("debug_info"), dict):
+        result["debug_info"]["scheduler"] = {"priority": PRIORITY_NAMES[priority], "queue_wait_seconds": round(waited, 4)}
+        result["debug_info"]["model"] = {"name": model, "reason": reason}
+    return result
+
+
+def _post_chat(http, path: str, build, settings, model: str, timeout: int, headers=None):
+    """
+    POST an OpenAI-style chat payload built by build(mode) for the profile's output mode. If the
+    upstream refuses the response_format (400/422), retry once without it and remember that.
+    Returns (response, payload used).
+    """
+    mode = llm_profiles.response_format(settings, path, model)
+    payload = build(mode)
+    r = http.post(path, json=payload, headers=headers, timeout=timeout)
+    if r.status_code in (400, 422) and mode != "none":
+        payload = build("none")
+        r = http.post(path, json=payload, headers=headers, timeout=timeout)
+        if r.status_code in (200, 201):
+            llm_profiles.mark_unsupported(path, model)
+    return r, payload
+
+
+def _call_llm_upstream(
+    text: str,
+    history: Optional[List[Dict[str, Any]]] = None,
+    role_sheet: Optional[Dict[str, Any]] = None,
+    user_id: Optional[int] = None,
+    over_hallucination: bool = False,
+    compressed_memory: Optional[Dict[str, Any]] = None,
+    timeout: int = 30,
+    http=None,
+    lmstudio_url: Optional[str] = None,
+    profile: Optional[str] = None,
+    model: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Centralized LLM call. Tries LMStudio (local) first if LMSTUDIO_URL is set, otherwise falls back to OpenAI if OPENAI_API_KEY is present.
     Returns a normalized dict with keys: response (str), debug_info (dict), compressed_memory (optional)
     """
-    LMSTUDIO_URL = os.environ.get("LMSTUDIO_URL")
+    http = http or requests
+    LMSTUDIO_URL = lmstudio_url or os.environ.get("LMSTUDIO_URL")
     OPENAI_KEY = os.environ.get("OPENAI_API_KEY")
 
     # Helper to build LMStudio payload
@@ -37,11 +194,13 @@ def call_llm(
                 pass
         return payload
 
+    model = model or os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+    settings = llm_profiles.resolve(profile, model)
+
     # Try LMStudio/local LLM first
     if LMSTUDIO_URL:
         # If user provided a full OpenAI-style path, prefer OpenAI-style payload (model/messages)
-        def _openai_payload():
-            model = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+        def _openai_payload(mode):
             messages = []
             if role_sheet and isinstance(role_sheet, dict):
                 tone = role_sheet.get("tone")
@@ -54,7 +213,7 @@ def call_llm(
                     messages.append({"role": role, "content": content})
             messages.append({"role": "user", "content": text})
             payload = {"model": model, "messages": messages, "temperature": float(os.environ.get("OPENAI_TEMPERATURE", "0.7"))}
-            return payload
+            return llm_profiles.apply(payload, settings, mode)
 
         # Build candidate endpoints: prefer exact LMSTUDIO_URL; if it doesn't look like a chat/completions path, try adding it
         candidate_paths = [LMSTUDIO_URL]
@@ -63,10 +222,9 @@ def call_llm(
 
         # First try OpenAI-style payloads (many modern proxies accept this)
         last_exc = None
-        openai_payload = _openai_payload()
         for path in candidate_paths:
             try:
-                r = requests.post(path, json=openai_payload, timeout=timeout)
+                r, openai_payload = _post_chat(http, path, _openai_payload, settings, model, timeout)
                 if r.status_code in (200, 201):
                     try:
                         data = r.json()
@@ -95,6 +253,10 @@ def call_llm(
                 continue
 
         # If OpenAI-style attempts failed, fall back to simpler shapes (input/text/messages)
+        prefix = llm_profiles.instruction(settings, "none") if settings else None
+        if prefix:
+            # no system message in these shapes; the instruction goes in front of the text
+            text = f"{prefix}\n\n{text}"
         payload_shapes = []
         payload_shapes.append(_build_lm_payload())
         payload_shapes.append({"prompt": text})
@@ -105,7 +267,7 @@ def call_llm(
         for path in candidate_paths:
             for payload in payload_shapes:
                 try:
-                    r = requests.post(path, json=payload, timeout=timeout)
+                    r = http.post(path, json=payload, timeout=timeout)
                     if r.status_code not in (200, 201):
                         last_exc = (path, r.status_code, r.text)
                         continue
@@ -137,7 +299,6 @@ def call_llm(
     # Fallback to OpenAI
     if OPENAI_KEY:
         try:
-            model = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
             messages = []
             if role_sheet and isinstance(role_sheet, dict):
                 tone = role_sheet.get("tone")
@@ -152,7 +313,8 @@ def call_llm(
 
             payload = {"model": model, "messages": messages, "temperature": float(os.environ.get("OPENAI_TEMPERATURE", "0.7"))}
             headers = {"Authorization": f"Bearer {OPENAI_KEY}", "Content-Type": "application/json"}
-            r = requests.post("https://api.openai.com/v1/chat/completions", json=payload, headers=headers, timeout=timeout)
+            r, payload = _post_chat(http, "https://api.openai.com/v1/chat/completions",
+                                    lambda mode: llm_profiles.apply(payload, settings, mode), settings, model, timeout, headers=headers)
             r.raise_for_status()
             data = r.json()
             assistant_text = ""
@@ -166,3 +328,26 @@ def call_llm(
             return {"error": f"OpenAI request failed: {e}"}
 
     return {"error": "No LLM configured. Set LMSTUDIO_URL or OPENAI_API_KEY on the server."}
+
+
+def warmup(timeout: int = 120) -> Dict[str, Any]:
+    """
+    Send a one-token completion to each configured local upstream (LMSTUDIO_URL and the hedge
+    URL) so the model is loaded before real traffic. Bypasses the scheduler; hosted OpenAI
+    needs no warmup and is skipped. Returns {url: seconds or error string}.
+    """
+    from hedging import LMSTUDIO_HEDGE_URL
+    results: Dict[str, Any] = {}
+    for url in filter(None, [os.environ.get("LMSTUDIO_URL"), LMSTUDIO_HEDGE_URL]):
+        path = url if url.rstrip('/').endswith('/v1/chat/completions') else url.rstrip('/') + '/v1/chat/completions'
+        # every tier, so neither the first short nor the first long chat pays the model load
+        for model in router.models:
+            payload = {"model": model, "messages": [{"role": "user", "content": "hi"}], "max_tokens": 1, "temperature": 0}
+            key = url if len(router.models) == 1 else f"{url} {model}"
+            started = time.monotonic()
+            try:
+                r = requests.post(path, json=payload, timeout=timeout)
+                results[key] = round(time.monotonic() - started, 3) if r.status_code in (200, 201) else f"HTTP {r.status_code}"
+            except requests.exceptions.RequestException as e:
+                results[key] = str(e)
+    return results
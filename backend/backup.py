@@ -0,0 +1,264 @@
+"""
+NDJSON export/import of a user's tasks and chats. Exports stream rows off a server-side cursor
+and imports are applied in fixed-size batches, so memory stays flat however large the account is.
+
+Format: one JSON object per line. The first line is {"type": "meta", ...}; every other line is
+{"type": "task" | "chat", ...columns}. Import accepts the same format (plain or gzip).
+"""
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from sqlalchemy import select as sa_select
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+
+import migrations
+import reminders
+import search
+import sync
+import task_stats
+from db import engine
+from models import ChatMessage, ImportKey, Task
+from serialization import dumps_json
+from shared_state import JobStatus, state
+
+EXPORT_FORMAT = 1
+# rows fetched per round trip from the server-side cursor
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "1000"))
+# rows per import transaction
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_LINE_BYTES = 1 << 20
+# cap on the (decompressed) upload, so a small gzip bomb can't expand without bound
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", str(256 << 20)))
+_CHUNK_BYTES = 64 * 1024
+_ENTITIES = (("task", Task), ("chat", ChatMessage))
+
+import_jobs = JobStatus("import", ttl=24 * 3600)
+
+
+_deployment: Dict[str, str] = {}
+
+
+def _source(user_id: int) -> str:
+    # the deployment id keeps user 1 of one server apart from user 1 of another
+    if "id" not in _deployment:
+        _deployment["id"] = migrations.deployment_id(engine)
+    return f"sista:{_deployment['id']}:user:{user_id}"
+
+
+def _export_lines(user_id: int) -> Iterator[bytes]:
+    yield dumps_json({"type": "meta", "format": EXPORT_FORMAT, "source": _source(user_id),
+                      "exported_at": datetime.utcnow()}) + b"\n"
+    with engine.connect() as conn:
+        # stream_results: named cursor on Postgres, so rows arrive EXPORT_FETCH_SIZE at a time
+        conn = conn.execution_options(stream_results=True, yield_per=EXPORT_FETCH_SIZE)
+        for entity, model in _ENTITIES:
+            table = model.__table__
+            result = conn.execute(sa_select(table).where(table.c.user_id == user_id).order_by(table.c.id))
+            for row in result:
+                yield dumps_json({"type": entity, **row._mapping}) + b"\n"
+
+
+def export_stream(user_id: int, compress: bool = False) -> Iterator[bytes]:
+    """NDJSON bytes in ~64 KiB chunks, optionally as one gzip member."""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buf: List[bytes] = []
+    size = 0
+    for line in _export_lines(user_id):
+        buf.append(line)
+        size += len(line)
+        if size >= _CHUNK_BYTES:
+            chunk = b"".join(buf)
+            buf, size = [], 0
+            chunk = gz.compress(chunk) if gz else chunk
+            if chunk:
+                yield chunk
+    chunk = b"".join(buf)
+    if gz:
+        chunk = gz.compress(chunk) + gz.flush()
+    if chunk:
+        yield chunk
+
+
+def _inflate(inflate, chunk: bytes) -> Iterator[bytes]:
+    """Decompress at most _CHUNK_BYTES at a time, so the size cap is checked as the output grows."""
+    while chunk:
+        out = inflate.decompress(chunk, _CHUNK_BYTES)
+        chunk = inflate.unconsumed_tail
+        if out:
+            yield out
+
+
+async def _read_ndjson(request: Request) -> AsyncIterator[Tuple[int, bytes]]:
+    encoding = request.headers.get("content-encoding", "").lower()
+    # wbits 47: accept gzip or zlib framing
+    inflate = zlib.decompressobj(47) if encoding in ("gzip", "deflate") else None
+    pending = b""
+    lineno = 0
+    total = 0
+    async for chunk in request.stream():
+        for piece in (_inflate(inflate, chunk) if inflate is not None else (chunk,)):
+            total += len(piece)
+            if total > IMPORT_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Import exceeds {IMPORT_MAX_BYTES} bytes")
+            pending += piece
+            *lines, pending = pending.split(b"\n")
+            if len(pending) > IMPORT_MAX_LINE_BYTES:
+                raise HTTPException(status_code=413, detail=f"Line {lineno + len(lines) + 1} exceeds {IMPORT_MAX_LINE_BYTES} bytes")
+            for line in lines:
+                lineno += 1
+                yield lineno, line
+    if inflate is not None:
+        pending += inflate.flush()
+    if pending.strip():
+        yield lineno + 1, pending
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def _due_at(item: Dict[str, Any]) -> Optional[datetime]:
+    # exported due_at is already UTC; only a bare due_date is in the user's local time
+    if item.get("due_at"):
+        return reminders.parse_due(item["due_at"], tz=timezone.utc)
+    return reminders.parse_due(item.get("due_date"))
+
+
+def _build_row(user_id: int, item: Dict[str, Any]):
+    created_at = _parse_datetime(item.get("created_at")) or datetime.utcnow()
+    if item["type"] == "task":
+        if not item.get("title"):
+            raise ValueError("task without title")
+        return Task(title=str(item["title"]), status=item.get("status") or "pending", category=item.get("category"),
+                    due_date=item.get("due_date"), due_at=_due_at(item),
+                    created_at=created_at, user_id=user_id)
+    if item.get("message") is None:
+        raise ValueError("chat without message")
+    return ChatMessage(message=str(item["message"]), reply=item.get("reply"), created_at=created_at, user_id=user_id)
+
+
+def _existing_ids(session: Session, user_id: int, batch: List[Tuple[int, Optional[str], Dict[str, Any]]]) -> set:
+    """(type, id) of the batch's rows that are still in the account, for re-importing one's own export."""
+    found = set()
+    for entity, model in _ENTITIES:
+        ids = [item["id"] for _, _, item in batch if item["type"] == entity and isinstance(item.get("id"), int)]
+        if ids:
+            rows = session.exec(select(model.id).where(model.user_id == user_id, model.id.in_(ids))).all()
+            found.update((entity, i) for i in rows)
+    return found
+
+
+def _apply_batch(user_id: int, batch: List[Tuple[int, Optional[str], Dict[str, Any]]], summary: Dict[str, Any],
+                 own_export: bool = False):
+    """
+    Insert one batch in a single transaction; rows whose key was already imported are skipped, and
+    so are rows of the user's own export that still exist under their original id.
+    """
+    keys = [key for _, key, _ in batch if key]
+    with Session(engine) as session:
+        seen = set(session.exec(select(ImportKey.key).where(ImportKey.user_id == user_id, ImportKey.key.in_(keys))).all()) if keys else set()
+        existing = _existing_ids(session, user_id, batch) if own_export else set()
+        created = []
+        for lineno, key, item in batch:
+            if (key and key in seen) or (item["type"], item.get("id")) in existing:
+                summary["skipped"] += 1
+                continue
+            try:
+                row = _build_row(user_id, item)
+            except (KeyError, ValueError) as e:
+                summary["errors"] += 1
+                if len(summary["error_samples"]) < 10:
+                    summary["error_samples"].append({"line": lineno, "error": str(e)})
+                continue
+            if key:
+                seen.add(key)
+            created.append((key, item["type"], row))
+        if not created:
+            return
+        # one counter bump per batch: /sync clients pick up the whole batch at once
+        version = sync.next_change_version(session, user_id)
+        now = datetime.utcnow()
+        for _, entity, row in created:
+            row.change_version = version
+            row.updated_at = now
+            if entity == "task":
+                task_stats.record(session, user_id, after=row)
+            session.add(row)
+        session.flush()
+        settings = reminders.get_settings(session, user_id)
+        for key, entity, row in created:
+            if key:
+                session.add(ImportKey(user_id=user_id, key=key, entity=entity, entity_id=row.id))
+            search.index_row(session, entity, row)
+            if entity == "task":
+                reminders.schedule_task(session, row, settings)
+        session.commit()
+        summary["imported"] += len(created)
+
+
+async def import_stream(request: Request, user_id: int, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Consume an NDJSON upload and apply it in IMPORT_BATCH_SIZE transactions. Each row gets an
+    idempotency key ("key" field, or source + type + id from an export), so re-uploading after a
+    failure only adds what is missing. Importing one's own export (same user of this deployment)
+    skips rows that still exist. An Idempotency-Key header additionally replays the summary of a
+    finished import without reading the body again.
+    """
+    job_id = f"{user_id}:{idempotency_key}" if idempotency_key else None
+    if job_id:
+        previous = import_jobs.get(job_id)
+        if previous and previous.get("status") == "done":
+            return dict(previous["summary"], replayed=True)
+        if not state.add(f"import-lock:{job_id}", True, ttl=3600):
+            raise HTTPException(status_code=409, detail="An import with this Idempotency-Key is already running")
+        import_jobs.set(job_id, "running")
+    summary: Dict[str, Any] = {"imported": 0, "skipped": 0, "errors": 0, "error_samples": [], "lines": 0}
+    source = None
+    own_source = _source(user_id)
+    batch: List[Tuple[int, Optional[str], Dict[str, Any]]] = []
+    try:
+        async for lineno, line in _read_ndjson(request):
+            if not line.strip():
+                continue
+            summary["lines"] += 1
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            if not isinstance(item, dict) or item.get("type") not in ("meta", "task", "chat"):
+                summary["errors"] += 1
+                if len(summary["error_samples"]) < 10:
+                    summary["error_samples"].append({"line": lineno, "error": "not a task/chat/meta object"})
+                continue
+            if item["type"] == "meta":
+                source = item.get("source")
+                continue
+            key = item.get("key")
+            if not key and source and item.get("id") is not None:
+                key = f"{source}:{item['type']}:{item['id']}"
+            batch.append((lineno, str(key) if key else None, item))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await run_in_threadpool(_apply_batch, user_id, batch, summary, source == own_source)
+                batch = []
+        if batch:
+            await run_in_threadpool(_apply_batch, user_id, batch, summary, source == own_source)
+    except Exception:
+        if job_id:
+            import_jobs.set(job_id, "failed", summary=summary)
+        raise
+    finally:
+        if job_id:
+            state.delete(f"import-lock:{job_id}")
+    if job_id:
+        import_jobs.set(job_id, "done", summary=summary)
+    return summary
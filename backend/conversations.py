@@ -0,0 +1,114 @@
+"""
+Chat threads. Every turn gets the next `seq` of its Conversation, and the LLM context for a turn
+is read with one range scan on (conversation_id, seq) over the last CHAT_CONTEXT_TURNS turns, so
+it costs the same however many chats the user has.
+
+Signed-in users' turns are ChatMessage rows, so /chats, /sync, search and export keep seeing
+them. Anonymous threads are keyed by an unguessable session key instead of a user, keep their
+turns in AnonymousMessage and are pruned once idle for ANON_CHAT_TTL_HOURS.
+"""
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from models import AnonymousMessage, ChatMessage, Conversation
+import search
+import sync
+
+CHAT_CONTEXT_TURNS = int(os.environ.get("CHAT_CONTEXT_TURNS", "10"))
+ANON_CHAT_TTL_HOURS = float(os.environ.get("ANON_CHAT_TTL_HOURS", "24"))
+_TITLE_CHARS = 80
+_PRUNE_BATCH = 200
+
+
+def find(session: Session, user_id: Optional[int], conversation_id: Optional[int] = None,
+         session_key: Optional[str] = None) -> Optional[Conversation]:
+    """
+    The caller's existing thread, or None to start a new one. A user asking for someone else's
+    (or an unknown) thread gets 404; an expired anonymous key simply starts over.
+    """
+    if user_id:
+        if conversation_id is None:
+            return None
+        conv = session.get(Conversation, conversation_id)
+        if conv is None or conv.user_id != user_id:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return conv
+    if not session_key:
+        return None
+    return session.exec(select(Conversation).where(Conversation.session_key == session_key)).first()
+
+
+def _turns(conv: Conversation):
+    return ChatMessage if conv.user_id else AnonymousMessage
+
+
+def context(session: Session, conv: Optional[Conversation], turns: int = CHAT_CONTEXT_TURNS) -> List[Dict[str, Any]]:
+    """The thread's last `turns` exchanges as OpenAI-style history, oldest first."""
+    if conv is None or not conv.last_seq:
+        return []
+    model = _turns(conv)
+    rows = session.exec(
+        select(model).where(model.conversation_id == conv.id, model.seq > conv.last_seq - turns).order_by(model.seq)
+    ).all()
+    history: List[Dict[str, Any]] = []
+    for row in rows:
+        history.append({"role": "user", "content": row.message})
+        if row.reply:
+            history.append({"role": "assistant", "content": row.reply})
+    return history
+
+
+def prune_anonymous(session: Session) -> int:
+    """Delete up to _PRUNE_BATCH anonymous threads idle for longer than ANON_CHAT_TTL_HOURS."""
+    cutoff = datetime.utcnow() - timedelta(hours=ANON_CHAT_TTL_HOURS)
+    ids = session.exec(
+        select(Conversation.id).where(Conversation.session_key.is_not(None), Conversation.updated_at < cutoff).limit(_PRUNE_BATCH)
+    ).all()
+    if ids:
+        session.execute(delete(AnonymousMessage).where(AnonymousMessage.conversation_id.in_(ids)))
+        session.execute(delete(Conversation).where(Conversation.id.in_(ids)))
+    return len(ids)
+
+
+def append(session: Session, user_id: Optional[int], conversation_id: Optional[int], message: str,
+           reply: Optional[str]) -> Dict[str, Any]:
+    """
+    Store one turn at the end of a thread (a new one if conversation_id is None). The thread row
+    is locked until the caller commits, so concurrent turns get consecutive seqs.
+    Returns {"conversation": Conversation, "row": ChatMessage | AnonymousMessage}.
+    """
+    now = datetime.utcnow()
+    conv = None
+    if conversation_id is not None:
+        # None if an anonymous thread was pruned while its reply was being generated
+        conv = session.exec(select(Conversation).where(Conversation.id == conversation_id).with_for_update()).first()
+    if conv is None:
+        if not user_id:
+            prune_anonymous(session)
+        conv = Conversation(user_id=user_id or None, session_key=None if user_id else secrets.token_urlsafe(24),
+                            title=message[:_TITLE_CHARS], created_at=now)
+        session.add(conv)
+        session.flush()
+    conv.last_seq += 1
+    conv.updated_at = now
+    session.add(conv)
+    if user_id:
+        row = ChatMessage(user_id=user_id, message=message, reply=reply, conversation_id=conv.id, seq=conv.last_seq, created_at=now)
+        sync.stamp(session, row, user_id)
+        session.add(row)
+        session.flush()
+        search.index_row(session, "chat", row)
+    else:
+        row = AnonymousMessage(conversation_id=conv.id, seq=conv.last_seq, message=message, reply=reply, created_at=now)
+        session.add(row)
+    return {"conversation": conv, "row": row}
+
+
+def summary(conv: Conversation) -> Dict[str, Any]:
+    return {"id": conv.id, "title": conv.title, "turns": conv.last_seq, "created_at": conv.created_at, "updated_at": conv.updated_at}
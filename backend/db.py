@@ -0,0 +1,70 @@
+import logging
+import os
+import random
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import create_engine
+
+logger = logging.getLogger("sista.db")
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+# Fallback to a local sqlite file if DATABASE_URL not provided. This makes local dev easier
+if not DATABASE_URL:
+    DATABASE_URL = "sqlite:///./sista_dev.db"
+
+# per-worker pool; keep WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) under the server's max_connections
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+# how long startup keeps retrying the first DB connection
+DB_CONNECT_TIMEOUT = float(os.environ.get("DB_CONNECT_TIMEOUT", os.environ.get("WAIT_FOR_DB_TIMEOUT", "60")))
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+else:
+    engine = create_engine(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True)
+
+
+def connect_with_backoff(timeout: float = DB_CONNECT_TIMEOUT, initial: float = 0.1, maximum: float = 5.0):
+    """
+    Block until the database answers SELECT 1, retrying with exponential backoff plus jitter.
+    Replaces the external wait-for-db step: the first attempt usually succeeds, and a DB that
+    is still starting is probed quickly at first instead of on a fixed 1 s tick.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial
+    while True:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return
+        except OperationalError as e:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise
+            logger.info("database not ready (%s), retrying in %.2fs", e.__class__.__name__, delay)
+            time.sleep(min(remaining, delay * random.uniform(0.5, 1.0)))
+            delay = min(maximum, delay * 2)
+
+
+def migrate() -> int:
+    """Wait for the database and apply pending schema migrations; returns the schema version."""
+    from migrations import upgrade
+    connect_with_backoff()
+    return upgrade(engine)
+
+
+def warm_pool(connections: int = None):
+    """Open pool connections up front so a fresh worker's first requests don't pay connect latency."""
+    if DATABASE_URL.startswith("sqlite"):
+        connections = 1
+    conns = []
+    try:
+        for _ in range(connections or DB_POOL_SIZE):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            conns.append(conn)
+    finally:
+        for conn in conns:
+            conn.close()
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, Optional, Set, Tuple
+
+# Per-connection buffer. A client that falls this far behind gets a "resync" event instead of
+# the dropped changes and should call GET /sync with its last version.
+QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "256"))
+PG_CHANNEL = os.environ.get("EVENTS_PG_CHANNEL", "sista_events")
+# NOTIFY payloads are limited to 8000 bytes; bigger events are sent without their row data
+PG_PAYLOAD_LIMIT = 7900
+
+
+class EventBus:
+    """
+    In-process pub/sub of task/chat change events, keyed by user id.
+    publish() is thread-safe and may be called from sync endpoints running in the threadpool;
+    delivery happens on the event loop that owns each subscriber queue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self.worker_id = uuid.uuid4().hex
+        self._bridge: Optional["PgNotifyBridge"] = None
+
+    def subscribe(self, user_id: int) -> Tuple[asyncio.AbstractEventLoop, asyncio.Queue]:
+        sub = (asyncio.get_running_loop(), asyncio.Queue(maxsize=QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, user_id: int, sub):
+        with self._lock:
+            subs = self._subscribers.get(user_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[user_id]
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, user_id: int, event: Dict[str, Any]):
+        self.dispatch_local(user_id, event)
+        if self._bridge:
+            self._bridge.notify(user_id, event)
+
+    def dispatch_local(self, user_id: int, event: Dict[str, Any]):
+        with self._lock:
+            subs = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subs:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # loop already closed; the connection is going away
+                pass
+
+    def attach_bridge(self, bridge: "PgNotifyBridge"):
+        self._bridge = bridge
+
+
+def _offer(queue: asyncio.Queue, event: Dict[str, Any]):
+    if queue.full():
+        # drop the backlog and tell the client to catch up through /sync
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait({"type": "resync"})
+        return
+    queue.put_nowait(event)
+
+
+class PgNotifyBridge:
+    """
+    Fans events out across worker processes with Postgres LISTEN/NOTIFY. Each worker publishes
+    locally first and NOTIFYs the others; the listener thread ignores its own notifications.
+    """
+
+    def __init__(self, bus: EventBus, dsn: str):
+        self.bus = bus
+        self.dsn = dsn
+        self._send_lock = threading.Lock()
+        self._send_conn = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(0)  # autocommit, required for LISTEN and immediate NOTIFY
+        return conn
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen, name="pg-notify-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def notify(self, user_id: int, event: Dict[str, Any]):
+        payload = json.dumps({"origin": self.bus.worker_id, "user_id": user_id, "event": event}, default=str)
+        if len(payload.encode("utf-8")) > PG_PAYLOAD_LIMIT:
+            slim = {k: v for k, v in event.items() if k != "data"}
+            payload = json.dumps({"origin": self.bus.worker_id, "user_id": user_id, "event": slim}, default=str)
+        with self._send_lock:
+            try:
+                if self._send_conn is None or self._send_conn.closed:
+                    self._send_conn = self._connect()
+                with self._send_conn.cursor() as cur:
+                    cur.execute("SELECT pg_notify(%s, %s)", (PG_CHANNEL, payload))
+            except Exception:
+                # fan-out is best effort; clients on other workers recover through /sync
+                self._send_conn = None
+
+    def _listen(self):
+        import select
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {PG_CHANNEL}")
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        try:
+                            msg = json.loads(note.payload)
+                        except ValueError:
+                            continue
+                        if msg.get("origin") == self.bus.worker_id:
+                            continue
+                        self.bus.dispatch_local(int(msg["user_id"]), msg["event"])
+            except Exception:
+                self._stop.wait(2)
+            finally:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+bus = EventBus()
+
+
+def publish_change(user_id: int, entity: str, row=None, entity_id: Optional[int] = None, version: Optional[int] = None):
+    """Publish '<entity>.upsert' with the row, or '<entity>.delete' when only entity_id is given."""
+    from fastapi.encoders import jsonable_encoder
+    if row is not None:
+        event = {"type": f"{entity}.upsert", "id": row.id, "version": row.change_version, "data": jsonable_encoder(row)}
+    else:
+        event = {"type": f"{entity}.delete", "id": entity_id, "version": version}
+    bus.publish(user_id, event)
+
+
+def start_pg_bridge(database_url: str) -> Optional[PgNotifyBridge]:
+    """Enable cross-worker fan-out when EVENTS_PG_NOTIFY is set and the DB is Postgres."""
+    if os.environ.get("EVENTS_PG_NOTIFY", "").lower() not in ("1", "true", "yes"):
+        return None
+    if not database_url.startswith("postgres"):
+        return None
+    bridge = PgNotifyBridge(bus, database_url.replace("postgresql+psycopg2://", "postgresql://"))
+    bus.attach_bridge(bridge)
+    bridge.start()
+    return bridge
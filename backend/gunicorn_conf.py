@@ -0,0 +1,40 @@
+"""
+gunicorn settings for the multi-worker launch mode (used when WEB_CONCURRENCY > 1, see start.sh).
+Shared state between workers goes through SHARED_STATE_BACKEND=sql and EVENTS_PG_NOTIFY=1.
+
+With the sql backend these hold across all workers: LLM_RATE_LIMIT per user, the
+LLM_MAX_INFLIGHT_TOTAL cap on concurrent upstream calls, single-flight of identical /ai/todos
+prompts, repeats of cached decompositions and job status. The priority/fair queue itself
+(LLM_MAX_INFLIGHT, LLM_MAX_QUEUE, the wait estimate) and near-duplicate matching in the semantic
+cache stay per worker; set LLM_MAX_INFLIGHT_TOTAL to what the model server can run in parallel.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.environ.get("WORKER_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+# no preload: the app and its event loop are built in each worker, and warmup runs in each
+# worker's startup handler. The master has already imported db for the migration though, so
+# workers inherit that module and its engine; on_starting and post_fork make sure none of its
+# pooled connections cross the fork.
+preload_app = False
+
+
+def on_starting(server):
+    # migrate once in the master so workers don't race on DDL
+    from db import engine, migrate
+    migrate()
+    # close the migration's connections so no socket is inherited by (and shared between) workers
+    engine.dispose()
+    os.environ["SISTA_SCHEMA_READY"] = "1"
+
+
+def post_fork(server, worker):
+    # belt and braces: start the worker with an empty pool of its own, leaving any connection
+    # the master might still hold to the master (close=False doesn't touch the parent's sockets)
+    from db import engine
+    engine.dispose(close=False)
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from admission import CancelToken
+
+# Second upstream used for hedged duplicates; hedging is off unless this is set
+LMSTUDIO_HEDGE_URL = os.environ.get("LMSTUDIO_HEDGE_URL")
+# hedge once the primary is slower than this percentile of its recent latencies
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.95"))
+# delay used until enough samples are collected, and the lower bound afterwards
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "2.0"))
+# at most this fraction of calls may be duplicated
+LLM_HEDGE_BUDGET = float(os.environ.get("LLM_HEDGE_BUDGET", "0.1"))
+_MIN_SAMPLES = 20
+
+
+class Hedger:
+    """
+    Tail-latency hedging across two LLM upstreams. The primary call starts immediately; if it has
+    not answered within the recent latency percentile, a duplicate goes to the secondary and the
+    first successful answer wins. The loser's token fires, which shuts down its socket (see
+    ai_client._CancellableSession), so it gives back its hedge-pool thread and stops loading its
+    upstream at once. A token bucket refilled by `budget` per call caps the extra upstream load.
+
+    The delay is a percentile of whole-call latency rather than time to first byte: completions
+    are requested without streaming (structured output is parsed from the complete body), so the
+    upstream sends its first byte only with the finished answer and the two coincide.
+    """
+
+    def __init__(self, primary: Optional[str], secondary: Optional[str], percentile: float = LLM_HEDGE_PERCENTILE,
+                 min_delay: float = LLM_HEDGE_MIN_DELAY, budget: float = LLM_HEDGE_BUDGET):
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._tokens = 1.0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.primary and self.secondary)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=int(os.environ.get("LLM_HEDGE_THREADS", "16")), thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            if len(self._latencies) < _MIN_SAMPLES:
+                return self.min_delay
+            ordered = sorted(self._latencies)
+            value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+        return max(self.min_delay, value)
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.hedged += 1
+                return True
+            return False
+
+    @staticmethod
+    def _attempt(fn: Callable[[str, CancelToken], Dict[str, Any]], url: str, token: CancelToken):
+        started = time.monotonic()
+        return fn(url, token), time.monotonic() - started
+
+    def run(self, fn: Callable[[str, CancelToken], Dict[str, Any]], cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """
+        fn(upstream_url, cancel_token) -> call_llm-style result dict. fn must abort its HTTP call
+        when the token fires. A primary that fails outright fails over to the secondary.
+        """
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(10.0, self._tokens + self.budget)
+        tokens = {"primary": CancelToken(), "secondary": CancelToken()}
+        if cancel is not None:
+            for t in tokens.values():
+                cancel.add_callback(t.cancel)
+        pool = self._pool()
+        futures = {pool.submit(self._attempt, fn, self.primary, tokens["primary"]): "primary"}
+        done, _ = wait(futures, timeout=self.hedge_delay())
+        if not done and self._take_token():
+            futures[pool.submit(self._attempt, fn, self.secondary, tokens["secondary"])] = "secondary"
+        hedged = len(futures) > 1
+        pending = set(futures)
+        last = None
+        while pending or (last is not None and len(futures) == 1):
+            if not pending:
+                # primary errored before the hedge delay: plain failover, not charged to the budget
+                fut = pool.submit(self._attempt, fn, self.secondary, tokens["secondary"])
+                futures[fut] = "secondary"
+                pending = {fut}
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                which = futures[fut]
+                try:
+                    result, elapsed = fut.result()
+                except Exception as e:
+                    result, elapsed = {"error": f"{which} upstream failed: {e}"}, None
+                if which == "primary" and elapsed is not None and "error" not in result:
+                    with self._lock:
+                        self._latencies.append(elapsed)
+                if "error" not in result:
+                    for other, t in tokens.items():
+                        if other != which:
+                            t.cancel()
+                    if which == "secondary" and hedged:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    if isinstance(result.get("debug_info"), dict):
+                        result["debug_info"]["hedge"] = {"winner": which, "hedged": hedged, "failover": len(futures) > 1 and not hedged}
+                    return result
+                last = result
+        return last
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_seconds": round(self.hedge_delay(), 3),
+        }
+
+
+hedger = Hedger(os.environ.get("LMSTUDIO_URL"), LMSTUDIO_HEDGE_URL)
@@ -0,0 +1,128 @@
+"""
+Per-operation request profiles for call_llm: instructions, output format and sampling settings.
+
+A profile is resolved for a (profile, model) pair from the built-in defaults, then the
+LLM_PROFILES overrides for the profile, then those for "profile@model", e.g.
+
+    LLM_PROFILES='{"decompose": {"max_tokens": 200}, "decompose@gpt-4o-mini": {"response_format": "json_object"}}'
+
+response_format is "json_schema" (grammar-constrained, LM Studio / newer OpenAI models),
+"json_object" (OpenAI JSON mode) or "none" (instruction + stop sequences only). The constrained
+modes must produce an object, so the decomposition then asks for {"steps": [...]} instead of a
+bare array. An upstream that rejects response_format is remembered and asked again in "none" mode.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger("sista.llm_profiles")
+
+DECOMPOSE_MAX_STEPS = int(os.environ.get("DECOMPOSE_MAX_STEPS", "7"))
+
+_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "decompose": {
+        "max_tokens": 256,
+        "temperature": 0.2,
+        "stop": ["\n\n"],
+        "response_format": "json_schema",
+        "max_steps": DECOMPOSE_MAX_STEPS,
+    },
+}
+
+_INSTRUCTIONS = {
+    ("decompose", "array"): (
+        "Split the user's task into at most {max_steps} short, concrete steps in the user's language, "
+        "in the order to do them. Reply with only a JSON array of strings on one line, e.g. [\"…\", \"…\"]."
+    ),
+    ("decompose", "object"): (
+        "Split the user's task into at most {max_steps} short, concrete steps in the user's language, "
+        "in the order to do them. Reply with only a JSON object {{\"steps\": [\"…\", \"…\"]}}."
+    ),
+}
+
+
+def _load_overrides() -> Dict[str, Dict[str, Any]]:
+    raw = os.environ.get("LLM_PROFILES")
+    if not raw:
+        return {}
+    try:
+        overrides = json.loads(raw)
+    except ValueError:
+        logger.warning("LLM_PROFILES is not valid JSON; ignoring it")
+        return {}
+    return {k: v for k, v in overrides.items() if isinstance(v, dict)}
+
+
+_overrides = _load_overrides()
+_unsupported: Set[Tuple[str, str]] = set()
+_unsupported_lock = threading.Lock()
+
+
+def resolve(profile: Optional[str], model: str) -> Optional[Dict[str, Any]]:
+    if not profile:
+        return None
+    settings = dict(_DEFAULTS.get(profile, {}))
+    settings.update(_overrides.get(profile, {}))
+    settings.update(_overrides.get(f"{profile}@{model}", {}))
+    settings["name"] = profile
+    return settings
+
+
+def _schema(settings: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": "steps",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"steps": {"type": "array", "items": {"type": "string"}, "maxItems": settings["max_steps"]}},
+            "required": ["steps"],
+            "additionalProperties": False,
+        },
+    }
+
+
+def response_format(settings: Optional[Dict[str, Any]], endpoint: str, model: str) -> str:
+    """The output mode to use against this endpoint/model, after any remembered downgrade."""
+    if not settings:
+        return "none"
+    mode = settings.get("response_format") or "none"
+    with _unsupported_lock:
+        if (endpoint, model) in _unsupported:
+            return "none"
+    return mode
+
+
+def mark_unsupported(endpoint: str, model: str):
+    with _unsupported_lock:
+        if (endpoint, model) not in _unsupported:
+            logger.info("%s rejected response_format for %s; falling back to instruction-only output", endpoint, model)
+            _unsupported.add((endpoint, model))
+
+
+def instruction(settings: Dict[str, Any], mode: str) -> Optional[str]:
+    template = _INSTRUCTIONS.get((settings["name"], "array" if mode == "none" else "object"))
+    return template.format(**settings) if template else None
+
+
+def apply(payload: Dict[str, Any], settings: Optional[Dict[str, Any]], mode: str) -> Dict[str, Any]:
+    """Add the profile's instruction, limits and output format to an OpenAI-style chat payload."""
+    if not settings:
+        return payload
+    payload = dict(payload)
+    text = instruction(settings, mode)
+    if text:
+        payload["messages"] = [{"role": "system", "content": text}] + list(payload["messages"])
+    for key in ("max_tokens", "temperature"):
+        if settings.get(key) is not None:
+            payload[key] = settings[key]
+    if mode == "json_schema":
+        payload["response_format"] = {"type": "json_schema", "json_schema": _schema(settings)}
+    elif mode == "json_object":
+        payload["response_format"] = {"type": "json_object"}
+    elif settings.get("stop"):
+        # stop sequences only without a schema; a constrained output ends on its own
+        payload["stop"] = settings["stop"]
+    return payload
+
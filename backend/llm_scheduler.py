@@ -0,0 +1,239 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from shared_state import Semaphore
+
+# Priority classes, lower runs first
+INTERACTIVE = 0
+DECOMPOSITION = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", DECOMPOSITION: "decomposition", BACKGROUND: "background"}
+PRIORITY_BY_NAME = {v: k for k, v in PRIORITY_NAMES.items()}
+
+# Concurrent upstream calls; set to what the model server can actually run in parallel
+LLM_MAX_INFLIGHT = int(os.environ.get("LLM_MAX_INFLIGHT", "2"))
+# with several workers: cap on concurrent upstream calls across all of them, enforced through
+# shared_state (0 = only the per-worker LLM_MAX_INFLIGHT applies)
+LLM_MAX_INFLIGHT_TOTAL = int(os.environ.get("LLM_MAX_INFLIGHT_TOTAL", "0"))
+# a cluster slot held longer than this (a worker died mid-call) is handed out again
+LLM_SLOT_LEASE_SECONDS = float(os.environ.get("LLM_SLOT_LEASE_SECONDS", "300"))
+# a request waiting this long is promoted one class up so background work is never starved forever
+LLM_AGING_SECONDS = float(os.environ.get("LLM_AGING_SECONDS", "30"))
+
+
+class _Ticket:
+    __slots__ = ("priority", "origin", "user", "finish_tag", "seq", "enqueued_at", "granted", "cancelled")
+
+    def __init__(self, priority: int, user: Any, finish_tag: float, seq: int):
+        self.priority = priority
+        self.origin = priority
+        self.user = user
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+
+    def __lt__(self, other: "_Ticket"):
+        return (self.finish_tag, self.seq) < (other.finish_tag, other.seq)
+
+
+class _WaitStats:
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))], 4) if recent else 0.0
+
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "max": round(self.max, 4),
+            "p50": pct(0.5),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+        }
+
+
+class LLMScheduler:
+    """
+    Admission point in front of the LLM upstream. At most `max_inflight` calls run at once; waiting
+    calls are served strictly by priority class, and within a class by weighted fair queueing
+    across users (start-time virtual clock), so one user's burst can't starve the others.
+    """
+
+    def __init__(self, max_inflight: int = LLM_MAX_INFLIGHT, aging_seconds: float = LLM_AGING_SECONDS):
+        self.max_inflight = max(1, max_inflight)
+        self.aging_seconds = aging_seconds
+        self._cond = threading.Condition()
+        self._queues: Dict[int, List[_Ticket]] = {p: [] for p in PRIORITY_NAMES}
+        self._virtual_time: Dict[int, float] = {p: 0.0 for p in PRIORITY_NAMES}
+        self._last_finish: Dict[int, Dict[Any, float]] = {p: {} for p in PRIORITY_NAMES}
+        self._weights: Dict[Any, float] = {}
+        self._inflight = 0
+        self._seq = itertools.count()
+        self._wait_stats = {p: _WaitStats() for p in PRIORITY_NAMES}
+        self._service = _WaitStats()
+        # smoothed upstream service time, used to estimate queue wait for admission control
+        self._service_ewma: Optional[float] = None
+        self._withdrawn = {p: 0 for p in PRIORITY_NAMES}
+        self._rejected = {p: 0 for p in PRIORITY_NAMES}
+
+    def set_weight(self, user: Any, weight: float):
+        with self._cond:
+            self._weights[user] = max(weight, 0.01)
+
+    def _enqueue(self, priority: int, user: Any, cost: float) -> _Ticket:
+        weight = self._weights.get(user, 1.0)
+        start = max(self._virtual_time[priority], self._last_finish[priority].get(user, 0.0))
+        finish = start + cost / weight
+        self._last_finish[priority][user] = finish
+        ticket = _Ticket(priority, user, finish, next(self._seq))
+        heapq.heappush(self._queues[priority], ticket)
+        return ticket
+
+    def _promote_aged(self):
+        if not self.aging_seconds:
+            return
+        now = time.monotonic()
+        for priority in (BACKGROUND, DECOMPOSITION):
+            queue = self._queues[priority]
+            # one class up per aging period waited
+            aged = [t for t in queue if not t.cancelled and now - t.enqueued_at >= self.aging_seconds * (t.origin - priority + 1)]
+            if not aged:
+                continue
+            self._queues[priority] = [t for t in queue if t not in aged]
+            heapq.heapify(self._queues[priority])
+            for t in aged:
+                t.priority = priority - 1
+                t.finish_tag = self._virtual_time[t.priority]
+                heapq.heappush(self._queues[t.priority], t)
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        self._promote_aged()
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            while queue:
+                ticket = heapq.heappop(queue)
+                if ticket.cancelled:
+                    continue
+                self._virtual_time[priority] = max(self._virtual_time[priority], ticket.finish_tag)
+                return ticket
+        return None
+
+    def _dispatch(self):
+        while self._inflight < self.max_inflight:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            ticket.granted = True
+            self._inflight += 1
+        self._cond.notify_all()
+
+    def acquire(self, priority: int = INTERACTIVE, user: Any = None, cost: float = 1.0, timeout: Optional[float] = None, cancel=None) -> bool:
+        """
+        Block until a slot is granted. Returns False if the timeout passes or `cancel` (an
+        admission.CancelToken) fires first; the ticket is then withdrawn from the queue.
+        """
+        with self._cond:
+            ticket = self._enqueue(priority, user, cost)
+            if cancel is not None:
+                cancel.add_callback(self._wake)
+            self._dispatch()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0) or (cancel is not None and cancel.cancelled):
+                    ticket.cancelled = True
+                    self._withdrawn[ticket.origin] += 1
+                    return False
+                # wake periodically so aging is applied even when nothing else happens
+                self._cond.wait(timeout=min(remaining, 1.0) if remaining is not None else 1.0)
+                if not ticket.granted:
+                    self._dispatch()
+            self._wait_stats[ticket.origin].add(time.monotonic() - ticket.enqueued_at)
+            return True
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def release(self, service_seconds: Optional[float] = None):
+        with self._cond:
+            self._inflight -= 1
+            if service_seconds is not None:
+                self._service.add(service_seconds)
+                if self._service_ewma is None:
+                    self._service_ewma = service_seconds
+                else:
+                    self._service_ewma = 0.8 * self._service_ewma + 0.2 * service_seconds
+            self._dispatch()
+
+    def queue_depth_at_or_above(self, priority: int) -> int:
+        """Waiting calls that would be served before a new call of this priority."""
+        with self._cond:
+            return sum(1 for p, q in self._queues.items() if p <= priority for t in q if not t.cancelled)
+
+    def estimate_wait(self, priority: int) -> float:
+        """Rough queue wait in seconds for a new call of this priority."""
+        with self._cond:
+            if self._service_ewma is None:
+                return 0.0
+            ahead = sum(1 for p, q in self._queues.items() if p <= priority for t in q if not t.cancelled)
+            busy = self._inflight >= self.max_inflight
+            if not ahead and not busy:
+                return 0.0
+            # each slot frees on average every service/max_inflight seconds
+            return (ahead + 1) * self._service_ewma / self.max_inflight
+
+    def run(self, fn: Callable[[], Any], priority: int = INTERACTIVE, user: Any = None, cost: float = 1.0) -> Any:
+        self.acquire(priority, user, cost)
+        started = time.monotonic()
+        try:
+            return fn()
+        finally:
+            self.release(time.monotonic() - started)
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        with self._cond:
+            queues = [self._queues[priority]] if priority is not None else self._queues.values()
+            return sum(1 for q in queues for t in q if not t.cancelled)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_inflight": self.max_inflight,
+                "cluster_max_inflight": LLM_MAX_INFLIGHT_TOTAL or None,
+                "inflight": self._inflight,
+                "queued": {PRIORITY_NAMES[p]: sum(1 for t in q if not t.cancelled) for p, q in self._queues.items()},
+                "queue_wait_seconds": {PRIORITY_NAMES[p]: s.snapshot() for p, s in self._wait_stats.items()},
+                "service_seconds": self._service.snapshot(),
+                "withdrawn": {PRIORITY_NAMES[p]: n for p, n in self._withdrawn.items()},
+                "rejected": {PRIORITY_NAMES[p]: n for p, n in self._rejected.items()},
+            }
+
+    def record_rejected(self, priority: int):
+        with self._cond:
+            self._rejected[priority] += 1
+
+
+scheduler = LLMScheduler()
+# taken after a local slot, right before the upstream call (see ai_client.call_llm)
+cluster_slots = Semaphore("llm", LLM_MAX_INFLIGHT_TOTAL, lease=LLM_SLOT_LEASE_SECONDS) if LLM_MAX_INFLIGHT_TOTAL > 0 else None
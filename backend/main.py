@@ -1,22 +1,54 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import SQLModel, Field, create_engine, Session, select, ForeignKey
+from sqlmodel import Session, select
+from sqlalchemy import text as sql_text
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from fastapi import Depends, Header
+from fastapi import Depends, Header, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Dict, Any
 import requests
-from ai_client import call_llm
+from ai_client import call_llm, warmup as warmup_llm
+from llm_scheduler import scheduler, INTERACTIVE, DECOMPOSITION, BACKGROUND
+from hedging import hedger
+from model_router import router
+from semantic_cache import semantic_cache
+from token_revocation import revocations
+from db import DATABASE_URL, engine, connect_with_backoff, migrate, warm_pool
+from models import User, TokenVersion, ChatMessage, Task, SyncCounter, Tombstone, ImportKey, TaskStat, Reminder, ReminderSettings, WebhookDelivery, TaskPlan, ActionRun, Conversation
+import sync
+import events
+import search
+import serialization
+import backup
+import task_stats
+import reminders
+import webhooks
+import speculative
+import actions
+import conversations
+import rule_decompose
+import profiling
+import migrations
+import threading
+import admission
+import asyncio
+import hashlib
+from shared_state import SingleFlight
 
 # simple JWT settings (for demo)
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-key")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+# access tokens are short-lived and verified without touching the DB; refresh tokens renew them
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -29,39 +61,39 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-def create_access_token(data: dict):
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, token_type: str = "access"):
     to_encode = data.copy()
-    # no exp for simplicity
+    if expires_delta is None:
+        expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode["exp"] = datetime.utcnow() + expires_delta
+    to_encode["typ"] = token_type
+    if "ver" not in to_encode and "sub" in to_encode:
+        to_encode["ver"] = revocations.current_version(int(to_encode["sub"]))
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
-class User(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    username: str = Field(index=True, unique=True)
-    hashed_password: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+def create_refresh_token(data: dict):
+    return create_access_token(data, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS), token_type="refresh")
 
 
-class ChatMessage(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
-    message: str
-    reply: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-DATABASE_URL = os.environ.get("DATABASE_URL")
-
-# Fallback to a local sqlite file if DATABASE_URL not provided. This makes local dev easier
-if not DATABASE_URL:
-    DATABASE_URL = "sqlite:///./sista_dev.db"
+def decode_token(token: str, token_type: str = "access") -> int:
+    """Decode a JWT and return the user id. Raises JWTError if expired, revoked or of the wrong type."""
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get("typ", "access") != token_type:
+        raise JWTError("Wrong token type")
+    try:
+        uid = int(payload.get("sub"))
+    except (TypeError, ValueError):
+        raise JWTError("Invalid subject")
+    if not revocations.is_valid(uid, payload.get("ver")):
+        raise JWTError("Token revoked")
+    return uid
 
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
 
 app = FastAPI(title="Sista Backend")
+# lets X-Profile capture sync endpoints in their threadpool thread too (see profiling.py)
+app.router.route_class = profiling.ProfiledRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -70,26 +102,82 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(profiling.ProfilingMiddleware)
 
 
-class Task(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    title: str
-    status: str = "pending"
-    category: Optional[str] = None
-    due_date: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    # user_id is required: tasks belong to a user
-    user_id: int = Field(foreign_key="user.id")
+# with more than one worker each process polls for logouts handled by its siblings
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+REVOCATION_REFRESH_SECONDS = float(os.environ.get("REVOCATION_REFRESH_SECONDS", "5" if WEB_CONCURRENCY > 1 else "0"))
+
+
+def load_token_revocations():
+    with Session(engine) as session:
+        rows = session.exec(select(TokenVersion)).all()
+        revocations.load((r.user_id, r.version, r.removed) for r in rows)
+    last_seen = {"at": datetime.utcnow()}
 
+    def changed_since_last_poll():
+        # small overlap so a row committed during the previous poll isn't missed
+        since = last_seen["at"] - timedelta(seconds=1)
+        last_seen["at"] = datetime.utcnow()
+        with Session(engine) as session:
+            rows = session.exec(select(TokenVersion).where(TokenVersion.updated_at >= since)).all()
+            return [(r.user_id, r.version, r.removed) for r in rows]
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    revocations.configure_refresh(changed_since_last_poll, REVOCATION_REFRESH_SECONDS)
+
+
+def bump_token_version(session: Session, user_id: int, removed: bool = False) -> int:
+    """Invalidate every token issued to user_id so far. Caller commits the session."""
+    row = session.get(TokenVersion, user_id)
+    if not row:
+        row = TokenVersion(user_id=user_id, version=revocations.current_version(user_id))
+    row.version += 1
+    row.removed = removed
+    row.updated_at = datetime.utcnow()
+    session.add(row)
+    return row.version
+
+
+# WARMUP_LLM=1: send a one-token completion at startup; /readyz stays 503 until it returns
+WARMUP_LLM = os.environ.get("WARMUP_LLM", "0").lower() in ("1", "true", "yes")
+_lifecycle: Dict[str, Any] = {"schema_version": 0, "warmup": None, "warmed": not WARMUP_LLM}
+
+
+def _warmup_llm():
+    try:
+        _lifecycle["warmup"] = warmup_llm()
+    finally:
+        _lifecycle["warmed"] = True
 
 
 @app.on_event("startup")
 def on_startup():
-    create_db_and_tables()
+    # under gunicorn the master applies migrations once (see gunicorn_conf.py)
+    if os.environ.get("SISTA_SCHEMA_READY") != "1":
+        migrate()
+    else:
+        connect_with_backoff()
+    _lifecycle["schema_version"] = migrations.current_version(engine)
+    warm_pool()
+    load_token_revocations()
+    events.start_pg_bridge(DATABASE_URL)
+    if webhooks.WEBHOOKS_ENABLED:
+        webhooks.dispatcher.start()
+        reminders.scheduler.handlers.append(webhooks.on_reminder)
+    if reminders.REMINDERS_ENABLED:
+        reminders.scheduler.start()
+    if WARMUP_LLM:
+        threading.Thread(target=_warmup_llm, name="llm-warmup", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # reminders first: a firing reminder may still enqueue a webhook for the dispatcher to send
+    reminders.scheduler.stop()
+    webhooks.dispatcher.stop()
+    if webhooks.on_reminder in reminders.scheduler.handlers:
+        reminders.scheduler.handlers.remove(webhooks.on_reminder)
 
 
 @app.get("/", tags=["health"])
@@ -97,46 +185,263 @@ def health():
     return {"message": "Sista FastAPI backend is running"}
 
 
+@app.get("/healthz", tags=["health"])
+def healthz():
+    """Liveness: the process is up and serving. Touches nothing else, so a slow DB never gets the pod killed."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz", tags=["health"])
+def readyz(response: Response):
+    """Readiness: DB reachable, schema at the latest migration and (if enabled) the LLM warmed up."""
+    checks: Dict[str, Any] = {
+        "schema": _lifecycle["schema_version"] >= migrations.HEAD,
+        "llm_warmup": _lifecycle["warmed"],
+    }
+    try:
+        with engine.connect() as conn:
+            conn.execute(sql_text("SELECT 1"))
+        checks["database"] = True
+    except Exception:
+        checks["database"] = False
+    ready = all(checks.values())
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "starting", "checks": checks, "schema_version": _lifecycle["schema_version"],
+            "warmup": _lifecycle["warmup"]}
+
+
+@app.get("/metrics/llm", tags=["health"])
+def llm_metrics():
+    """LLM scheduler state (in-flight calls, queue depth, queue-wait percentiles), hedging counters and model tier choices."""
+    return dict(
+        scheduler.metrics(),
+        hedging=hedger.metrics(),
+        models=router.metrics(),
+        semantic_cache=semantic_cache.metrics() if semantic_cache else {"enabled": False},
+    )
+
+
+@app.get("/admin/profile/sample", tags=["admin"], dependencies=[Depends(profiling.require_admin)])
+async def admin_profile_sample(seconds: float = Query(10, gt=0, le=profiling.SAMPLER_MAX_SECONDS),
+                               interval_ms: float = Query(5, ge=1, le=1000)):
+    """Sample every thread for `seconds` and download the stacks in collapsed (flamegraph) format."""
+    folded = await run_in_threadpool(profiling.sampler.sample, seconds, interval_ms / 1000)
+    filename = f"sista-{datetime.utcnow():%Y%m%dT%H%M%S}.folded"
+    return PlainTextResponse(folded, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.get("/admin/profile/requests", tags=["admin"], dependencies=[Depends(profiling.require_admin)])
+def admin_profiled_requests():
+    """Requests captured with X-Profile: 1 (most recent first)."""
+    return profiling.recent_profiles()
+
+
+@app.get("/admin/profile/requests/{profile_id}", tags=["admin"], dependencies=[Depends(profiling.require_admin)])
+def admin_profiled_request(profile_id: int, format: str = Query("text", pattern="^(text|pstats)$"),
+                           sort: str = Query("cumulative", pattern="^(cumulative|tottime|calls|ncalls)$"),
+                           limit: int = Query(60, ge=1, le=1000)):
+    capture = profiling.get_profile(profile_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Profile not found (only the most recent are kept)")
+    if format == "pstats":
+        return Response(content=capture.dump(), media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="sista-request-{profile_id}.pstats"'})
+    return PlainTextResponse(capture.text(sort, limit))
+
+
+class SlowLogSettings(BaseModel):
+    threshold_ms: float
+
+
+@app.get("/admin/slow-requests", tags=["admin"], dependencies=[Depends(profiling.require_admin)])
+def admin_slow_requests(limit: int = Query(50, ge=1, le=profiling.SLOW_REQUEST_KEEP)):
+    entries = list(profiling.slow_log.entries)[-limit:]
+    return {"threshold_ms": profiling.slow_log.threshold_ms, "entries": list(reversed(entries))}
+
+
+@app.put("/admin/slow-requests", tags=["admin"], dependencies=[Depends(profiling.require_admin)])
+def admin_set_slow_requests(settings: SlowLogSettings):
+    """Set the slow-request threshold for this worker; 0 turns the log (and the SQL timing hooks) off."""
+    profiling.slow_log.set_threshold(settings.threshold_ms)
+    return {"threshold_ms": profiling.slow_log.threshold_ms}
+
+
 def get_current_user_id(authorization: Optional[str] = Header(None)) -> int:
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
     token = authorization.split(" ", 1)[1]
+    # expiry + in-memory revocation check; removed users are revoked too, so no DB lookup is needed
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        uid = int(payload.get("sub"))
+        return decode_token(token)
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
-    # verify user exists
-    with Session(engine) as session:
-        user = session.get(User, uid)
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-    return uid
 
 
 @app.get("/tasks", response_model=List[Task])
-def list_tasks(user_id: int = Depends(get_current_user_id)):
+def list_tasks(request: Request, user_id: int = Depends(get_current_user_id), if_none_match: Optional[str] = Header(None)):
     with Session(engine) as session:
-        tasks = session.exec(select(Task).where(Task.user_id == user_id).order_by(Task.created_at)).all()
-        return tasks
+        # the user's change counter doubles as a list version, so unchanged lists cost one PK lookup
+        etag = sync.etag_for(user_id, sync.current_version(session, user_id))
+        if etag in sync.parse_if_none_match(if_none_match):
+            return Response(status_code=304, headers={"ETag": etag})
+        tasks = session.exec(select(Task).where(Task.user_id == user_id).order_by(Task.created_at, Task.id)).all()
+        # rows come straight from the table: skip response_model re-validation
+        return serialization.fast_response(request, tasks, headers={"ETag": etag})
+
+
+# how far a client-supplied created_at may be from the server clock
+TASK_CLOCK_SKEW_SECONDS = float(os.environ.get("TASK_CLOCK_SKEW_SECONDS", "60"))
 
 
 @app.post("/tasks", response_model=Task)
-def create_task(task: Task, user_id: int = Depends(get_current_user_id)):
+def create_task(task: Task, precompute: bool = Query(True), user_id: int = Depends(get_current_user_id)):
+    """
+    With precompute (default), the task is decomposed in the background at low priority and the
+    first step is available from GET /tasks/{id}/plan and /api/execute shortly after.
+    An explicit created_at is kept, so clients creating several tasks at once can fix their order,
+    but only within TASK_CLOCK_SKEW_SECONDS of the server clock: it can't backdate a task.
+    """
     with Session(engine) as session:
         db_task = Task(
             title=task.title,
             status=task.status or "pending",
             category=task.category,
             due_date=task.due_date,
+            due_at=task.due_at or reminders.parse_due(task.due_date),
             user_id=user_id,
         )
+        # the body is not validated into types (table model): parse like due_date, naive UTC
+        created_at = reminders.parse_due(task.created_at, tz=timezone.utc) if "created_at" in task.model_fields_set else None
+        if created_at:
+            # only good for ordering a batch; ages (neglect stats, reminders) stay on the server clock
+            skew = timedelta(seconds=TASK_CLOCK_SKEW_SECONDS)
+            db_task.created_at = min(max(created_at, db_task.created_at - skew), db_task.created_at + skew)
+        sync.stamp(session, db_task, user_id)
+        task_stats.record(session, user_id, after=db_task)
         session.add(db_task)
+        session.flush()
+        search.index_row(session, "task", db_task)
+        reminders.schedule_task(session, db_task)
+        speculate = precompute and speculative.precomputer.accepting()
+        if speculate:
+            session.add(TaskPlan(task_id=db_task.id, user_id=user_id))
         session.commit()
         session.refresh(db_task)
+        if speculate:
+            speculative.precomputer.submit(db_task.id, user_id, db_task.title)
+        events.publish_change(user_id, "task", db_task)
         return db_task
 
 
+@app.get("/tasks/stats")
+def get_task_stats(user_id: int = Depends(get_current_user_id)):
+    """Counts by status/category and the oldest open task (for neglect alerts); constant cost per user."""
+    with Session(engine) as session:
+        return task_stats.snapshot(session, user_id)
+
+
+@app.get("/tasks/plans")
+def list_task_plans(user_id: int = Depends(get_current_user_id)):
+    """Precomputed plans of the user's tasks, keyed by task id."""
+    with Session(engine) as session:
+        plans = session.exec(select(TaskPlan).where(TaskPlan.user_id == user_id)).all()
+        return {str(p.task_id): speculative.plan_dict(p) for p in plans}
+
+
+@app.get("/tasks/{task_id}/plan")
+def get_task_plan(task_id: int, user_id: int = Depends(get_current_user_id)):
+    with Session(engine) as session:
+        plan = session.get(TaskPlan, task_id)
+        if not plan or plan.user_id != user_id:
+            raise HTTPException(status_code=404, detail="No plan for this task")
+        return speculative.plan_dict(plan)
+
+
+class ReminderSettingsUpdate(BaseModel):
+    alarm_enabled: Optional[bool] = None
+    neglect_days: Optional[int] = None
+    webhook_url: Optional[str] = None
+
+
+@app.get("/reminders/settings", response_model=ReminderSettings)
+def get_reminder_settings(user_id: int = Depends(get_current_user_id)):
+    with Session(engine) as session:
+        return reminders.get_settings(session, user_id)
+
+
+@app.put("/reminders/settings", response_model=ReminderSettings)
+def update_reminder_settings(update: ReminderSettingsUpdate, user_id: int = Depends(get_current_user_id)):
+    """Persist 鬼電モード / neglect settings; changing neglect_days reschedules the user's neglect reminders."""
+    if update.neglect_days is not None and not 1 <= update.neglect_days <= 365:
+        raise HTTPException(status_code=422, detail="neglect_days must be between 1 and 365")
+    if update.webhook_url:
+        try:
+            webhooks.destination_of(update.webhook_url)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    with Session(engine) as session:
+        settings = reminders.get_settings(session, user_id)
+        previous_days = settings.neglect_days
+        for field, value in update.model_dump(exclude_unset=True).items():
+            setattr(settings, field, value)
+        settings.updated_at = datetime.utcnow()
+        session.add(settings)
+        if settings.neglect_days != previous_days:
+            reminders.reschedule_user(session, user_id, settings)
+        session.commit()
+        session.refresh(settings)
+        return settings
+
+
+@app.post("/reminders/notify")
+def send_gyakugire(user_id: int = Depends(get_current_user_id)):
+    """逆ギレ送信: queue a webhook about the most neglected open task right now."""
+    with Session(engine) as session:
+        settings = reminders.get_settings(session, user_id)
+        if not settings.webhook_url:
+            raise HTTPException(status_code=400, detail="webhook_url is not set")
+        oldest = task_stats.snapshot(session, user_id)["oldest_open"]
+        if oldest:
+            event = webhooks.gyakugire_event(oldest["title"], oldest["neglected_days"], oldest["id"])
+        else:
+            event = webhooks.gyakugire_event("タスク", 0)
+        delivery = webhooks.enqueue(session, user_id, settings.webhook_url, event)
+        session.commit()
+        return {"queued": delivery.id}
+
+
+@app.get("/webhooks/deliveries")
+def list_webhook_deliveries(
+    status: Optional[str] = Query(None, pattern="^(pending|delivered|dead)$"),
+    limit: int = Query(50, ge=1, le=500),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Recent outbox rows for the user; status=dead lists the dead letters."""
+    with Session(engine) as session:
+        query = select(WebhookDelivery).where(WebhookDelivery.user_id == user_id)
+        if status:
+            query = query.where(WebhookDelivery.status == status)
+        return session.exec(query.order_by(WebhookDelivery.id.desc()).limit(limit)).all()
+
+
+@app.post("/webhooks/deliveries/{delivery_id}/retry")
+def retry_webhook_delivery(delivery_id: int, user_id: int = Depends(get_current_user_id)):
+    with Session(engine) as session:
+        delivery = session.get(WebhookDelivery, delivery_id)
+        if not delivery or delivery.user_id != user_id:
+            raise HTTPException(status_code=404, detail="Delivery not found")
+        if delivery.status != "dead":
+            raise HTTPException(status_code=409, detail="Only dead deliveries can be retried")
+        delivery.status = "pending"
+        delivery.attempts = 0
+        delivery.next_attempt_at = datetime.utcnow()
+        session.add(delivery)
+        session.commit()
+    webhooks.dispatcher.wake()
+    return {"ok": True}
+
+
 @app.put("/tasks/{task_id}", response_model=Task)
 @app.put("/tasks/{task_id}", response_model=Task)
 def update_task(task_id: int, task: Task, user_id: int = Depends(get_current_user_id)):
@@ -146,13 +451,32 @@ def update_task(task_id: int, task: Task, user_id: int = Depends(get_current_use
             raise HTTPException(status_code=404, detail="Task not found")
         if db_task.user_id != user_id:
             raise HTTPException(status_code=403, detail="Not allowed")
+        previous = (db_task.status, db_task.category)
+        retitled = db_task.title != task.title
         db_task.title = task.title
         db_task.status = task.status
         db_task.category = task.category
         db_task.due_date = task.due_date
+        db_task.due_at = task.due_at or reminders.parse_due(task.due_date)
+        sync.stamp(session, db_task, user_id)
+        task_stats.record(session, user_id, before_values=previous, after=db_task)
         session.add(db_task)
+        search.index_row(session, "task", db_task)
+        reminders.schedule_task(session, db_task)
+        plan = session.get(TaskPlan, task_id) if retitled else None
+        speculate = plan is not None and speculative.precomputer.accepting()
+        if plan is not None:
+            # the precomputed plan was for the old title
+            speculative.precomputer.cancel(task_id)
+            if speculate:
+                session.add(speculative.reset(plan))
+            else:
+                session.delete(plan)
         session.commit()
         session.refresh(db_task)
+        if speculate:
+            speculative.precomputer.submit(task_id, user_id, db_task.title)
+        events.publish_change(user_id, "task", db_task)
         return db_task
 
 
@@ -165,8 +489,16 @@ def delete_task(task_id: int, user_id: int = Depends(get_current_user_id)):
             raise HTTPException(status_code=404, detail="Task not found")
         if db_task.user_id != user_id:
             raise HTTPException(status_code=403, detail="Not allowed")
-        session.delete(db_task)
+        version = sync.delete_with_tombstone(session, db_task, "task")
+        task_stats.record(session, user_id, before=db_task)
+        search.remove_row(session, "task", task_id)
+        reminders.cancel_task(session, task_id)
+        speculative.precomputer.cancel(task_id)
+        plan = session.get(TaskPlan, task_id)
+        if plan is not None:
+            session.delete(plan)
         session.commit()
+        events.publish_change(user_id, "task", entity_id=task_id, version=version)
         return {"ok": True}
 
 
@@ -181,6 +513,17 @@ class UserCreate(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: int = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+def issue_tokens(user_id: int) -> Token:
+    data = {"sub": str(user_id)}
+    return Token(access_token=create_access_token(data), refresh_token=create_refresh_token(data))
 
 
 class ChatRequest(BaseModel):
@@ -190,6 +533,9 @@ class ChatRequest(BaseModel):
     over_hallucination: Optional[bool] = False
     history: Optional[list] = None
     compressed_memory: Optional[dict] = None
+    # thread to continue (signed in) or the session_key of an anonymous one; omit both to start a new thread
+    conversation_id: Optional[int] = None
+    session_key: Optional[str] = None
 
 
 class AIDecomposeRequest(BaseModel):
@@ -215,8 +561,12 @@ def register(user: UserCreate):
         session.add(db_user)
         session.commit()
         session.refresh(db_user)
-        token = create_access_token({"sub": str(db_user.id)})
-        return Token(access_token=token)
+        if session.get(TokenVersion, db_user.id):
+            # the id was used by a removed account; start a new generation so its old tokens stay dead
+            version = bump_token_version(session, db_user.id)
+            session.commit()
+            revocations.set_version(db_user.id, version)
+        return issue_tokens(db_user.id)
 
 
 @app.post("/auth/login", response_model=Token)
@@ -225,15 +575,231 @@ def login(form: UserCreate):
         user = session.exec(select(User).where(User.username == form.username)).first()
         if not user or not verify_password(form.password, user.hashed_password):
             raise HTTPException(status_code=400, detail="Incorrect username or password")
-        token = create_access_token({"sub": str(user.id)})
-        return Token(access_token=token)
+        return issue_tokens(user.id)
+
+
+@app.post("/auth/refresh", response_model=Token)
+def refresh(req: RefreshRequest):
+    try:
+        uid = decode_token(req.refresh_token, token_type="refresh")
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    # refresh is the one place that re-checks the DB, so deleted users can't mint new tokens
+    with Session(engine) as session:
+        if not session.get(User, uid):
+            raise HTTPException(status_code=401, detail="User not found")
+    return issue_tokens(uid)
+
+
+@app.post("/auth/logout")
+def logout(user_id: int = Depends(get_current_user_id)):
+    # revokes all access and refresh tokens of the user
+    with Session(engine) as session:
+        version = bump_token_version(session, user_id)
+        session.commit()
+    revocations.set_version(user_id, version)
+    return {"ok": True}
+
+
+@app.delete("/auth/me")
+def delete_me(user_id: int = Depends(get_current_user_id)):
+    with Session(engine) as session:
+        for t in session.exec(select(Task).where(Task.user_id == user_id)).all():
+            session.delete(t)
+        for c in session.exec(select(ChatMessage).where(ChatMessage.user_id == user_id)).all():
+            session.delete(c)
+        for row in session.exec(select(Tombstone).where(Tombstone.user_id == user_id)).all():
+            session.delete(row)
+        for row in session.exec(select(ImportKey).where(ImportKey.user_id == user_id)).all():
+            session.delete(row)
+        for model in (TaskStat, Reminder, ReminderSettings, WebhookDelivery, TaskPlan, ActionRun, Conversation):
+            for row in session.exec(select(model).where(model.user_id == user_id)).all():
+                session.delete(row)
+        counter = session.get(SyncCounter, user_id)
+        if counter:
+            session.delete(counter)
+        user = session.get(User, user_id)
+        if user:
+            session.delete(user)
+        search.remove_user(session, user_id)
+        version = bump_token_version(session, user_id, removed=True)
+        session.commit()
+    revocations.set_version(user_id, version, removed=True)
+    return {"ok": True}
 
 
 @app.get("/chats", response_model=List[ChatMessage])
-def list_chats(user_id: int = Depends(get_current_user_id)):
+def list_chats(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before: Optional[int] = Query(None, ge=1),
+    user_id: int = Depends(get_current_user_id),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Oldest first (by id, paged or not). With `limit`, only the newest `limit` messages (older than message id `before`,
+    if given) are returned; page back by passing the first id of a page as the next `before`.
+    A page shorter than `limit` is the last one.
+    """
+    with Session(engine) as session:
+        # each page is its own representation: page 1's ETag must not validate page 2
+        page = f"chats:{limit}:{before}" if limit is not None or before is not None else ""
+        etag = sync.etag_for(user_id, sync.current_version(session, user_id), page)
+        if etag in sync.parse_if_none_match(if_none_match):
+            return Response(status_code=304, headers={"ETag": etag})
+        query = select(ChatMessage).where(ChatMessage.user_id == user_id)
+        if before is not None:
+            query = query.where(ChatMessage.id < before)
+        if limit is None:
+            msgs = session.exec(query.order_by(ChatMessage.id)).all()
+        else:
+            msgs = list(reversed(session.exec(query.order_by(ChatMessage.id.desc()).limit(limit)).all()))
+        return serialization.fast_response(request, msgs, headers={"ETag": etag})
+
+
+@app.get("/conversations")
+def list_conversations(request: Request, limit: int = Query(20, ge=1, le=100), user_id: int = Depends(get_current_user_id)):
+    """The user's chat threads, most recently active first."""
+    with Session(engine) as session:
+        convs = session.exec(
+            select(Conversation).where(Conversation.user_id == user_id).order_by(Conversation.updated_at.desc()).limit(limit)
+        ).all()
+        return serialization.fast_response(request, [conversations.summary(c) for c in convs])
+
+
+@app.get("/conversations/{conversation_id}/messages", response_model=List[ChatMessage])
+def list_conversation_messages(
+    request: Request,
+    conversation_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    before_seq: Optional[int] = Query(None, ge=1),
+    user_id: int = Depends(get_current_user_id),
+):
+    """The newest `limit` turns of a thread (before `before_seq`, if given), oldest first."""
     with Session(engine) as session:
-        msgs = session.exec(select(ChatMessage).where(ChatMessage.user_id == user_id).order_by(ChatMessage.created_at)).all()
-        return msgs
+        conversations.find(session, user_id, conversation_id)
+        query = select(ChatMessage).where(ChatMessage.conversation_id == conversation_id)
+        if before_seq is not None:
+            query = query.where(ChatMessage.seq < before_seq)
+        msgs = session.exec(query.order_by(ChatMessage.seq.desc()).limit(limit)).all()
+        return serialization.fast_response(request, list(reversed(msgs)))
+
+
+@app.get("/sync")
+def sync_changes(request: Request, since: int = Query(0, ge=0), user_id: int = Depends(get_current_user_id)):
+    """
+    Incremental sync: returns tasks/chats written after change version `since` plus tombstones
+    for deletions. Clients keep the returned `version` and pass it as `since` next time.
+    """
+    with Session(engine) as session:
+        return serialization.fast_response(request, sync.changes_since(session, user_id, since))
+
+
+@app.get("/export")
+def export_data(compress: Optional[str] = Query(None, pattern="^gzip$"), user_id: int = Depends(get_current_user_id)):
+    """
+    Stream all of the user's tasks and chats as NDJSON (see backup.py for the format).
+    ?compress=gzip returns a .ndjson.gz file instead.
+    """
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    filename = f"sista-export-{stamp}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        backup.export_stream(user_id, compress=bool(compress)),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.post("/import")
+async def import_data(request: Request, user_id: int = Depends(get_current_user_id), idempotency_key: Optional[str] = Header(None)):
+    """
+    Import an NDJSON export (body may be gzip with Content-Encoding: gzip). Rows already imported
+    are skipped, so a failed upload can simply be retried. Returns counts and sample errors.
+    """
+    summary = await backup.import_stream(request, user_id, idempotency_key)
+    if summary.get("imported"):
+        events.bus.publish(user_id, {"type": "resync"})
+    return summary
+
+
+@app.get("/search")
+def search_items(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Optional[str] = Query(None, pattern="^(task|chat)$"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    user_id: int = Depends(get_current_user_id),
+):
+    """
+    Substring-style full-text search over the user's tasks and chat history, best match first.
+    Page with `offset`; `next_offset` is null on the last page.
+    """
+    types = [type] if type else ["task", "chat"]
+    with Session(engine) as session:
+        hits = search.search(session, user_id, q, types, limit + 1, offset)
+        more = len(hits) > limit
+        hits = hits[:limit]
+        models = {"task": Task, "chat": ChatMessage}
+        for hit in hits:
+            hit["item"] = session.get(models[hit["type"]], hit["id"])
+        return serialization.fast_response(request, {"hits": [h for h in hits if h["item"] is not None], "next_offset": offset + limit if more else None})
+
+
+WS_PING_SECONDS = int(os.environ.get("WS_PING_SECONDS", "30"))
+
+
+@app.websocket("/ws")
+async def ws_events(websocket: WebSocket, token: Optional[str] = None):
+    """
+    Push task/chat change events for the authenticated user. Browsers can't set headers on a
+    WebSocket, so the access token comes from ?token= (or an Authorization header). Since access
+    tokens are short-lived, clients send {"type": "auth", "token": ...} to extend the connection;
+    it is closed with 4401 once the token expires or is revoked.
+    """
+    auth = websocket.headers.get("authorization")
+    if not token and auth and auth.startswith("Bearer "):
+        token = auth.split(" ", 1)[1]
+    try:
+        user_id = decode_token(token or "")
+    except JWTError:
+        await websocket.close(code=4401)
+        return
+    await websocket.accept()
+    state = {"token": token}
+    sub = events.bus.subscribe(user_id)
+    loop, queue = sub
+
+    async def receive():
+        while True:
+            msg = await websocket.receive_json()
+            if isinstance(msg, dict) and msg.get("type") == "auth":
+                try:
+                    if decode_token(msg.get("token") or "") == user_id:
+                        state["token"] = msg["token"]
+                except JWTError:
+                    pass
+
+    receiver = asyncio.create_task(receive())
+    try:
+        await websocket.send_json({"type": "hello", "user_id": user_id})
+        while not receiver.done():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=WS_PING_SECONDS)
+            except asyncio.TimeoutError:
+                event = {"type": "ping"}  # keep-alive
+            # expiry / revocation is checked before every send, so a busy socket is cut off too
+            try:
+                decode_token(state["token"])
+            except JWTError:
+                await websocket.close(code=4401)
+                break
+            await websocket.send_json(event)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        receiver.cancel()
+        events.bus.unsubscribe(user_id, sub)
 
 
 def get_user_id_from_auth(authorization: Optional[str]) -> Optional[int]:
@@ -241,8 +807,7 @@ def get_user_id_from_auth(authorization: Optional[str]) -> Optional[int]:
     if authorization and authorization.startswith("Bearer "):
         token = authorization.split(" ", 1)[1]
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            return int(payload.get("sub"))
+            return decode_token(token)
         except JWTError:
             return None
     return None
@@ -258,32 +823,55 @@ def create_chat(msg: BaseModel, user_id: int = Depends(get_current_user_id)):
         reply = "やる気ないなら、Sistaがちょっと手伝うね…"
     with Session(engine) as session:
         chat = ChatMessage(user_id=user_id, message=text, reply=reply)
+        sync.stamp(session, chat, user_id)
         session.add(chat)
+        session.flush()
+        search.index_row(session, "chat", chat)
         session.commit()
         session.refresh(chat)
+        events.publish_change(user_id, "chat", chat)
         return chat
 
 
 @app.post("/chat")
-def proxy_chat(req: ChatRequest, authorization: Optional[str] = Header(None)):
+async def proxy_chat(req: ChatRequest, request: Request, authorization: Optional[str] = Header(None)):
     """
     Proxy endpoint for the LLM. If OPENAI_API_KEY is set, forward to OpenAI's Chat Completions API.
     Expected payload follows LLM_client.py: {user_id, text, role_sheet, over_hallucination, history, compressed_memory}
     Returns JSON with keys: response, debug_info (optional), compressed_memory (optional).
+    Under overload answers 503 + Retry-After instead of queueing past the client's
+    X-Request-Timeout; upstream work is cancelled if the client disconnects.
     """
     # get optional user id from authorization header early
     user_id = get_user_id_from_auth(authorization)
+    deadline = admission.deadline_from_headers(request)
+    admission.admit(INTERACTIVE, deadline, admission.rate_subject(request, user_id))
+    cancel = admission.CancelToken()
+    return await admission.run_until_disconnect(request, lambda: _proxy_chat(req, user_id, deadline, cancel), cancel)
+
+
+def _proxy_chat(req: ChatRequest, user_id: Optional[int], deadline: Optional[float], cancel: admission.CancelToken):
+    # an existing thread supplies its own recent turns; a new one may be seeded with client-side history
+    with Session(engine) as session:
+        conv = conversations.find(session, user_id, req.conversation_id, req.session_key)
+        conversation_id = conv.id if conv else None
+        history = conversations.context(session, conv) if conv else req.history
 
     # Delegate to centralized ai_client
     result = call_llm(
         text=req.text,
-        history=req.history,
+        history=history,
         role_sheet=req.role_sheet,
         user_id=user_id,
         over_hallucination=req.over_hallucination,
         compressed_memory=req.compressed_memory,
+        priority=INTERACTIVE,
+        deadline=deadline,
+        cancel=cancel,
     )
 
+    if result.get('dropped'):
+        raise admission.overloaded(result['error'], 1)
     if 'error' in result:
         # choose an appropriate HTTP status
         raise HTTPException(status_code=502, detail=result['error'])
@@ -293,66 +881,180 @@ def proxy_chat(req: ChatRequest, authorization: Optional[str] = Header(None)):
 
     # store in DB
     with Session(engine) as session:
-        chat = ChatMessage(user_id=user_id or 0, message=req.text, reply=assistant_text)
-        session.add(chat)
+        stored = conversations.append(session, user_id, conversation_id, req.text, assistant_text)
         session.commit()
+        conv, chat = stored["conversation"], stored["row"]
+        session.refresh(conv)
         session.refresh(chat)
+    if user_id:
+        events.publish_change(user_id, "chat", chat)
 
-    return {"response": assistant_text, "debug_info": debug_info, "compressed_memory": result.get('compressed_memory'), "created_at": chat.created_at.isoformat()}
+    thread = {"conversation_id": conv.id, "seq": chat.seq}
+    if conv.session_key:
+        thread["session_key"] = conv.session_key
+    return {"response": assistant_text, "debug_info": debug_info, "compressed_memory": result.get('compressed_memory'),
+            "created_at": chat.created_at.isoformat(), **thread}
 
 
 @app.post("/api/execute")
-async def execute_step(req: dict):
-    return {"result": f"『{req.get('task')}』の最初の一歩を実行しました！（妹が代行）"}
+async def execute_step(req: dict, authorization: Optional[str] = Header(None)):
+    """
+    Run a first-step action on the action executor (see actions.py).
+    Body: {"action": name (default "first_step"), "params": {...}, "task": title, "task_id": id,
+    "dry_run": bool, "stream": bool}. Waits for the run and returns {"result": message, "run": ...};
+    with stream the run's state is streamed as NDJSON on every transition instead. Runs still
+    going after the wait come back with 202 and can be followed on the WebSocket or /actions/runs/{id}.
+    """
+    user_id = get_user_id_from_auth(authorization)
+    if not user_id:
+        if req.get("action"):
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        return {"result": f"『{req.get('task')}』の最初の一歩を実行しました！（妹が代行）"}
+    name = req.get("action") or "first_step"
+    params = req.get("params") or {}
+    if name == "first_step" and isinstance(params, dict):
+        params = dict(params, task=params.get("task") or req.get("task"))
+    task_id = req.get("task_id")
+    # subscribe before submitting so no transition is missed
+    sub = events.bus.subscribe(user_id)
+    try:
+        run = await run_in_threadpool(actions.executor.submit, user_id, name, params, task_id, bool(req.get("dry_run")))
+    except Exception:
+        events.bus.unsubscribe(user_id, sub)
+        raise
+    wait = actions.executor.timeout + 5
+
+    if req.get("stream"):
+        async def stream():
+            try:
+                async for data in actions.watch(user_id, sub, run.id, wait):
+                    yield serialization.dumps_json(data) + b"\n"
+            finally:
+                events.bus.unsubscribe(user_id, sub)
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    data = actions.run_dict(run)
+    try:
+        async for data in actions.watch(user_id, sub, run.id, wait):
+            pass
+    finally:
+        events.bus.unsubscribe(user_id, sub)
+    if data["status"] not in actions.TERMINAL:
+        return JSONResponse(status_code=202, content=jsonable_encoder({"result": "実行中だよ", "run": data}))
+    message = (data.get("result") or {}).get("message") or data.get("error") or data["status"]
+    return {"result": message, "run": data}
+
+
+@app.get("/actions")
+def list_actions():
+    return actions.catalog()
+
+
+@app.get("/actions/runs")
+def list_action_runs(limit: int = Query(50, ge=1, le=500), user_id: int = Depends(get_current_user_id)):
+    with Session(engine) as session:
+        runs = session.exec(
+            select(ActionRun).where(ActionRun.user_id == user_id).order_by(ActionRun.id.desc()).limit(limit)
+        ).all()
+        return [actions.run_dict(r) for r in runs]
+
+
+@app.get("/actions/runs/{run_id}")
+def get_action_run(run_id: int, user_id: int = Depends(get_current_user_id)):
+    with Session(engine) as session:
+        run = session.get(ActionRun, run_id)
+        if not run or run.user_id != user_id:
+            raise HTTPException(status_code=404, detail="Run not found")
+        return actions.run_dict(run)
 
 
 # --- AI decomposition endpoint (returns JSON-formatted ToDo list) ---
+decompose_flight = SingleFlight("decompose")
+
+
 @app.post('/ai/todos')
-def ai_todos(req: AIDecomposeRequest, authorization: Optional[str] = Header(None)):
+async def ai_todos(req: AIDecomposeRequest, request: Request, authorization: Optional[str] = Header(None)):
     """
     Produce a JSON ToDo list for a given prompt. This is a simple, deterministic decomposition
     used by the Streamlit dashboard. Returns: {"todos": [AITodo, ...]}
+    Same admission control and disconnect handling as /chat. Prompts matching a rule_decompose
+    template, and near-duplicates of earlier prompts (semantic cache), are answered without the LLM;
+    a prompt already being decomposed for the same user waits for that result instead.
     """
     prompt = (req.prompt or '').strip()
     if not prompt:
         return {"todos": []}
 
-    # Try to delegate decomposition to the LLM using centralized call_llm
+    # common goals are answered from the template library before admission control or any cache
+    local = _rule_todos(prompt)
+    if local:
+        return local
     user_id = get_user_id_from_auth(authorization)
-    llm_result = call_llm(text=prompt, history=None, role_sheet=None, user_id=user_id)
+    if semantic_cache is not None:
+        hit = semantic_cache.lookup(prompt, user_id)
+        if hit:
+            return {"todos": hit["value"], "debug": {"semantic_cache": {"similarity": hit["similarity"], "matched_prompt": hit["matched_prompt"]}}}
+    deadline = admission.deadline_from_headers(request)
+    admission.admit(DECOMPOSITION, deadline, admission.rate_subject(request, user_id))
+    cancel = admission.CancelToken()
+    # the same prompt sent again while it is being decomposed (by any worker) waits for that result
+    key = f"{user_id or 0}:{hashlib.sha1(rule_decompose.normalize(prompt).encode('utf-8')).hexdigest()}"
+    result = await admission.run_until_disconnect(
+        request, lambda: decompose_flight.do(key, lambda: _ai_todos(prompt, user_id, deadline, cancel)), cancel)
+    # only real LLM decompositions are worth reusing, not the local fallback
+    if semantic_cache is not None and result.get("todos") and not {"llm_error", "rules"} & set(result.get("debug") or {}):
+        semantic_cache.store(prompt, result["todos"], user_id)
+    return result
+
+
+def _parse_steps(text: str):
+    """JSON array of steps from a decomposition reply; tolerates code fences and a cut-off closing bracket."""
+    import json
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`').strip()
+        if text.lower().startswith('json'):
+            text = text[4:].strip()
+    # a stop sequence / max_tokens may have cut the reply right before the closing bracket
+    for candidate in (text, text + ']', text + '"]'):
+        try:
+            parsed = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict):
+            parsed = parsed.get('steps')
+        return parsed if isinstance(parsed, list) else None
+    return None
+
+
+def _rule_todos(prompt: str) -> Optional[Dict[str, Any]]:
+    hit = rule_decompose.engine.confident(prompt)
+    if not hit:
+        return None
+    return {"todos": rule_decompose.todos_from(hit["steps"]), "debug": {"rules": {"template": hit["template"], "confidence": hit["confidence"]}}}
+
+
+def _ai_todos(prompt: str, user_id: Optional[int], deadline: Optional[float], cancel: admission.CancelToken, priority: int = DECOMPOSITION):
+    local = _rule_todos(prompt)
+    if local:
+        return local
+    # Try to delegate decomposition to the LLM using centralized call_llm
+    llm_result = call_llm(text=prompt, history=None, role_sheet=None, user_id=user_id, priority=priority, deadline=deadline, cancel=cancel,
+                          profile="decompose")
+    if llm_result.get('dropped'):
+        # nobody is waiting for a fallback answer either
+        raise admission.overloaded(llm_result['error'], 1)
     if 'error' in llm_result:
-        # Fall back to local heuristics but surface error info
-        # Keep behavior robust: return local decomposition plus debug
-        local = []
-        parts = [p.strip() for p in prompt.replace('、', ',').split(',') if p.strip()]
-        if len(parts) > 1:
-            for i, p in enumerate(parts):
-                local.append({"id": i+1, "title": p, "status": "pending", "order": i+1})
-            return {"todos": local, "debug": {"llm_error": llm_result.get('error')}}
-        sentences = [s.strip() for s in prompt.replace('。', '.').split('.') if s.strip()]
-        if len(sentences) > 1:
-            for i, s in enumerate(sentences):
-                local.append({"id": i+1, "title": s, "status": "pending", "order": i+1})
-            return {"todos": local, "debug": {"llm_error": llm_result.get('error')}}
-        words = prompt.split()
-        if len(words) <= 3:
-            local.append({"id": 1, "title": f"{prompt} を小さく試す", "status": "pending", "order": 1})
-            return {"todos": local, "debug": {"llm_error": llm_result.get('error')}}
-        for i, piece in enumerate([words[0], ' '.join(words[1:2] if len(words) > 1 else words[0:1]), '報告する']):
-            local.append({"id": i+1, "title": piece if piece else f"Step {i+1}", "status": "pending", "order": i+1})
-        return {"todos": local, "debug": {"llm_error": llm_result.get('error')}}
+        # offline fallback: template library / the user's own enumeration, with the error surfaced
+        local = rule_decompose.fallback(prompt)
+        return {"todos": local["todos"], "debug": {"llm_error": llm_result.get('error'), "rules": local["rules"]}}
 
     # llm_result has 'response' -- try to parse it into a list of todo titles
     resp_text = llm_result.get('response') or ''
     todos: List[Dict[str, Any]] = []
 
-    # If the model returned JSON array, try to parse
-    import json
-    parsed = None
-    try:
-        parsed = json.loads(resp_text)
-    except Exception:
-        parsed = None
+    # The decompose profile asks for a JSON array, or {"steps": [...]} in JSON/schema mode
+    parsed = _parse_steps(resp_text)
 
     if isinstance(parsed, list):
         for i, item in enumerate(parsed):
@@ -388,3 +1090,7 @@ def ai_todos(req: AIDecomposeRequest, authorization: Optional[str] = Header(None
     for i, p in enumerate(parts):
         todos.append({"id": i+1, "title": p, "status": "pending", "order": i+1})
     return {"todos": todos, "debug": {"llm_raw": llm_result.get('debug_info')}}
+
+
+# speculative first steps reuse the /ai/todos decomposition at background priority
+speculative.precomputer.decompose = lambda prompt, user_id, cancel: _ai_todos(prompt, user_id, None, cancel, priority=BACKGROUND)
@@ -0,0 +1,256 @@
+"""
+Versioned schema migrations. Applied versions are recorded in `schema_migrations`, so a
+restarted pod only reads one small table instead of reflecting the whole schema. On Postgres an
+advisory lock serialises concurrent pods during a rolling deploy.
+
+Add new migrations to MIGRATIONS with the next version number; never edit an applied one.
+Version 1 creates the frozen pre-migration schema (and tops up databases from before it), so
+every later step runs its own DDL in order on fresh and legacy databases alike. Tables created
+by a migration from models.py get the model's current columns; keep later column additions
+idempotent with the helpers below.
+"""
+import logging
+import uuid
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import SQLModel
+
+logger = logging.getLogger("sista.migrations")
+
+_LOCK_ID = 74_121_001
+
+
+def add_column_if_missing(conn: Connection, table: str, column: str, ddl_type: str, default: str = None, index: bool = False):
+    if column in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return
+    ddl = f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl_type}'
+    if default is not None:
+        ddl += f" DEFAULT {default}"
+    conn.execute(text(ddl))
+    if index:
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS "ix_{table}_{column}" ON "{table}" ("{column}")'))
+
+
+def _baseline_tables() -> MetaData:
+    """
+    The schema as it was when versioned migrations were introduced, frozen here so that later
+    migrations really run their DDL on fresh databases too. Never change this to follow models.py.
+    """
+    metadata = MetaData()
+    Table("user", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("username", String, nullable=False, index=True, unique=True),
+          Column("hashed_password", String, nullable=False),
+          Column("created_at", DateTime, nullable=False))
+    Table("tokenversion", metadata,
+          Column("user_id", Integer, primary_key=True, autoincrement=False),
+          Column("version", Integer, nullable=False),
+          Column("removed", Boolean, nullable=False),
+          Column("updated_at", DateTime, nullable=False))
+    Table("chatmessage", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+          Column("message", String, nullable=False),
+          Column("reply", String),
+          Column("created_at", DateTime, nullable=False),
+          Column("change_version", Integer, nullable=False, server_default="0", index=True),
+          Column("updated_at", DateTime))
+    Table("task", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("title", String, nullable=False),
+          Column("status", String, nullable=False),
+          Column("category", String),
+          Column("due_date", String),
+          Column("created_at", DateTime, nullable=False),
+          Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+          Column("change_version", Integer, nullable=False, server_default="0", index=True),
+          Column("updated_at", DateTime))
+    Table("synccounter", metadata,
+          Column("user_id", Integer, primary_key=True, autoincrement=False),
+          Column("value", Integer, nullable=False))
+    Table("tombstone", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("user_id", Integer, nullable=False, index=True),
+          Column("entity", String, nullable=False),
+          Column("entity_id", Integer, nullable=False),
+          Column("change_version", Integer, nullable=False, index=True),
+          Column("deleted_at", DateTime, nullable=False))
+    Table("sharedstate", metadata,
+          Column("key", String, primary_key=True),
+          Column("value", String, nullable=False),
+          Column("expires_at", DateTime, index=True))
+    return metadata
+
+
+def _baseline(conn: Connection):
+    _baseline_tables().create_all(conn)
+    # databases created before versioned migrations may predate the sync columns
+    for table in ("task", "chatmessage"):
+        add_column_if_missing(conn, table, "change_version", "INTEGER", default="0", index=True)
+        add_column_if_missing(conn, table, "updated_at", "TIMESTAMP")
+
+
+def _search_index(conn: Connection):
+    import search
+    search.ensure_search_index(conn)
+
+
+def _import_keys(conn: Connection):
+    from models import ImportKey
+    SQLModel.metadata.create_all(conn, tables=[ImportKey.__table__])
+
+
+def _task_stats(conn: Connection):
+    from sqlmodel import Session
+    from models import TaskStat
+    import task_stats
+    SQLModel.metadata.create_all(conn, tables=[TaskStat.__table__])
+    # "oldest untouched task" reads (user_id, updated_at); older rows never had updated_at set
+    conn.execute(text("UPDATE task SET updated_at = created_at WHERE updated_at IS NULL"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_task_user_id_updated_at ON task (user_id, updated_at)"))
+    with Session(bind=conn) as session:
+        task_stats.rebuild(session)
+        session.flush()
+
+
+def _reminders(conn: Connection):
+    from sqlmodel import Session, select
+    from models import Reminder, ReminderSettings, Task
+    import reminders
+    add_column_if_missing(conn, "task", "due_at", "TIMESTAMP", index=True)
+    SQLModel.metadata.create_all(conn, tables=[ReminderSettings.__table__, Reminder.__table__])
+    with Session(bind=conn) as session:
+        last_id = 0
+        while True:
+            tasks = session.exec(select(Task).where(Task.id > last_id).order_by(Task.id).limit(1000)).all()
+            if not tasks:
+                break
+            for task in tasks:
+                if task.due_at is None and task.due_date:
+                    task.due_at = reminders.parse_due(task.due_date)
+                    session.add(task)
+                reminders.schedule_task(session, task)
+            last_id = tasks[-1].id
+            session.flush()
+            session.expunge_all()
+
+
+def _webhook_outbox(conn: Connection):
+    from models import WebhookDelivery
+    SQLModel.metadata.create_all(conn, tables=[WebhookDelivery.__table__])
+    # the dispatcher's claim query: pending rows by due time
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_webhookdelivery_status_next_attempt_at ON webhookdelivery (status, next_attempt_at)"))
+
+
+def _task_plans(conn: Connection):
+    from models import TaskPlan
+    SQLModel.metadata.create_all(conn, tables=[TaskPlan.__table__])
+
+
+def _action_runs(conn: Connection):
+    from models import ActionRun
+    SQLModel.metadata.create_all(conn, tables=[ActionRun.__table__])
+
+
+def _conversations(conn: Connection):
+    from models import AnonymousMessage, Conversation
+    SQLModel.metadata.create_all(conn, tables=[Conversation.__table__, AnonymousMessage.__table__])
+    add_column_if_missing(conn, "chatmessage", "conversation_id", "INTEGER")
+    add_column_if_missing(conn, "chatmessage", "seq", "INTEGER")
+    # thread reads are range scans on (conversation_id, seq); /chats pages by (user_id, id)
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_chatmessage_conversation_id_seq ON chatmessage (conversation_id, seq)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chatmessage_user_id_id ON chatmessage (user_id, id)"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_anonymousmessage_conversation_id_seq ON anonymousmessage (conversation_id, seq)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_conversation_user_id_updated_at ON conversation (user_id, updated_at)"))
+    # anonymous threads are pruned by idle time
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_conversation_anonymous_updated_at ON conversation (updated_at) WHERE session_key IS NOT NULL"))
+
+
+def _sync_backfill(conn: Connection):
+    # rows written before /sync existed kept change_version 0 and their users had no counter, so
+    # /sync?since=0 answered "nothing changed"; version them 1 and start each counter above that
+    for table in ("task", "chatmessage"):
+        conn.execute(text(f"UPDATE {table} SET change_version = 1 WHERE change_version IS NULL OR change_version = 0"))
+    conn.execute(text(
+        "INSERT INTO synccounter (user_id, value) "
+        "SELECT user_id, MAX(change_version) FROM ("
+        "SELECT user_id, change_version FROM task UNION ALL SELECT user_id, change_version FROM chatmessage"
+        ") AS versioned WHERE user_id NOT IN (SELECT user_id FROM synccounter) GROUP BY user_id"
+    ))
+
+
+def _search_bigrams(conn: Connection):
+    import search
+    search.ensure_bigram_index(conn)
+
+
+def _deployment_id(conn: Connection):
+    # random id of this deployment, written into exports so an import can tell its own data apart
+    conn.execute(text("CREATE TABLE IF NOT EXISTS deployment (id VARCHAR(36) PRIMARY KEY)"))
+    if conn.execute(text("SELECT id FROM deployment")).first() is None:
+        conn.execute(text("INSERT INTO deployment (id) VALUES (:id)"), {"id": str(uuid.uuid4())})
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline", _baseline),
+    (2, "search_index", _search_index),
+    (3, "import_keys", _import_keys),
+    (4, "task_stats", _task_stats),
+    (5, "reminders", _reminders),
+    (6, "webhook_outbox", _webhook_outbox),
+    (7, "task_plans", _task_plans),
+    (8, "action_runs", _action_runs),
+    (9, "conversations", _conversations),
+    (10, "sync_backfill", _sync_backfill),
+    (11, "search_bigrams", _search_bigrams),
+    (12, "deployment_id", _deployment_id),
+]
+HEAD = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn: Connection):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def deployment_id(engine: Engine) -> str:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT id FROM deployment")).scalar_one()
+
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_migrations"):
+            return 0
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar() or 0
+
+
+def upgrade(engine: Engine) -> int:
+    """Apply pending migrations, one transaction each. Returns the resulting schema version."""
+    postgres = engine.dialect.name == "postgresql"
+    with engine.connect() as lock_conn:
+        if postgres:
+            lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": _LOCK_ID})
+            lock_conn.commit()  # the lock is session-level; don't sit idle in a transaction
+        try:
+            with engine.begin() as conn:
+                _ensure_version_table(conn)
+                applied = {r[0] for r in conn.execute(text("SELECT version FROM schema_migrations"))}
+            for version, name, fn in MIGRATIONS:
+                if version in applied:
+                    continue
+                logger.info("applying migration %s %s", version, name)
+                with engine.begin() as conn:
+                    fn(conn)
+                    conn.execute(text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                                 {"v": version, "n": name, "t": datetime.utcnow()})
+        finally:
+            if postgres:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _LOCK_ID})
+                lock_conn.commit()
+    return current_version(engine)
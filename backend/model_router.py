@@ -0,0 +1,79 @@
+"""
+Model tiering for call_llm. Most calls (decomposition, background work, short chats) go to a
+small fast model; long or many-turn conversations go to the large one, unless the upstream
+queue is already deep, in which case they fall back to the small model too.
+
+LLM_MODEL_SMALL / LLM_MODEL_LARGE default to OPENAI_MODEL, so with neither set there is one
+tier and nothing changes. Large-model calls are charged LLM_LARGE_COST in the scheduler's fair
+queuing, so a user holding long conversations does not crowd out everyone else.
+"""
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from llm_scheduler import scheduler, INTERACTIVE
+
+_DEFAULT_MODEL = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+LLM_MODEL_SMALL = os.environ.get("LLM_MODEL_SMALL") or _DEFAULT_MODEL
+LLM_MODEL_LARGE = os.environ.get("LLM_MODEL_LARGE") or _DEFAULT_MODEL
+# a chat is "long" from this many characters (prompt + history) or this many history turns
+LLM_LARGE_MIN_CHARS = int(os.environ.get("LLM_LARGE_MIN_CHARS", "1200"))
+LLM_LARGE_MIN_TURNS = int(os.environ.get("LLM_LARGE_MIN_TURNS", "8"))
+# with more calls than this waiting, long chats are served by the small model as well
+LLM_LARGE_MAX_QUEUE = int(os.environ.get("LLM_LARGE_MAX_QUEUE", "2"))
+LLM_LARGE_COST = float(os.environ.get("LLM_LARGE_COST", "3"))
+
+
+def _history_chars(history: Optional[List[Any]]) -> int:
+    total = 0
+    for h in history or []:
+        content = h.get("content") if isinstance(h, dict) else h
+        total += len(str(content or ""))
+    return total
+
+
+class ModelRouter:
+    def __init__(self, small: str = LLM_MODEL_SMALL, large: str = LLM_MODEL_LARGE, min_chars: int = LLM_LARGE_MIN_CHARS,
+                 min_turns: int = LLM_LARGE_MIN_TURNS, max_queue: int = LLM_LARGE_MAX_QUEUE, large_cost: float = LLM_LARGE_COST):
+        self.small = small
+        self.large = large
+        self.min_chars = min_chars
+        self.min_turns = min_turns
+        self.max_queue = max_queue
+        self.large_cost = large_cost
+        self._lock = threading.Lock()
+        self._choices: Counter = Counter()
+
+    @property
+    def models(self) -> List[str]:
+        return [self.small] if self.small == self.large else [self.small, self.large]
+
+    def choose(self, text: str, history: Optional[List[Any]] = None, priority: int = INTERACTIVE,
+               profile: Optional[str] = None) -> Tuple[str, str]:
+        """(model, reason) for one call."""
+        if self.small == self.large:
+            model, reason = self.small, "single"
+        elif profile or priority != INTERACTIVE:
+            # structured operations (decomposition) and non-interactive work never need the big model
+            model, reason = self.small, "operation"
+        elif len(text or "") + _history_chars(history) < self.min_chars and len(history or []) < self.min_turns:
+            model, reason = self.small, "short"
+        elif scheduler.queue_depth() > self.max_queue:
+            model, reason = self.small, "load"
+        else:
+            model, reason = self.large, "long"
+        with self._lock:
+            self._choices[(model, reason)] += 1
+        return model, reason
+
+    def cost(self, model: str) -> float:
+        return self.large_cost if model == self.large and self.small != self.large else 1.0
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            choices = [{"model": m, "reason": r, "calls": n} for (m, r), n in sorted(self._choices.items())]
+        return {"small": self.small, "large": self.large, "choices": choices}
+
+
+router = ModelRouter()
@@ -0,0 +1,178 @@
+from sqlalchemy import UniqueConstraint
+from sqlmodel import SQLModel, Field
+from typing import Optional
+from datetime import datetime
+
+
+class User(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    username: str = Field(index=True, unique=True)
+    hashed_password: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class TokenVersion(SQLModel, table=True):
+    # per-user token generation; only written on logout / user removal
+    user_id: int = Field(primary_key=True)
+    version: int = 0
+    removed: bool = False
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ChatMessage(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    message: str
+    reply: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # per-user change counter value of the last write (see SyncCounter)
+    change_version: int = Field(default=0, index=True, sa_column_kwargs={"server_default": "0"})
+    updated_at: Optional[datetime] = None
+    # thread and position in it (see conversations.py); null for messages from before threads
+    conversation_id: Optional[int] = Field(default=None, foreign_key="conversation.id")
+    seq: Optional[int] = None
+
+
+class Conversation(SQLModel, table=True):
+    # a chat thread: a signed-in user's (turns in ChatMessage) or an anonymous session's (AnonymousMessage)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    # anonymous threads only: the unguessable key the client presents instead of a login
+    session_key: Optional[str] = Field(default=None, unique=True)
+    title: Optional[str] = None
+    last_seq: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class AnonymousMessage(SQLModel, table=True):
+    # turns of anonymous threads, kept apart from users' chat history and pruned when idle
+    id: Optional[int] = Field(default=None, primary_key=True)
+    conversation_id: int = Field(foreign_key="conversation.id")
+    seq: int
+    message: str
+    reply: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Task(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    title: str
+    status: str = "pending"
+    category: Optional[str] = None
+    due_date: Optional[str] = None
+    # typed due time (UTC) parsed from due_date or set directly; drives due reminders
+    due_at: Optional[datetime] = Field(default=None, index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # user_id is required: tasks belong to a user
+    user_id: int = Field(foreign_key="user.id")
+    change_version: int = Field(default=0, index=True, sa_column_kwargs={"server_default": "0"})
+    updated_at: Optional[datetime] = None
+
+
+class SyncCounter(SQLModel, table=True):
+    # monotonic per-user counter, bumped on every task/chat insert, update or delete
+    user_id: int = Field(primary_key=True)
+    value: int = 0
+
+
+class Tombstone(SQLModel, table=True):
+    # records deletions so /sync can tell clients what to drop
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    entity: str
+    entity_id: int
+    change_version: int = Field(index=True)
+    deleted_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class SharedState(SQLModel, table=True):
+    # key/value rows for shared_state.SqlStateBackend (background job status)
+    key: str = Field(primary_key=True)
+    value: str
+    expires_at: Optional[datetime] = Field(default=None, index=True)
+
+
+class ImportKey(SQLModel, table=True):
+    # idempotency keys of rows created by POST /import, so a retried upload doesn't duplicate data
+    __table_args__ = (UniqueConstraint("user_id", "key"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    key: str
+    entity: str
+    entity_id: int
+
+
+class TaskStat(SQLModel, table=True):
+    # per-user task counters kept current on every task write (see task_stats.py);
+    # dimension is "status" or "category", key the value ("" for no category)
+    user_id: int = Field(primary_key=True)
+    dimension: str = Field(primary_key=True)
+    key: str = Field(primary_key=True)
+    count: int = 0
+
+
+class ReminderSettings(SQLModel, table=True):
+    # per-user 鬼電モード / neglect settings (previously only kept in the Streamlit session)
+    user_id: int = Field(primary_key=True)
+    alarm_enabled: bool = False
+    neglect_days: int = 3
+    webhook_url: Optional[str] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Reminder(SQLModel, table=True):
+    # pending due/neglect events, one per (task, kind); the scheduler loads them by fire_at range
+    __table_args__ = (UniqueConstraint("task_id", "kind"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    task_id: int
+    kind: str
+    fire_at: datetime = Field(index=True)
+
+
+class WebhookDelivery(SQLModel, table=True):
+    # transactional outbox for outgoing webhooks (see webhooks.py): written in the same
+    # transaction as the change that triggers it, delivered asynchronously
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    url: str
+    # scheme://host:port, the unit of batching and of the per-destination concurrency cap
+    destination: str
+    payload: str
+    status: str = Field(default="pending", index=True)  # pending | delivered | dead
+    attempts: int = 0
+    # due time while pending; pushed forward by a lease while a worker is delivering it
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    delivered_at: Optional[datetime] = None
+
+
+class TaskPlan(SQLModel, table=True):
+    # first step + sub-steps of a task, decomposed speculatively in the background after create_task
+    task_id: int = Field(primary_key=True)
+    user_id: int = Field(index=True)
+    status: str = "pending"  # pending | ready | failed
+    first_step: Optional[str] = None
+    steps: Optional[str] = None  # JSON list of {"id", "title", "status", "order"}
+    source: Optional[str] = None  # llm | rules | cache | fallback
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = None
+
+
+class ActionRun(SQLModel, table=True):
+    # one execution of a registered action (see actions.py); also the result store clients poll
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    task_id: Optional[int] = None
+    action: str
+    params: str  # JSON object, as validated
+    dry_run: bool = False
+    status: str = "queued"  # queued | running | done | failed | timeout
+    result: Optional[str] = None  # JSON
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,308 @@
+"""
+Admin-only profiling, for finding where a request's time goes without a redeploy.
+
+- Sampler: for N seconds, a thread snapshots every thread's stack each few milliseconds and
+  counts them in collapsed-stack format ("frame;frame;frame count" per line), which
+  flamegraph.pl / speedscope / inferno read directly. The thread exists only while sampling.
+- Per-request cProfile: a request carrying X-Profile: 1 and a valid X-Admin-Token is profiled
+  on the event loop thread and, through ProfiledRoute, inside the threadpool thread that runs a
+  sync endpoint. The result is kept in a small ring and its id returned in X-Profile-Id.
+- Slow-request log: while enabled (SLOW_REQUEST_MS or the admin endpoint), SQLAlchemy cursor
+  events on the engine time every statement of the current request; requests slower than the
+  threshold are logged with their slowest statements.
+
+When nothing is enabled the middleware costs one header scan per request and no SQLAlchemy
+listeners are attached.
+"""
+import collections
+import contextvars
+import cProfile
+import functools
+import hmac
+import inspect
+import io
+import itertools
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi import Header, HTTPException
+from fastapi.routing import APIRoute
+from sqlalchemy import event as sa_event
+
+from db import engine
+
+logger = logging.getLogger("sista.profiling")
+
+# unset: the admin surface answers 404 and X-Profile is ignored
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "20"))
+SLOW_REQUEST_KEEP = int(os.environ.get("SLOW_REQUEST_KEEP", "200"))
+SAMPLER_MAX_SECONDS = 300
+_STATEMENT_CHARS = 500
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+# --- sampling profiler ---
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class Sampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+
+    def sample(self, seconds: float, interval: float) -> str:
+        """Sample all threads for `seconds`; returns the collapsed stacks. Blocks the calling thread."""
+        with self._lock:
+            if self._running:
+                raise HTTPException(status_code=409, detail="A sampling run is already in progress")
+            self._running = True
+        try:
+            me = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            counts: collections.Counter = collections.Counter()
+            samples = 0
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        counts[f"{names.get(ident, ident)};{_collapse(frame)}"] += 1
+                samples += 1
+                time.sleep(interval)
+            lines = [f"{stack} {n}" for stack, n in counts.most_common()]
+            logger.info("sampler: %d samples over %.1fs, %d distinct stacks", samples, seconds, len(counts))
+            return "\n".join(lines) + "\n"
+        finally:
+            with self._lock:
+                self._running = False
+
+
+sampler = Sampler()
+
+
+# --- per-request cProfile ---
+
+_request_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("request_profile", default=None)
+_profile_ids = itertools.count(1)
+# one cProfile per thread: concurrent profiled requests share the loop thread, so only the first gets it
+_loop_profile_active = False
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.id = next(_profile_ids)
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.duration_ms: Optional[float] = None
+        self._lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+
+    def add(self, profile: cProfile.Profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def stats(self) -> Optional[pstats.Stats]:
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for p in profiles[1:]:
+            stats.add(p)
+        return stats
+
+    def text(self, sort: str = "cumulative", limit: int = 60) -> str:
+        stats = self.stats()
+        if stats is None:
+            return "no profile data\n"
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self) -> bytes:
+        """pstats binary format (what Stats.dump_stats writes), for snakeviz / pstats.Stats(file)."""
+        stats = self.stats()
+        return marshal.dumps(stats.stats) if stats is not None else b""
+
+    def summary(self) -> Dict[str, Any]:
+        return {"id": self.id, "method": self.method, "path": self.path, "started": self.started, "duration_ms": self.duration_ms}
+
+
+_profiles: Deque[RequestProfile] = collections.deque(maxlen=PROFILE_KEEP)
+
+
+def recent_profiles() -> List[Dict[str, Any]]:
+    return [p.summary() for p in reversed(_profiles)]
+
+
+def get_profile(profile_id: int) -> Optional[RequestProfile]:
+    for p in _profiles:
+        if p.id == profile_id:
+            return p
+    return None
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Wraps sync endpoints so a profiled request is also profiled in the threadpool thread that
+    runs it (cProfile only sees the thread it is enabled in). Async endpoints are left alone.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = _profiled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _profiled(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        capture = _request_profile.get()
+        if capture is None:
+            return fn(*args, **kwargs)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            capture.add(profile)
+    return wrapper
+
+
+# --- slow-request log ---
+
+_request_queries: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_queries", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_queries.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = _request_queries.get()
+    started = conn.info.get("query_started")
+    if queries is not None and started:
+        queries.append((statement, (time.perf_counter() - started.pop()) * 1000))
+
+
+class SlowLog:
+    def __init__(self, threshold_ms: float = SLOW_REQUEST_MS):
+        self.threshold_ms = 0.0
+        self.entries: Deque[Dict[str, Any]] = collections.deque(maxlen=SLOW_REQUEST_KEEP)
+        self._lock = threading.Lock()
+        self.set_threshold(threshold_ms)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def set_threshold(self, threshold_ms: float):
+        """0 disables the log and detaches the SQLAlchemy listeners."""
+        with self._lock:
+            was, self.threshold_ms = self.enabled, max(0.0, threshold_ms)
+            if self.enabled and not was:
+                sa_event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+                sa_event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+            elif was and not self.enabled:
+                sa_event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+                sa_event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+
+    def record(self, method: str, path: str, status: Optional[int], duration_ms: float, queries: list):
+        total_sql = sum(ms for _, ms in queries)
+        slowest = sorted(queries, key=lambda q: q[1], reverse=True)[:10]
+        entry = {
+            "at": time.time(),
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(duration_ms, 2),
+            "sql_count": len(queries),
+            "sql_ms": round(total_sql, 2),
+            "slowest_sql": [{"ms": round(ms, 2), "statement": stmt[:_STATEMENT_CHARS]} for stmt, ms in slowest],
+        }
+        self.entries.append(entry)
+        logger.warning("slow request %s %s: %.0f ms (%d queries, %.0f ms SQL)", method, path, duration_ms, len(queries), total_sql)
+
+
+slow_log = SlowLog()
+
+
+# --- ASGI middleware ---
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        capture = None
+        if ADMIN_TOKEN:
+            headers = dict(scope["headers"])
+            if headers.get(b"x-profile") in (b"1", b"true") and is_admin(headers.get(b"x-admin-token", b"").decode("latin-1")):
+                capture = RequestProfile(scope["method"], scope["path"])
+        if capture is None and not slow_log.enabled:
+            return await self.app(scope, receive, send)
+
+        status: Dict[str, Any] = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if capture is not None:
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"x-profile-id", str(capture.id).encode())])
+            await send(message)
+
+        queries: Optional[list] = [] if slow_log.enabled else None
+        tokens = (_request_profile.set(capture), _request_queries.set(queries))
+        global _loop_profile_active
+        profile = None
+        if capture is not None and not _loop_profile_active:
+            # the event loop thread: middleware, async endpoints and everything else running meanwhile
+            _loop_profile_active = True
+            profile = cProfile.Profile()
+            profile.enable()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if profile is not None:
+                profile.disable()
+                _loop_profile_active = False
+                capture.add(profile)
+            if capture is not None:
+                capture.duration_ms = round(duration_ms, 2)
+                _profiles.append(capture)
+            _request_profile.reset(tokens[0])
+            _request_queries.reset(tokens[1])
+            if queries is not None and duration_ms >= slow_log.threshold_ms:
+                slow_log.record(scope["method"], scope["path"], status.get("code"), duration_ms, queries)
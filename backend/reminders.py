@@ -0,0 +1,261 @@
+"""
+Due-date (鬼電モード) and neglect (放置日数で逆ギレ) reminders.
+
+Every open task has at most one pending Reminder row per kind, kept current by the task
+endpoints. The table is the source of truth, so nothing is lost on restart. Each worker runs a
+ReminderScheduler that loads only the next REMINDER_WINDOW_SECONDS of reminders with an index
+range query on fire_at into a min-heap and sleeps until the earliest one. A reminder is claimed
+with a row lock before firing, so with several workers each fires exactly once.
+Neglect reminders re-arm themselves for another `neglect_days`; due reminders fire once.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import event as sa_event
+from sqlmodel import Session, select
+
+import events
+from db import engine
+from models import Reminder, ReminderSettings, Task
+from task_stats import DONE_STATUSES
+
+logger = logging.getLogger("sista.reminders")
+
+REMINDERS_ENABLED = os.environ.get("REMINDERS", "1").lower() in ("1", "true", "yes")
+# how far ahead each range query looks, and how often it is repeated
+REMINDER_WINDOW_SECONDS = int(os.environ.get("REMINDER_WINDOW_SECONDS", "300"))
+REMINDER_REFRESH_SECONDS = int(os.environ.get("REMINDER_REFRESH_SECONDS", "60"))
+# upper bound on rows held in memory per window
+REMINDER_BATCH = int(os.environ.get("REMINDER_BATCH", "10000"))
+
+# zone of due dates typed without an offset ("2024/05/01 09:00" is 09:00 on the user's clock)
+DUE_TZ = ZoneInfo(os.environ.get("DUE_TZ", "Asia/Tokyo"))
+
+_DUE_FORMATS = ("%Y/%m/%d %H:%M", "%Y/%m/%d", "%Y-%m-%d %H:%M", "%Y.%m.%d")
+
+
+def parse_due(value: Any, tz: tzinfo = DUE_TZ) -> Optional[datetime]:
+    """
+    Best-effort parse of the free-form due_date string into a naive UTC datetime. Values without
+    an offset are read as local time in `tz` (DUE_TZ); pass timezone.utc for stored UTC values.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        text = str(value).strip()
+        try:
+            dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+        except ValueError:
+            for fmt in _DUE_FORMATS:
+                try:
+                    dt = datetime.strptime(text, fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz)
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def get_settings(session: Session, user_id: int) -> ReminderSettings:
+    return session.get(ReminderSettings, user_id) or ReminderSettings(user_id=user_id)
+
+
+def _after_commit(session: Session):
+    pending = session.info.pop("reminders_pending", [])
+    for reminder_id, fire_at in pending:
+        scheduler.notify(reminder_id, fire_at)
+
+
+def _after_rollback(session: Session):
+    session.info.pop("reminders_pending", None)
+
+
+def _queue_notify(session: Session, reminder: Reminder):
+    # only hand the reminder to the scheduler once it is committed and visible to _fire
+    pending = session.info.setdefault("reminders_pending", [])
+    if not session.info.get("reminders_hooked"):
+        sa_event.listen(session, "after_commit", _after_commit)
+        sa_event.listen(session, "after_rollback", _after_rollback)
+        session.info["reminders_hooked"] = True
+    pending.append((reminder.id, reminder.fire_at))
+
+
+def _set(session: Session, task: Task, kind: str, fire_at: Optional[datetime]):
+    reminder = session.exec(select(Reminder).where(Reminder.task_id == task.id, Reminder.kind == kind)).first()
+    if fire_at is None:
+        if reminder is not None:
+            session.delete(reminder)
+        return
+    if reminder is None:
+        reminder = Reminder(user_id=task.user_id, task_id=task.id, kind=kind, fire_at=fire_at)
+    elif reminder.fire_at == fire_at:
+        return
+    reminder.fire_at = fire_at
+    session.add(reminder)
+    session.flush()
+    _queue_notify(session, reminder)
+
+
+def schedule_task(session: Session, task: Task, settings: Optional[ReminderSettings] = None):
+    """(Re)compute a task's reminders. Call once task.id is assigned (after flush)."""
+    if task.status in DONE_STATUSES:
+        cancel_task(session, task.id)
+        return
+    settings = settings or get_settings(session, task.user_id)
+    _set(session, task, "due", task.due_at)
+    touched = task.updated_at or task.created_at
+    _set(session, task, "neglect", touched + timedelta(days=settings.neglect_days))
+
+
+def cancel_task(session: Session, task_id: int):
+    for reminder in session.exec(select(Reminder).where(Reminder.task_id == task_id)).all():
+        session.delete(reminder)
+
+
+def reschedule_user(session: Session, user_id: int, settings: ReminderSettings):
+    """Recompute neglect reminders of all open tasks after neglect_days changed."""
+    tasks = session.exec(select(Task).where(Task.user_id == user_id, Task.status.not_in(DONE_STATUSES))).all()
+    for task in tasks:
+        schedule_task(session, task, settings)
+
+
+class ReminderScheduler:
+    """
+    Min-heap of (fire_at, reminder_id) covering the next window. Entries superseded by a later
+    notify() are skipped lazily; `handlers` are called with every fired event (in this thread).
+    """
+
+    def __init__(self, window: int = REMINDER_WINDOW_SECONDS, refresh: int = REMINDER_REFRESH_SECONDS, batch: int = REMINDER_BATCH):
+        self.window = window
+        self.refresh = refresh
+        self.batch = batch
+        self.handlers: List[Callable[[int, Dict[str, Any]], None]] = []
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[datetime, int]] = []
+        self._queued: Dict[int, datetime] = {}
+        self._loaded_until = datetime.min
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.fired = 0
+        self.skipped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self, reminder_id: int, fire_at: datetime):
+        """Reminder created or moved by this worker; other workers' changes arrive with the next window query."""
+        with self._cond:
+            if fire_at > self._loaded_until:
+                self._queued.pop(reminder_id, None)
+                return
+            self._queued[reminder_id] = fire_at
+            heapq.heappush(self._heap, (fire_at, reminder_id))
+            self._cond.notify()
+
+    def _load_window(self):
+        horizon = datetime.utcnow() + timedelta(seconds=self.window)
+        with Session(engine) as session:
+            rows = session.exec(
+                select(Reminder.id, Reminder.fire_at).where(Reminder.fire_at < horizon).order_by(Reminder.fire_at).limit(self.batch)
+            ).all()
+        with self._cond:
+            # a full batch means more rows are due before the horizon; cover only what was read
+            self._loaded_until = rows[-1][1] if len(rows) >= self.batch else horizon
+            for reminder_id, fire_at in rows:
+                if self._queued.get(reminder_id) != fire_at:
+                    self._queued[reminder_id] = fire_at
+                    heapq.heappush(self._heap, (fire_at, reminder_id))
+            self._cond.notify()
+
+    def _run(self):
+        next_refresh = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() >= next_refresh:
+                    self._load_window()
+                    next_refresh = time.monotonic() + self.refresh
+                due = []
+                with self._cond:
+                    now = datetime.utcnow()
+                    while self._heap and self._heap[0][0] <= now:
+                        fire_at, reminder_id = heapq.heappop(self._heap)
+                        if self._queued.get(reminder_id) == fire_at:
+                            del self._queued[reminder_id]
+                            due.append(reminder_id)
+                    if not due:
+                        wait = next_refresh - time.monotonic()
+                        if self._heap:
+                            wait = min(wait, (self._heap[0][0] - now).total_seconds())
+                        self._cond.wait(timeout=max(0.01, wait))
+                        continue
+                for reminder_id in due:
+                    self._fire(reminder_id)
+            except Exception:
+                logger.exception("reminder scheduler iteration failed")
+                self._stop.wait(5)
+
+    def _fire(self, reminder_id: int):
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            reminder = session.exec(select(Reminder).where(Reminder.id == reminder_id).with_for_update(skip_locked=True)).first()
+            if reminder is None or reminder.fire_at > now:
+                # claimed by another worker, rescheduled or removed meanwhile
+                self.skipped += 1
+                return
+            task = session.get(Task, reminder.task_id)
+            if task is None or task.status in DONE_STATUSES:
+                session.delete(reminder)
+                session.commit()
+                return
+            settings = get_settings(session, task.user_id)
+            touched = task.updated_at or task.created_at
+            payload = {
+                "type": f"reminder.{reminder.kind}",
+                "task_id": task.id,
+                "title": task.title,
+                "due_at": task.due_at,
+                "neglected_days": (now - touched).days,
+                "fire_at": reminder.fire_at,
+            }
+            if reminder.kind == "neglect":
+                reminder.fire_at = now + timedelta(days=settings.neglect_days)
+                session.add(reminder)
+            else:
+                session.delete(reminder)
+            deliver = reminder.kind == "neglect" or settings.alarm_enabled
+            user_id = task.user_id
+            session.commit()
+        if not deliver:
+            return
+        self.fired += 1
+        payload = {k: v.isoformat() if isinstance(v, datetime) else v for k, v in payload.items()}
+        events.bus.publish(user_id, payload)
+        for handler in self.handlers:
+            try:
+                handler(user_id, payload)
+            except Exception:
+                logger.exception("reminder handler failed")
+
+
+scheduler = ReminderScheduler()
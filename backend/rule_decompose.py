@@ -0,0 +1,345 @@
+"""
+Rule-based task decomposition: a curated library of common goals matched with an Aho-Corasick
+automaton over normalized text. No model, no I/O; a lookup takes microseconds.
+
+_ai_todos asks it first and skips the LLM when a template matches confidently, and uses it as
+the offline fallback when the LLM fails. The request is cut into content words (runs of anything
+but hiragana, spaces and punctuation, which in Japanese are mostly particles and okurigana), and
+confidence is the share of those words a template's keywords cover completely. Time words and
+light verbs (する, 行く, やる...) don't count, so 「確定申告をする」 and 「明日ジムに行く」 match fully,
+while in 「税金を払う」 the verb 払 is half the request and it goes to the LLM, and
+「確定申告の書類を税理士に送る前に領収書を整理」 barely matches at all. Negated or quitting
+requests (「ジムをやめる」, 「ジムに行かない」) never match: the template would plan the opposite.
+"""
+import os
+import re
+import unicodedata
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+RULES_ENABLED = os.environ.get("DECOMPOSE_RULES", "1").lower() in ("1", "true", "yes")
+# minimum coverage for answering without the LLM
+RULES_CONFIDENCE = float(os.environ.get("DECOMPOSE_RULES_CONFIDENCE", "0.6"))
+# below this even the offline fallback prefers a generic plan over a loosely matching template
+RULES_FALLBACK_CONFIDENCE = float(os.environ.get("DECOMPOSE_RULES_FALLBACK_CONFIDENCE", "0.3"))
+
+# (name, keywords, steps); steps are ordered and the first one is deliberately tiny
+TEMPLATES: List[Tuple[str, List[str], List[str]]] = [
+    ("tax_return", ["確定申告", "申告", "税金", "納税", "e-tax", "源泉徴収", "tax"], [
+        "源泉徴収票と去年の控えを机の上に出す",
+        "医療費・保険料など控除の領収書を1つの封筒に集める",
+        "e-Taxのログイン方法（マイナンバーカードかID・パスワード）を確認する",
+        "作成コーナーで収入と控除を入力する",
+        "提出して受付結果を保存する",
+    ]),
+    ("gym", ["ジム", "筋トレ", "トレーニング", "ワークアウト", "運動", "gym", "workout"], [
+        "ウェアとシューズをバッグに詰めて玄関に置く",
+        "行く時間をカレンダーに入れる",
+        "ジムに着いたらまず5分だけウォームアップする",
+        "決めた3種目だけやる",
+        "やった内容をメモする",
+    ]),
+    ("running", ["ランニング", "ジョギング", "走る", "マラソン", "running"], [
+        "ランニングシューズを履く",
+        "外に出て5分だけゆっくり走る",
+        "走った距離と時間を記録する",
+    ]),
+    ("cleaning", ["掃除", "そうじ", "片付け", "片づけ", "かたづけ", "整理整頓", "部屋を片付", "部屋の片付", "部屋を掃除", "部屋の掃除", "cleaning"], [
+        "ゴミ袋を1枚用意する",
+        "目についたゴミを5分だけ袋に入れる",
+        "床に置いてある物を元の場所に戻す",
+        "掃除機をかける",
+        "ゴミを出す日を確認する",
+    ]),
+    ("decluttering", ["断捨離", "不用品", "捨てる", "メルカリ", "出品"], [
+        "引き出しを1つだけ開ける",
+        "1年使っていない物を3つ選ぶ",
+        "捨てる・売る・譲るに分ける",
+        "売る物の写真を撮って出品する",
+    ]),
+    ("laundry", ["洗濯", "せんたく", "洗濯物", "洗濯物を干", "洗濯物を畳", "laundry"], [
+        "洗濯物を洗濯機に入れる",
+        "洗剤を入れてスタートボタンを押す",
+        "終わる時間にアラームをかける",
+        "干す（または乾燥機に移す）",
+        "乾いたら畳んでしまう",
+    ]),
+    ("dishes", ["皿洗い", "皿を洗", "洗い物", "食器", "食器を洗"], [
+        "シンクの食器を水につける",
+        "コップから順に洗う",
+        "水切りかごに並べる",
+    ]),
+    ("cooking", ["料理", "自炊", "作り置き", "ご飯を作", "晩ご飯", "夕飯", "cooking"], [
+        "冷蔵庫の中身を確認する",
+        "作るメニューを1つ決める",
+        "足りない材料をメモする",
+        "材料を切る",
+        "調理して片付ける",
+    ]),
+    ("shopping", ["買い物", "買い出し", "スーパー", "shopping"], [
+        "買う物をメモに書き出す",
+        "エコバッグと財布を持つ",
+        "お店に行ってメモの物だけ買う",
+    ]),
+    ("study", ["勉強", "復習", "予習", "宿題", "試験", "テスト", "資格", "study"], [
+        "教科書（または問題集）を開いて机に置く",
+        "今日やる範囲を1ページだけ決める",
+        "25分タイマーをかけて取り組む",
+        "解けなかった問題に印をつける",
+        "明日やる範囲をメモする",
+    ]),
+    ("english", ["英語", "英会話", "toeic", "toefl", "英単語", "english"], [
+        "単語帳アプリ（または単語帳）を開く",
+        "単語を10個だけ覚える",
+        "例文を1つ声に出して読む",
+        "学習記録をつける",
+    ]),
+    ("programming", ["プログラミング", "コーディング", "実装", "バグ", "デバッグ", "programming", "coding"], [
+        "エディタとリポジトリを開く",
+        "やることを1行でメモに書く",
+        "一番小さい変更を1つだけ入れて動かす",
+        "コミットする",
+    ]),
+    ("report", ["レポート", "論文", "課題", "作文", "感想文", "レポートを書", "論文を書", "作文を書", "感想文を書", "report", "essay"], [
+        "ファイルを新規作成してタイトルだけ書く",
+        "見出しを3つ書き出す",
+        "集めた資料のリンクやメモを貼る",
+        "一番書きやすい見出しから本文を書く",
+        "読み直して提出する",
+    ]),
+    ("presentation", ["プレゼン", "発表", "スライド", "資料作成", "資料を作", "presentation", "slides"], [
+        "スライドファイルを開いて表紙だけ作る",
+        "伝えたいことを3行で書く",
+        "1行につき1枚スライドを作る",
+        "声に出して1回通しで練習する",
+    ]),
+    ("email", ["メール", "返信", "問い合わせ", "email", "mail"], [
+        "メールアプリを開く",
+        "返信が必要なメールを1通選ぶ",
+        "要点を3行で書いて送信する",
+    ]),
+    ("job_hunting", ["就活", "就職活動", "転職", "履歴書", "職務経歴書", "エントリーシート", "面接"], [
+        "求人サイト（または企業ページ）を開く",
+        "気になる求人を1つブックマークする",
+        "履歴書・職務経歴書のファイルを開く",
+        "志望動機を3行で書く",
+        "応募する",
+    ]),
+    ("moving", ["引っ越し", "引越し", "引越", "転居", "moving"], [
+        "引っ越し日の候補をカレンダーに書く",
+        "引っ越し業者の見積もりを1社だけ依頼する",
+        "段ボールを用意する",
+        "使わない部屋の物から箱詰めする",
+        "転出届・住所変更の手続きをする",
+    ]),
+    ("paperwork", ["役所", "手続き", "住民票", "マイナンバー", "届出", "申請"], [
+        "必要な書類を自治体のサイトで確認する",
+        "本人確認書類を財布に入れる",
+        "窓口の受付時間を調べる",
+        "役所に行って（またはオンラインで）提出する",
+    ]),
+    ("bills", ["支払い", "払う", "払い", "振込", "振り込み", "請求書", "公共料金", "家賃", "bill"], [
+        "請求書（または通知）を手元に出す",
+        "金額と期限を確認する",
+        "ネットバンキング（またはコンビニ）で支払う",
+        "支払い完了の記録を残す",
+    ]),
+    ("budget", ["家計簿", "節約", "貯金", "お金の管理", "budget"], [
+        "家計簿アプリ（またはノート）を開く",
+        "今日使ったお金を1件だけ記録する",
+        "固定費を書き出す",
+        "来月の予算を決める",
+    ]),
+    ("hospital", ["病院", "歯医者", "歯科", "通院", "健康診断", "検診"], [
+        "診察券と保険証を財布に入れる",
+        "病院のサイトで予約できる時間を調べる",
+        "予約する",
+        "予約日時をカレンダーに入れる",
+    ]),
+    ("haircut", ["美容院", "散髪", "床屋", "ヘアカット", "美容室"], [
+        "行きたいお店を1つ決める",
+        "予約サイトで空き時間を見る",
+        "予約する",
+    ]),
+    ("reading", ["読書", "本を読", "読む", "reading"], [
+        "本を手に取って開く",
+        "1ページだけ読む",
+        "読んだところに付箋を貼る",
+    ]),
+    ("travel", ["旅行", "旅", "帰省", "出張", "travel", "trip"], [
+        "行き先と日程をメモに書く",
+        "交通手段を調べる",
+        "宿を予約する",
+        "持ち物リストを作る",
+        "前日に荷造りする",
+    ]),
+    ("diet", ["ダイエット", "減量", "痩せ", "やせ", "diet"], [
+        "体重計に乗って記録する",
+        "今日の食事を1食だけ記録する",
+        "間食を1つ水かお茶に置き換える",
+    ]),
+    ("wake_up", ["早起き", "朝活", "寝坊"], [
+        "目覚ましを今日より15分早くセットする",
+        "スマホを寝室の外で充電する",
+        "起きたらカーテンを開ける",
+    ]),
+    ("bath", ["お風呂", "風呂", "シャワー", "入浴"], [
+        "着替えとタオルを脱衣所に置く",
+        "お湯をためる（またはシャワーを出す）",
+        "入る",
+    ]),
+    ("gift", ["プレゼントを", "誕生日", "贈り物", "お土産"], [
+        "相手が好きそうな物を3つ書き出す",
+        "予算を決める",
+        "1つ選んで注文（または買いに行く）",
+    ]),
+]
+
+_HIRAGANA = re.compile(r"[ぁ-ゟ]")
+# when-words say nothing about what the task is; they are not counted against coverage
+_TIME_WORDS = re.compile(r"今日|明日|明後日|今週|来週|今月|来月|週末|毎日|毎朝|毎晩|午前|午後|今夜|今晩|[0-9]+(?:時|分|日|月)")
+# ...and neither do verbs that only mean "do it" (ジムに行く, 課題をやる, 勉強を始める)
+_LIGHT_VERBS = re.compile(r"行[かきくけこっ]|始め|進め|頑張|取り組|終わらせ|済ませ|済ま|作[らりるれろっ]")
+# quitting / not doing: a template for the goal itself would plan the opposite. 〜ないと, 〜なきゃ,
+# 〜なければ and いけない / ならない are obligations, not negations.
+_NEGATION = re.compile(r"やめ|辞め|止め|解約|退会|キャンセル|中止|休む|サボ|(?<!いけ)(?<!なら)ない(?!と|けれ)|ません(?!と)|せず|ずに")
+
+
+def normalize(text: str) -> str:
+    """NFKC (full/half width, compatibility forms), lowercase, collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+def _is_content(ch: str) -> bool:
+    if ch.isspace() or _HIRAGANA.match(ch):
+        return False
+    return unicodedata.category(ch)[0] not in ("P", "S", "Z")
+
+
+def _words(norm: str, skip: set) -> List[List[int]]:
+    """Positions of each content word: maximal runs of content characters not in `skip`."""
+    words: List[List[int]] = []
+    prev = -2
+    for i, ch in enumerate(norm):
+        if i in skip or not _is_content(ch):
+            continue
+        if i == prev + 1:
+            words[-1].append(i)
+        else:
+            words.append([i])
+        prev = i
+    return words
+
+
+def negated(text: str) -> bool:
+    """True for requests to stop or not do something (「ジムをやめる」, 「掃除しない」)."""
+    return bool(_NEGATION.search(normalize(text)))
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: all occurrences of all patterns in one pass over the text."""
+
+    def __init__(self, patterns: List[Tuple[str, Any]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, Any]]] = [[]]
+        for pattern, value in patterns:
+            if pattern:
+                self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern: str, value: Any):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), value))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def finditer(self, text: str):
+        """Yield (start, end, value) for every match."""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, value in self._out[node]:
+                yield i + 1 - length, i + 1, value
+
+
+class RuleEngine:
+    def __init__(self, templates=TEMPLATES):
+        self.templates = templates
+        self._matcher = AhoCorasick([(normalize(kw), idx) for idx, (_, keywords, _) in enumerate(templates) for kw in keywords])
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """Best template for `text` as {"template", "confidence", "steps"}, or None."""
+        if negated(text):
+            return None
+        norm = normalize(text)
+        skip = {i for pattern in (_TIME_WORDS, _LIGHT_VERBS) for m in pattern.finditer(norm) for i in range(m.start(), m.end())}
+        words = _words(norm, skip)
+        if not words:
+            return None
+        covered: Dict[int, set] = {}
+        for start, end, idx in self._matcher.finditer(norm):
+            covered.setdefault(idx, set()).update(range(start, end))
+        if not covered:
+            return None
+        # a word counts only if a template covers all of it; ties go to the template covering the
+        # later word, since the predicate at the end of a Japanese sentence says what is to be done
+        hits = {idx: [w for w, word in enumerate(words) if all(i in positions for i in word)] for idx, positions in covered.items()}
+        best = max(hits, key=lambda idx: (len(hits[idx]), hits[idx][-1] if hits[idx] else -1, -idx))
+        if not hits[best]:
+            return None
+        name, _, steps = self.templates[best]
+        return {"template": name, "confidence": round(len(hits[best]) / len(words), 3), "steps": steps}
+
+    def confident(self, text: str) -> Optional[Dict[str, Any]]:
+        if not RULES_ENABLED:
+            return None
+        hit = self.match(text)
+        return hit if hit and hit["confidence"] >= RULES_CONFIDENCE else None
+
+
+engine = RuleEngine()
+
+
+def todos_from(steps: List[str]) -> List[Dict[str, Any]]:
+    return [{"id": i + 1, "title": s, "status": "pending", "order": i + 1} for i, s in enumerate(steps)]
+
+
+_SPLIT = re.compile(r"[、。,.，．\n;；]|(?:してから|したら|して、|、そして|それから)")
+
+
+def fallback(prompt: str) -> Dict[str, Any]:
+    """
+    Offline decomposition: a confident template; else the user's own enumeration (「洗濯して、料理する」);
+    else a template that fits at all; else generic first steps.
+    """
+    hit = engine.match(prompt) if RULES_ENABLED else None
+    parts = [p.strip() for p in _SPLIT.split(prompt or "") if p and p.strip()]
+    if hit and (hit["confidence"] >= RULES_CONFIDENCE or (len(parts) < 2 and hit["confidence"] >= RULES_FALLBACK_CONFIDENCE)):
+        return {"todos": todos_from(hit["steps"]), "rules": {"template": hit["template"], "confidence": hit["confidence"]}}
+    if len(parts) > 1:
+        return {"todos": todos_from(parts), "rules": {"template": None, "split": len(parts)}}
+    goal = (prompt or "").strip() or "やること"
+    return {"todos": todos_from([f"「{goal}」に必要な物を1つ手元に用意する", f"「{goal}」を5分だけやってみる", "どこまで進んだかメモする"]),
+            "rules": {"template": None}}
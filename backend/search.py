@@ -0,0 +1,168 @@
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+# SQLite: FTS5 table holding space-separated character bigrams, so mostly Japanese text without
+# word boundaries becomes searchable with the stock unicode61 tokenizer. Kept in sync from the
+# write endpoints inside their transaction.
+# Postgres: the same bigrams, computed by sista_bigrams() in SQL, in GIN expression indexes over
+# the same document (title + category, message + reply); nothing to maintain by hand. Unlike the
+# pg_trgm indexes this replaced, they also serve the 1-2 character queries common in Japanese.
+# pg_trgm is still used to score the matches.
+FTS_TABLE = "search_fts"
+# document expressions; the indexes in ensure_bigram_index must use exactly these
+_PG_TASK_DOC = "sista_bigrams(title || ' ' || coalesce(category, ''))"
+_PG_CHAT_DOC = "sista_bigrams(message || ' ' || coalesce(reply, ''))"
+_SPLIT = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def _is_sqlite(session_or_engine) -> bool:
+    bind = session_or_engine.get_bind() if isinstance(session_or_engine, Session) else session_or_engine
+    return bind.dialect.name == "sqlite"
+
+
+def bigrams(value: str) -> List[str]:
+    tokens: List[str] = []
+    for run in _SPLIT.split(unicodedata.normalize("NFKC", value or "").lower()):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def document_for(entity: str, row) -> str:
+    if entity == "task":
+        return " ".join(filter(None, [row.title, row.category]))
+    return " ".join(filter(None, [row.message, row.reply]))
+
+
+def ensure_search_index(conn):
+    """Create the FTS table / trigram indexes if missing and backfill SQLite (run as a migration)."""
+    if conn.dialect.name == "sqlite":
+        exists = conn.execute(text("SELECT name FROM sqlite_master WHERE name = :n"), {"n": FTS_TABLE}).first()
+        if exists:
+            return
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "body, owner, entity UNINDEXED, entity_id UNINDEXED, tokenize='unicode61')"
+        ))
+        for entity, sql in (("task", "SELECT id, user_id, title, category FROM task"),
+                            ("chat", "SELECT id, user_id, message, reply FROM chatmessage")):
+            for r in conn.execute(text(sql)).all():
+                body = " ".join(bigrams(" ".join(filter(None, r[2:]))))
+                conn.execute(text(f"INSERT INTO {FTS_TABLE} (body, owner, entity, entity_id) VALUES (:b, :o, :e, :i)"),
+                             {"b": body, "o": f"u{r[1]}", "e": entity, "i": r[0]})
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_task_title_trgm ON task USING gin (title gin_trgm_ops)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chatmessage_message_trgm ON chatmessage USING gin (message gin_trgm_ops)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chatmessage_reply_trgm ON chatmessage USING gin (reply gin_trgm_ops)"))
+
+
+def ensure_bigram_index(conn):
+    """Postgres: bigram tsvector indexes over the search documents, replacing title/message-only trigram ones."""
+    if conn.dialect.name != "postgresql":
+        return
+    # mirrors bigrams(): NFKC, lowercase, split on non-word runs, a 1-char run is its own token
+    conn.execute(text(
+        "CREATE OR REPLACE FUNCTION sista_bigrams(doc text) RETURNS tsvector LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ "
+        "SELECT coalesce(array_to_tsvector(array_agg(DISTINCT CASE WHEN char_length(run) = 1 THEN run ELSE substr(run, i, 2) END)), ''::tsvector) "
+        "FROM regexp_split_to_table(lower(normalize(coalesce(doc, ''), NFKC)), '\\W+') AS run, "
+        "generate_series(1, greatest(char_length(run) - 1, 1)) AS i WHERE run <> '' $$"
+    ))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_task_search_bigrams ON task USING gin (({_PG_TASK_DOC}))"))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_chatmessage_search_bigrams ON chatmessage USING gin (({_PG_CHAT_DOC}))"))
+    for index in ("ix_task_title_trgm", "ix_chatmessage_message_trgm", "ix_chatmessage_reply_trgm"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+
+def index_row(session: Session, entity: str, row):
+    """Insert or replace the search document of a task/chat row (no-op outside SQLite)."""
+    if not _is_sqlite(session):
+        return
+    conn = session.connection()
+    conn.execute(text(f"DELETE FROM {FTS_TABLE} WHERE entity = :e AND entity_id = :i"), {"e": entity, "i": row.id})
+    conn.execute(text(f"INSERT INTO {FTS_TABLE} (body, owner, entity, entity_id) VALUES (:b, :o, :e, :i)"),
+                 {"b": " ".join(bigrams(document_for(entity, row))), "o": f"u{row.user_id}", "e": entity, "i": row.id})
+
+
+def remove_row(session: Session, entity: str, entity_id: int):
+    if not _is_sqlite(session):
+        return
+    session.connection().execute(text(f"DELETE FROM {FTS_TABLE} WHERE entity = :e AND entity_id = :i"), {"e": entity, "i": entity_id})
+
+
+def remove_user(session: Session, user_id: int):
+    if not _is_sqlite(session):
+        return
+    session.connection().execute(text(f"DELETE FROM {FTS_TABLE} WHERE owner = :o"), {"o": f"u{user_id}"})
+
+
+def _fts_query(q: str) -> Optional[str]:
+    grams = bigrams(q)
+    if not grams:
+        return None
+    if len(grams) == 1 and len(grams[0]) == 1:
+        # single character: any bigram starting with it
+        return f'body : "{grams[0]}"*'
+    # consecutive bigrams as a phrase == substring match
+    phrase = " ".join(g.replace('"', '""') for g in grams)
+    return f'body : "{phrase}"'
+
+
+def search(session: Session, user_id: int, q: str, types: List[str], limit: int, offset: int) -> List[Dict[str, Any]]:
+    if _is_sqlite(session):
+        return _search_sqlite(session, user_id, q, types, limit, offset)
+    return _search_postgres(session, user_id, q, types, limit, offset)
+
+
+def _search_sqlite(session, user_id, q, types, limit, offset):
+    match = _fts_query(q)
+    if not match:
+        return []
+    placeholders = ", ".join(f":t{i}" for i in range(len(types)))
+    params = {"m": f'{match} AND owner : "u{int(user_id)}"', "limit": limit, "offset": offset}
+    params.update({f"t{i}": t for i, t in enumerate(types)})
+    rows = session.connection().execute(text(
+        f"SELECT entity, entity_id, bm25({FTS_TABLE}, 1.0, 0.0) AS rank FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH :m AND entity IN ({placeholders}) "
+        "ORDER BY rank LIMIT :limit OFFSET :offset"
+    ), params).all()
+    # bm25 is lower-is-better; flip it so higher scores rank first for clients
+    return [{"type": r[0], "id": int(r[1]), "score": round(-float(r[2]), 4)} for r in rows]
+
+
+def _pg_tsquery(q: str) -> Optional[str]:
+    """All of the query's bigrams (a lone character as a prefix), as tsquery input with quoted lexemes."""
+    grams = list(dict.fromkeys(bigrams(q)))
+    if not grams:
+        return None
+    quoted = ("'" + g.replace("\\", "\\\\").replace("'", "''") + "'" + (":*" if len(g) == 1 else "") for g in grams)
+    return " & ".join(quoted)
+
+
+def _search_postgres(session, user_id, q, types, limit, offset):
+    tsq = _pg_tsquery(q)
+    if not tsq:
+        return []
+    parts = []
+    # the bigram index finds candidates; ILIKE keeps the substring semantics of the SQLite phrase query
+    if "task" in types:
+        parts.append("SELECT 'task' AS entity, id, GREATEST(similarity(title, :q), similarity(coalesce(category, ''), :q)) AS score, created_at "
+                     f"FROM task WHERE user_id = :u AND {_PG_TASK_DOC} @@ CAST(:tsq AS tsquery) "
+                     "AND (normalize(title, NFKC) ILIKE :like OR normalize(category, NFKC) ILIKE :like)")
+    if "chat" in types:
+        parts.append("SELECT 'chat' AS entity, id, GREATEST(similarity(message, :q), similarity(coalesce(reply, ''), :q)) AS score, created_at "
+                     f"FROM chatmessage WHERE user_id = :u AND {_PG_CHAT_DOC} @@ CAST(:tsq AS tsquery) "
+                     "AND (normalize(message, NFKC) ILIKE :like OR normalize(reply, NFKC) ILIKE :like)")
+    if not parts:
+        return []
+    nq = unicodedata.normalize("NFKC", q)
+    like = "%" + nq.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    rows = session.connection().execute(text(
+        " UNION ALL ".join(parts) + " ORDER BY score DESC, created_at DESC LIMIT :limit OFFSET :offset"
+    ), {"q": q, "tsq": tsq, "u": user_id, "like": like, "limit": limit, "offset": offset}).all()
+    return [{"type": r[0], "id": int(r[1]), "score": round(float(r[2]), 4)} for r in rows]
@@ -0,0 +1,228 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from rule_decompose import negated
+from shared_state import MemoryStateBackend, state
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency: the cache is simply disabled without numpy
+    np = None
+
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE", "1").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+SEMANTIC_CACHE_CAPACITY = int(os.environ.get("SEMANTIC_CACHE_CAPACITY", "50000"))
+SEMANTIC_CACHE_DIM = int(os.environ.get("SEMANTIC_CACHE_DIM", "512"))
+# "user": only reuse a user's own decompositions; "global": share across users
+SEMANTIC_CACHE_SCOPE = os.environ.get("SEMANTIC_CACHE_SCOPE", "user")
+# switch from brute-force scan to the LSH index above this many entries
+SEMANTIC_CACHE_ANN_MIN = int(os.environ.get("SEMANTIC_CACHE_ANN_MIN", "5000"))
+# with a shared SHARED_STATE_BACKEND, repeats of a prompt (same normalized text) are also
+# answered from what other workers stored, for this long
+SEMANTIC_CACHE_SHARED_TTL = float(os.environ.get("SEMANTIC_CACHE_SHARED_TTL", "86400"))
+
+_STRIP = re.compile(r"[\s　、。，．,.!?！？「」『』（）()・~〜ー]+")
+# common endings that change phrasing but not the goal ("ジムに行きたい" / "ジム行く"); never a
+# polarity ending like ない, which turns the goal into its opposite
+_ENDINGS = re.compile(r"(したい|たい|ます|する|しよう|よう|なきゃ|きゃ)$")
+_HIRAGANA = re.compile(r"[\u3040-\u309f]+")
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _STRIP.sub("", text)
+    return _ENDINGS.sub("", text)
+
+
+class HashingVectorizer:
+    """
+    Character n-gram features hashed into a fixed-size, L2-normalised float32 vector.
+    Japanese goals differ mostly in particles and okurigana (ジムに行きたい / ジム行く), so the
+    kanji/katakana/latin "content" characters are weighted above grams of the full string.
+    """
+
+    def __init__(self, dim: int = SEMANTIC_CACHE_DIM):
+        self.dim = dim
+
+    def _add(self, vec, s: str, n: int, weight: float):
+        for i in range(len(s) - n + 1):
+            h = zlib.crc32(f"{n}:{s[i:i + n]}".encode("utf-8"))
+            vec[h % self.dim] += weight if h & 0x80000000 else -weight
+
+    def transform(self, text: str):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        s = normalize(text)
+        content = _HIRAGANA.sub("", s) or s
+        self._add(vec, content, 1, 1.0)
+        self._add(vec, content, 2, 2.0)
+        self._add(vec, s, 2, 0.5)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+
+class _LSHIndex:
+    """Random-hyperplane LSH over the cache rows; candidates are re-ranked with exact cosine."""
+
+    def __init__(self, dim: int, tables: int = 8, bits: int = 12, seed: int = 7):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables, bits, dim)).astype(np.float32)
+        self.weights = (1 << np.arange(bits)).astype(np.int64)
+        self.buckets: List[Dict[int, set]] = [dict() for _ in range(tables)]
+
+    def _codes(self, vecs):
+        # (tables, n, bits) sign pattern -> (tables, n) integer bucket ids
+        bits = np.einsum("tbd,nd->tnb", self.planes, vecs) > 0
+        return bits.astype(np.int64) @ self.weights
+
+    def add(self, row: int, vec):
+        for t, code in enumerate(self._codes(vec[None, :])[:, 0]):
+            self.buckets[t].setdefault(int(code), set()).add(row)
+
+    def remove(self, row: int, vec):
+        for t, code in enumerate(self._codes(vec[None, :])[:, 0]):
+            bucket = self.buckets[t].get(int(code))
+            if bucket:
+                bucket.discard(row)
+
+    def candidates(self, vec) -> List[int]:
+        found = set()
+        for t, code in enumerate(self._codes(vec[None, :])[:, 0]):
+            found |= self.buckets[t].get(int(code), set())
+        return sorted(found)
+
+
+class SemanticCache:
+    """
+    Near-duplicate cache for decompositions. Prompt vectors live in one contiguous float32
+    matrix that doubles up to `capacity` rows and then acts as a ring buffer; lookups are a single matrix-vector product, or an LSH
+    candidate lookup followed by exact re-ranking once the cache is large. Negated prompts are
+    never looked up or stored: n-gram similarity can't tell a goal from its opposite.
+
+    The matrix is per worker. With `shared` (default: when shared_state is not in-process), every
+    stored plan is also written to shared_state under its normalized prompt, so a repeat that
+    misses here is still answered from another worker's entry (and copied into this matrix).
+    """
+
+    def __init__(self, capacity: int = SEMANTIC_CACHE_CAPACITY, dim: int = SEMANTIC_CACHE_DIM,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, scope: str = SEMANTIC_CACHE_SCOPE,
+                 shared: Optional[bool] = None):
+        self.vectorizer = HashingVectorizer(dim)
+        self.capacity = capacity
+        self.threshold = threshold
+        self.scope = scope
+        self.shared = not isinstance(state, MemoryStateBackend) if shared is None else shared
+        self._lock = threading.Lock()
+        initial = min(capacity, 1024)
+        self._matrix = np.zeros((initial, dim), dtype=np.float32)
+        self._owners = np.full(initial, -1, dtype=np.int64)
+        self._values: List[Optional[Tuple[str, Any]]] = [None] * capacity
+        self._size = 0
+        self._next = 0
+        self._index: Optional[_LSHIndex] = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _owner(self, user_id: Optional[int]) -> int:
+        if self.scope == "global":
+            return 0
+        return int(user_id) if user_id is not None else 0
+
+    def _shared_key(self, prompt: str, owner: int) -> str:
+        return f"sc:{owner}:{hashlib.sha1(normalize(prompt).encode('utf-8')).hexdigest()}"
+
+    def lookup(self, prompt: str, user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        if negated(prompt):
+            # the nearest neighbour of 「ジムをやめる」 is the plan for going to the gym
+            with self._lock:
+                self.misses += 1
+            return None
+        vec = self.vectorizer.transform(prompt)
+        owner = self._owner(user_id)
+        with self._lock:
+            found = self._lookup_local(vec, owner)
+            if found is not None:
+                self.hits += 1
+                return found
+        item = state.get(self._shared_key(prompt, owner)) if self.shared else None
+        with self._lock:
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.shared_hits += 1
+            self._store_local(vec, owner, item["prompt"], item["value"])
+        return {"value": item["value"], "similarity": 1.0, "matched_prompt": item["prompt"]}
+
+    def _lookup_local(self, vec, owner: int) -> Optional[Dict[str, Any]]:
+        if not self._size:
+            return None
+        if self._index is not None:
+            rows = np.asarray(self._index.candidates(vec), dtype=np.int64)
+        else:
+            rows = np.arange(self._size)
+        if rows.size:
+            rows = rows[self._owners[rows] == owner]
+        if not rows.size:
+            return None
+        sims = self._matrix[rows] @ vec
+        best = int(np.argmax(sims))
+        score = float(sims[best])
+        if score < self.threshold:
+            return None
+        matched, value = self._values[int(rows[best])]
+        return {"value": value, "similarity": round(score, 4), "matched_prompt": matched}
+
+    def store(self, prompt: str, value: Any, user_id: Optional[int] = None):
+        if negated(prompt):
+            return
+        vec = self.vectorizer.transform(prompt)
+        owner = self._owner(user_id)
+        with self._lock:
+            self._store_local(vec, owner, prompt, value)
+        if self.shared:
+            state.set(self._shared_key(prompt, owner), {"prompt": prompt, "value": value}, ttl=SEMANTIC_CACHE_SHARED_TTL)
+
+    def _store_local(self, vec, owner: int, prompt: str, value: Any):
+        row = self._next
+        if row >= self._matrix.shape[0]:
+            self._grow()
+        if self._values[row] is not None and self._index is not None:
+            self._index.remove(row, self._matrix[row])
+        self._matrix[row] = vec
+        self._owners[row] = owner
+        self._values[row] = (prompt, value)
+        self._next = (row + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        if self._index is not None:
+            self._index.add(row, vec)
+        elif self._size >= SEMANTIC_CACHE_ANN_MIN:
+            self._build_index()
+
+    def _grow(self):
+        rows = min(self.capacity, self._matrix.shape[0] * 2)
+        matrix = np.zeros((rows, self._matrix.shape[1]), dtype=np.float32)
+        matrix[:self._matrix.shape[0]] = self._matrix
+        owners = np.full(rows, -1, dtype=np.int64)
+        owners[:self._owners.shape[0]] = self._owners
+        self._matrix, self._owners = matrix, owners
+
+    def _build_index(self):
+        index = _LSHIndex(self._matrix.shape[1])
+        codes = index._codes(self._matrix[:self._size])
+        for t in range(codes.shape[0]):
+            for row, code in enumerate(codes[t]):
+                index.buckets[t].setdefault(int(code), set()).add(row)
+        self._index = index
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"enabled": True, "size": self._size, "hits": self.hits, "shared_hits": self.shared_hits, "misses": self.misses,
+                "indexed": self._index is not None, "threshold": self.threshold, "shared": self.shared}
+
+
+semantic_cache: Optional[SemanticCache] = SemanticCache() if (np is not None and SEMANTIC_CACHE_ENABLED) else None
@@ -0,0 +1,103 @@
+import gzip
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+# optional accelerators; each falls back (stdlib json) or is simply not offered
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bodies smaller than this go out uncompressed (not worth the CPU / header overhead)
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+_columns_cache: Dict[type, tuple] = {}
+
+
+def _columns(cls) -> tuple:
+    cols = _columns_cache.get(cls)
+    if cols is None:
+        cols = _columns_cache[cls] = tuple(c.name for c in cls.__table__.columns)
+    return cols
+
+
+def to_plain(value: Any) -> Any:
+    """
+    Turn ORM rows (and lists/dicts of them) into plain dicts by reading the mapped columns
+    directly. Rows loaded from our own tables are already valid, so the pydantic
+    response_model round trip is skipped.
+    """
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {k: to_plain(v) for k, v in value.items()}
+    if hasattr(value, "__table__"):
+        return {c: getattr(value, c) for c in _columns(type(value))}
+    return value
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def dumps_json(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return msgpack is not None and any(t in accept for t in MSGPACK_TYPES)
+
+
+def _pick_encoding(request: Request) -> Optional[str]:
+    offered = {e.split(";")[0].strip() for e in request.headers.get("accept-encoding", "").lower().split(",")}
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def fast_response(request: Request, value: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Serialize `value` for the client: MessagePack when the Accept header asks for it, otherwise
+    JSON (orjson when installed), compressed with brotli/gzip above COMPRESS_MIN_BYTES if the
+    client accepts it.
+    """
+    plain = to_plain(value)
+    if _wants_msgpack(request):
+        body = msgpack.packb(plain, default=_default, use_bin_type=True)
+        media_type = "application/msgpack"
+    else:
+        body = dumps_json(plain)
+        media_type = "application/json"
+    out_headers = {"Vary": "Accept, Accept-Encoding"}
+    out_headers.update(headers or {})
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = _pick_encoding(request)
+        if encoding == "br":
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+        elif encoding == "gzip":
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        if encoding:
+            out_headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=out_headers)
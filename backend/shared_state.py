@@ -0,0 +1,283 @@
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from models import SharedState
+
+# "memory" keeps everything in this process (single worker). "sql" stores it in the shared
+# database so every worker sees the same rate limits, LLM slots, single-flight locks, cached
+# decompositions and job status (see gunicorn_conf.py for what stays per worker).
+SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "memory")
+
+
+class MemoryStateBackend:
+    """Process-local key/value store with TTLs. Values must be JSON-compatible."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    def _live(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._live(key)
+            return default if item is None else item[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set key only if it is absent (or expired). Returns True if this call set it."""
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Atomically add to an integer counter; the TTL applies when the counter is created."""
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                self._data[key] = (amount, time.monotonic() + ttl if ttl else None)
+                return amount
+            value = int(item[0]) + amount
+            self._data[key] = (value, item[1])
+            return value
+
+    def purge_expired(self):
+        with self._lock:
+            for key in list(self._data):
+                self._live(key)
+
+
+class SqlStateBackend:
+    """Same interface backed by the SharedState table; row locks make incr/add atomic across workers."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @staticmethod
+    def _expired(row: SharedState) -> bool:
+        return row.expires_at is not None and row.expires_at <= datetime.utcnow()
+
+    @staticmethod
+    def _expiry(ttl: Optional[float]) -> Optional[datetime]:
+        return datetime.utcnow() + timedelta(seconds=ttl) if ttl else None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with Session(self.engine) as session:
+            row = session.get(SharedState, key)
+            if row is None or self._expired(row):
+                return default
+            return json.loads(row.value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with Session(self.engine) as session:
+            row = session.get(SharedState, key) or SharedState(key=key, value="null")
+            row.value = json.dumps(value)
+            row.expires_at = self._expiry(ttl)
+            session.add(row)
+            session.commit()
+
+    def delete(self, key: str):
+        with Session(self.engine) as session:
+            row = session.get(SharedState, key)
+            if row is not None:
+                session.delete(row)
+                session.commit()
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        with Session(self.engine) as session:
+            row = session.exec(select(SharedState).where(SharedState.key == key).with_for_update()).first()
+            if row is not None:
+                if not self._expired(row):
+                    return False
+                row.value = json.dumps(value)
+                row.expires_at = self._expiry(ttl)
+                session.add(row)
+            else:
+                session.add(SharedState(key=key, value=json.dumps(value), expires_at=self._expiry(ttl)))
+            try:
+                session.commit()
+            except IntegrityError:
+                # another worker inserted the key first
+                return False
+            return True
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        for _ in range(3):
+            with Session(self.engine) as session:
+                row = session.exec(select(SharedState).where(SharedState.key == key).with_for_update()).first()
+                if row is None or self._expired(row):
+                    value = amount
+                    if row is None:
+                        row = SharedState(key=key, value="0")
+                    row.expires_at = self._expiry(ttl)
+                else:
+                    value = int(json.loads(row.value)) + amount
+                row.value = json.dumps(value)
+                session.add(row)
+                try:
+                    session.commit()
+                except IntegrityError:
+                    continue
+                return value
+        raise RuntimeError(f"Could not increment shared counter {key}")
+
+    def purge_expired(self):
+        with Session(self.engine) as session:
+            for row in session.exec(select(SharedState).where(SharedState.expires_at <= datetime.utcnow())).all():
+                session.delete(row)
+            session.commit()
+
+
+def create_backend(name: Optional[str] = None):
+    name = (name or SHARED_STATE_BACKEND).lower()
+    if name == "memory":
+        return MemoryStateBackend()
+    if name == "sql":
+        from db import engine
+        return SqlStateBackend(engine)
+    raise ValueError(f"Unknown SHARED_STATE_BACKEND: {name}")
+
+
+state = create_backend()
+
+
+class RateLimiter:
+    """Fixed-window rate limit shared by all workers through `state`."""
+
+    def __init__(self, name: str, limit: int, window_seconds: int):
+        self.name = name
+        self.limit = limit
+        self.window = window_seconds
+
+    def hit(self, subject: Any) -> Tuple[bool, int]:
+        """Count one request. Returns (allowed, seconds until the window resets)."""
+        now = int(time.time())
+        window_start = now - now % self.window
+        count = state.incr(f"rl:{self.name}:{subject}:{window_start}", ttl=self.window + 1)
+        return count <= self.limit, window_start + self.window - now
+
+
+class Semaphore:
+    """
+    At most `limit` holders across all workers. Each slot is a key in `state` held as a lease, so
+    a worker that dies mid-call gives its slot back after `lease` seconds.
+    """
+
+    def __init__(self, name: str, limit: int, lease: float = 300, poll_interval: float = 0.1):
+        self.name = name
+        self.limit = limit
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+    def acquire(self, timeout: Optional[float] = None, cancel=None) -> Optional[str]:
+        """Returns the slot key to pass to release(), or None on timeout / cancellation."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # random starting slot so waiting workers don't all race for slot 0
+            first = random.randrange(self.limit)
+            for i in range(self.limit):
+                key = f"sem:{self.name}:{(first + i) % self.limit}"
+                if state.add(key, True, ttl=self.lease):
+                    return key
+            if (cancel is not None and cancel.cancelled) or (deadline is not None and time.monotonic() >= deadline):
+                return None
+            time.sleep(self.poll_interval)
+
+    def release(self, slot: str):
+        state.delete(slot)
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution. Within a worker, waiters share
+    the leader's result directly; across workers, the leader holds a lock in `state` and publishes
+    the result there for `result_ttl` seconds. Errors are not shared: if the leader fails, a waiter
+    runs fn itself.
+    """
+
+    def __init__(self, name: str, lock_ttl: float = 120, result_ttl: float = 30):
+        self.name = name
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Tuple[threading.Event, Dict[str, Any]]] = {}
+
+    def do(self, key: str, fn: Callable[[], Any], poll_interval: float = 0.1) -> Any:
+        with self._lock:
+            entry = self._inflight.get(key)
+            leader = entry is None
+            if leader:
+                entry = (threading.Event(), {})
+                self._inflight[key] = entry
+        done, box = entry
+        if not leader:
+            if done.wait(self.lock_ttl) and "value" in box:
+                return box["value"]
+            return fn()
+        try:
+            box["value"] = self._do_shared(key, fn, poll_interval)
+            return box["value"]
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()
+
+    def _do_shared(self, key: str, fn: Callable[[], Any], poll_interval: float) -> Any:
+        if isinstance(state, MemoryStateBackend):
+            return fn()
+        lock_key, result_key = f"sf:{self.name}:{key}:lock", f"sf:{self.name}:{key}:result"
+        deadline = time.monotonic() + self.lock_ttl
+        while not state.add(lock_key, True, ttl=self.lock_ttl):
+            found = state.get(result_key)
+            if found is not None:
+                return found["value"]
+            if time.monotonic() > deadline:
+                break
+            time.sleep(poll_interval)
+        try:
+            # the previous leader may have published just before releasing the lock
+            found = state.get(result_key)
+            if found is not None:
+                return found["value"]
+            value = fn()
+            state.set(result_key, {"value": value}, ttl=self.result_ttl)
+            return value
+        finally:
+            state.delete(lock_key)
+
+
+class JobStatus:
+    """Status records for background jobs, visible from any worker."""
+
+    def __init__(self, kind: str, ttl: float = 3600):
+        self.kind = kind
+        self.ttl = ttl
+
+    def set(self, job_id: Any, status: str, **extra):
+        state.set(f"job:{self.kind}:{job_id}", dict(extra, status=status, updated_at=time.time()), ttl=self.ttl)
+
+    def get(self, job_id: Any) -> Optional[Dict[str, Any]]:
+        return state.get(f"job:{self.kind}:{job_id}")
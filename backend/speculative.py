@@ -0,0 +1,130 @@
+"""
+Speculative decomposition of newly created tasks. create_task hands the title to the
+Precomputer, which decomposes it at BACKGROUND priority, so it only gets LLM slots nobody
+interactive is waiting for, and stores the result as a TaskPlan. /api/execute and the dashboard
+can then show the first step instantly. Deleting or retitling the task cancels the work (the
+scheduler withdraws a queued call, an in-flight one is aborted).
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from sqlmodel import Session
+
+from admission import CancelToken, LLM_MAX_QUEUE
+from db import engine
+from llm_scheduler import scheduler
+from models import Task, TaskPlan
+from semantic_cache import semantic_cache
+
+logger = logging.getLogger("sista.speculative")
+
+SPECULATIVE_DECOMPOSE = os.environ.get("SPECULATIVE_DECOMPOSE", "1").lower() in ("1", "true", "yes")
+SPECULATIVE_THREADS = int(os.environ.get("SPECULATIVE_THREADS", "2"))
+# beyond this many unfinished precomputations new tasks are simply not precomputed
+SPECULATIVE_MAX_BACKLOG = int(os.environ.get("SPECULATIVE_MAX_BACKLOG", "64"))
+
+
+class Precomputer:
+    def __init__(self, threads: int = SPECULATIVE_THREADS, max_backlog: int = SPECULATIVE_MAX_BACKLOG):
+        self.threads = threads
+        self.max_backlog = max_backlog
+        # decompose(prompt, user_id, cancel) -> {"todos": [...], "debug": {...}}; wired up by main
+        self.decompose: Optional[Callable[[str, int, CancelToken], Dict[str, Any]]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._tokens: Dict[int, CancelToken] = {}
+
+    def accepting(self) -> bool:
+        """Only speculate when there is headroom: bounded backlog and a short LLM queue."""
+        if not SPECULATIVE_DECOMPOSE or self.decompose is None:
+            return False
+        with self._lock:
+            if len(self._tokens) >= self.max_backlog:
+                return False
+        return scheduler.queue_depth() < LLM_MAX_QUEUE
+
+    def submit(self, task_id: int, user_id: int, title: str):
+        token = CancelToken()
+        with self._lock:
+            previous = self._tokens.pop(task_id, None)
+            self._tokens[task_id] = token
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="speculative")
+        if previous is not None:
+            previous.cancel()
+        self._executor.submit(self._run, task_id, user_id, title, token)
+
+    def cancel(self, task_id: int):
+        with self._lock:
+            token = self._tokens.pop(task_id, None)
+        if token is not None:
+            token.cancel()
+
+    def _run(self, task_id: int, user_id: int, title: str, token: CancelToken):
+        try:
+            if token.cancelled:
+                return
+            hit = semantic_cache.lookup(title, user_id) if semantic_cache is not None else None
+            if hit:
+                todos, source, error = hit["value"], "cache", None
+            else:
+                result = self.decompose(title, user_id, token)
+                debug = result.get("debug") or {}
+                todos, error = result.get("todos") or [], debug.get("llm_error")
+                source = "fallback" if error else "rules" if "rules" in debug else "llm"
+                if semantic_cache is not None and todos and source == "llm":
+                    semantic_cache.store(title, todos, user_id)
+            if token.cancelled:
+                return
+            self._save(task_id, token, status="ready" if todos else "failed", todos=todos, source=source, error=error)
+        except Exception as e:
+            if not token.cancelled:
+                logger.warning("speculative decomposition of task %s failed: %s", task_id, e)
+                self._save(task_id, token, status="failed", error=str(e))
+        finally:
+            with self._lock:
+                if self._tokens.get(task_id) is token:
+                    del self._tokens[task_id]
+
+    def _save(self, task_id: int, token: CancelToken, status: str, todos=None, source=None, error=None):
+        with Session(engine) as session:
+            plan = session.get(TaskPlan, task_id)
+            # the task may have been deleted or retitled while we were working
+            if plan is None or token.cancelled or session.get(Task, task_id) is None:
+                return
+            plan.status = status
+            plan.first_step = todos[0].get("title") if todos else None
+            plan.steps = json.dumps(todos, ensure_ascii=False) if todos else None
+            plan.source = source
+            plan.error = error
+            plan.updated_at = datetime.utcnow()
+            session.add(plan)
+            session.commit()
+
+
+def reset(plan: TaskPlan) -> TaskPlan:
+    """Back to pending, e.g. before recomputing for a new title."""
+    plan.status = "pending"
+    plan.first_step = plan.steps = plan.source = plan.error = None
+    plan.updated_at = datetime.utcnow()
+    return plan
+
+
+def plan_dict(plan: TaskPlan) -> Dict[str, Any]:
+    return {
+        "task_id": plan.task_id,
+        "status": plan.status,
+        "first_step": plan.first_step,
+        "steps": json.loads(plan.steps) if plan.steps else [],
+        "source": plan.source,
+        "error": plan.error,
+        "updated_at": plan.updated_at,
+    }
+
+
+precomputer = Precomputer()
@@ -1,3 +1,19 @@
 #!/usr/bin/env sh
-echo "Starting command: $@"
-exec "$@"
+# WEB_CONCURRENCY=1 (default): single uvicorn process.
+# WEB_CONCURRENCY>1: gunicorn with uvicorn workers; "auto" uses one worker per core.
+if [ "$#" -gt 0 ]; then
+  echo "Starting command: $@"
+  exec "$@"
+fi
+
+if [ "${WEB_CONCURRENCY}" = "auto" ]; then
+  WEB_CONCURRENCY=$(python -c 'import multiprocessing; print(multiprocessing.cpu_count())')
+fi
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-1}"
+
+if [ "${WEB_CONCURRENCY}" -gt 1 ]; then
+  echo "Starting gunicorn with ${WEB_CONCURRENCY} uvicorn workers"
+  exec gunicorn main:app -c gunicorn_conf.py
+fi
+echo "Starting uvicorn"
+exec uvicorn main:app --host 0.0.0.0 --port 8000
@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlmodel import Session, select
+from models import ChatMessage, SyncCounter, Task, Tombstone
+
+
+def current_version(session: Session, user_id: int) -> int:
+    counter = session.get(SyncCounter, user_id)
+    return counter.value if counter else 0
+
+
+def next_change_version(session: Session, user_id: int) -> int:
+    """
+    Bump and return the user's change counter. The counter row is locked (FOR UPDATE on Postgres)
+    until the caller commits, so a user's writes become visible in version order and /sync never
+    skips a change.
+    """
+    query = select(SyncCounter).where(SyncCounter.user_id == user_id).with_for_update()
+    counter = session.exec(query).first()
+    if not counter:
+        # a user's first writes can arrive concurrently: create the row idempotently, then lock it
+        _insert_counter(session, user_id)
+        counter = session.exec(query).first()
+    counter.value += 1
+    session.add(counter)
+    return counter.value
+
+
+def _insert_counter(session: Session, user_id: int):
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        session.add(SyncCounter(user_id=user_id, value=0))
+        session.flush()
+        return
+    session.execute(insert(SyncCounter).values(user_id=user_id, value=0).on_conflict_do_nothing(index_elements=["user_id"]))
+
+
+def stamp(session: Session, row, user_id: int):
+    """Mark a Task/ChatMessage as changed in the current transaction."""
+    row.change_version = next_change_version(session, user_id)
+    row.updated_at = datetime.utcnow()
+
+
+def delete_with_tombstone(session: Session, row, entity: str):
+    version = next_change_version(session, row.user_id)
+    session.add(Tombstone(user_id=row.user_id, entity=entity, entity_id=row.id, change_version=version))
+    session.delete(row)
+    return version
+
+
+def etag_for(user_id: int, version: int, variant: str = "") -> str:
+    """Validator for a list at this change version; `variant` tells apart responses of one URL's query params."""
+    return f'W/"{user_id}-{version}-{variant}"' if variant else f'W/"{user_id}-{version}"'
+
+
+def changes_since(session: Session, user_id: int, since: int) -> Dict[str, Any]:
+    version = current_version(session, user_id)
+    if since >= version:
+        return {"version": version, "tasks": [], "chats": [], "deleted": []}
+    tasks = session.exec(
+        select(Task).where(Task.user_id == user_id, Task.change_version > since).order_by(Task.change_version)
+    ).all()
+    chats = session.exec(
+        select(ChatMessage).where(ChatMessage.user_id == user_id, ChatMessage.change_version > since).order_by(ChatMessage.change_version)
+    ).all()
+    deleted: List[Tombstone] = session.exec(
+        select(Tombstone).where(Tombstone.user_id == user_id, Tombstone.change_version > since).order_by(Tombstone.change_version)
+    ).all()
+    return {
+        "version": version,
+        "tasks": tasks,
+        "chats": chats,
+        "deleted": [{"entity": d.entity, "id": d.entity_id, "version": d.change_version} for d in deleted],
+    }
+
+
+def parse_if_none_match(header: Optional[str]) -> List[str]:
+    if not header:
+        return []
+    return [t.strip() for t in header.split(",") if t.strip()]
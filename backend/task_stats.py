@@ -0,0 +1,101 @@
+"""
+Per-user task counters for the dashboard, updated in the same transaction as each task write, so
+GET /tasks/stats reads a handful of rows instead of scanning the user's tasks. The oldest open
+task comes from the (user_id, updated_at) index.
+
+The counters can drift only if tasks are written outside the API; repair with
+    python task_stats.py rebuild [--user ID]
+"""
+import argparse
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from models import Task, TaskStat
+
+DONE_STATUSES = ("done", "completed")
+DIMENSIONS = ("status", "category")
+
+
+def _keys(status: Optional[str], category: Optional[str]) -> Tuple[Tuple[str, str], ...]:
+    return (("status", status or "pending"), ("category", category or ""))
+
+
+def _bump(session: Session, user_id: int, dimension: str, key: str, delta: int):
+    stat = session.get(TaskStat, (user_id, dimension, key))
+    if stat is None:
+        stat = TaskStat(user_id=user_id, dimension=dimension, key=key, count=0)
+    stat.count += delta
+    if stat.count <= 0 and stat in session:
+        session.delete(stat)
+    elif stat.count > 0:
+        session.add(stat)
+
+
+def record(session: Session, user_id: int, before: Optional[Task] = None, after: Optional[Task] = None,
+           before_values: Optional[Tuple[Optional[str], Optional[str]]] = None):
+    """
+    Apply one task write to the counters: create (after only), update (both) or delete (before
+    only). For updates of an already-modified row pass the old (status, category) as before_values.
+    Call after sync.stamp, whose counter-row lock serialises a user's concurrent writes.
+    """
+    old = _keys(*before_values) if before_values is not None else (_keys(before.status, before.category) if before is not None else ())
+    new = _keys(after.status, after.category) if after is not None else ()
+    for dimension, key in old:
+        if (dimension, key) not in new:
+            _bump(session, user_id, dimension, key, -1)
+    for dimension, key in new:
+        if (dimension, key) not in old:
+            _bump(session, user_id, dimension, key, +1)
+
+
+def snapshot(session: Session, user_id: int) -> Dict[str, Any]:
+    rows = session.exec(select(TaskStat).where(TaskStat.user_id == user_id)).all()
+    by = {d: {} for d in DIMENSIONS}
+    for r in rows:
+        by[r.dimension][r.key or "none"] = r.count
+    total = sum(by["status"].values())
+    done = sum(by["status"].get(s, 0) for s in DONE_STATUSES)
+    oldest = session.exec(
+        select(Task).where(Task.user_id == user_id, Task.status.not_in(DONE_STATUSES)).order_by(Task.updated_at).limit(1)
+    ).first()
+    oldest_open = None
+    if oldest is not None:
+        touched = oldest.updated_at or oldest.created_at
+        oldest_open = {"id": oldest.id, "title": oldest.title, "updated_at": touched,
+                       "neglected_days": (datetime.utcnow() - touched).days}
+    return {"total": total, "open": total - done, "by_status": by["status"], "by_category": by["category"],
+            "oldest_open": oldest_open}
+
+
+def rebuild(session: Session, user_id: Optional[int] = None) -> int:
+    """Recompute counters from the task table (all users, or one). Returns the number of counter rows."""
+    delete = select(TaskStat)
+    if user_id is not None:
+        delete = delete.where(TaskStat.user_id == user_id)
+    for stat in session.exec(delete).all():
+        session.delete(stat)
+    session.flush()
+    written = 0
+    for dimension, column, default in (("status", Task.status, "pending"), ("category", Task.category, "")):
+        query = select(Task.user_id, func.coalesce(column, default), func.count()).group_by(Task.user_id, func.coalesce(column, default))
+        if user_id is not None:
+            query = query.where(Task.user_id == user_id)
+        for uid, key, count in session.exec(query).all():
+            session.add(TaskStat(user_id=uid, dimension=dimension, key=key, count=count))
+            written += 1
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Task statistics maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user", type=int, default=None, help="only this user id")
+    args = parser.parse_args()
+    from db import engine
+    with Session(engine) as session:
+        n = rebuild(session, args.user)
+        session.commit()
+    print(f"rebuilt {n} counter rows")
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from reminders import parse_due
+
+
+def test_naive_due_date_is_local_time():
+    # 09:00 in Tokyo is 00:00 UTC
+    assert parse_due("2024/05/01 09:00", tz=ZoneInfo("Asia/Tokyo")) == datetime(2024, 5, 1, 0, 0)
+    assert parse_due("2024-05-01T09:00", tz=ZoneInfo("Asia/Tokyo")) == datetime(2024, 5, 1, 0, 0)
+    assert parse_due("2024/05/01", tz=ZoneInfo("Asia/Tokyo")) == datetime(2024, 4, 30, 15, 0)
+
+
+def test_explicit_offset_wins_over_local_zone():
+    assert parse_due("2024-05-01T09:00+00:00", tz=ZoneInfo("Asia/Tokyo")) == datetime(2024, 5, 1, 9, 0)
+    assert parse_due("2024-05-01T09:00Z", tz=ZoneInfo("Asia/Tokyo")) == datetime(2024, 5, 1, 9, 0)
+
+
+def test_stored_utc_values_are_kept():
+    assert parse_due("2024-05-01T00:00:00", tz=timezone.utc) == datetime(2024, 5, 1, 0, 0)
+
+
+def test_unparseable_is_none():
+    assert parse_due("someday") is None
+    assert parse_due("") is None
@@ -0,0 +1,36 @@
+import pytest
+
+import rule_decompose
+from rule_decompose import engine, fallback
+
+
+@pytest.mark.parametrize("text, template", [
+    ("確定申告をする", "tax_return"),
+    ("明日ジムに行く", "gym"),
+    ("ジムに行かないと", "gym"),
+    ("勉強しないといけない", "study"),
+    ("部屋を片付けたい", "cleaning"),
+    ("洗濯物を干す", "laundry"),
+])
+def test_confident_match(text, template):
+    hit = engine.confident(text)
+    assert hit is not None and hit["template"] == template
+
+
+@pytest.mark.parametrize("text", ["ジムをやめる", "ジムに行かない", "ジムを解約する", "英会話をサボりたい"])
+def test_negation_never_matches(text):
+    assert engine.match(text) is None
+    assert fallback(text)["rules"]["template"] is None
+
+
+def test_uncovered_verb_lowers_confidence():
+    # 払 is half of the request; tax_return only covers the object
+    hit = engine.match("税金を払う")
+    assert hit["template"] != "tax_return"
+    assert hit["confidence"] < rule_decompose.RULES_CONFIDENCE
+    assert engine.confident("税金を払う") is None
+
+
+def test_hiragana_does_not_count_as_content():
+    assert engine.match("ジムにいく")["confidence"] == 1.0
+    assert engine.match("確定申告の書類を税理士に送る前に領収書を整理")["confidence"] < rule_decompose.RULES_FALLBACK_CONFIDENCE
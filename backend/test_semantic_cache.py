@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from semantic_cache import SemanticCache
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache(capacity=16, dim=512, threshold=0.8, scope="user")
+    cache.store("ジムに行きたい", ["gym"], user_id=1)
+    cache.store("部屋を掃除したい", ["clean"], user_id=1)
+    cache.store("英語の勉強", ["english"], user_id=1)
+    return cache
+
+
+def test_rephrased_prompt_hits(cache):
+    assert cache.lookup("ジム行く", user_id=1)["value"] == ["gym"]
+
+
+@pytest.mark.parametrize("prompt", ["ジムに行きたくない", "部屋を掃除しない", "英語の勉強をやめる"])
+def test_negated_prompt_misses(cache, prompt):
+    assert cache.lookup(prompt, user_id=1) is None
+
+
+def test_negated_prompt_is_not_stored(cache):
+    cache.store("ジムをやめる", ["quit"], user_id=1)
+    assert cache.lookup("ジムに行きたい", user_id=1)["value"] == ["gym"]
+    assert cache.metrics()["size"] == 3
@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+class TokenRevocationCache:
+    """
+    In-memory view of per-user token versions used to reject revoked JWTs without a DB lookup.
+    Every token carries the user's version at issue time ("ver"). Logging out bumps the version,
+    which invalidates all older tokens; removing a user marks the id as gone for good.
+    Only users that ever logged out / were removed have an entry, so the map stays small.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[int, int] = {}
+        self._removed = set()
+        # with several workers, a logout handled elsewhere is picked up by polling the DB
+        self._loader: Optional[Callable[[], Iterable[Tuple[int, int, bool]]]] = None
+        self._refresh_interval = 0.0
+        self._next_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+
+    def load(self, rows: Iterable[Tuple[int, int, bool]]):
+        """Replace the cache contents with (user_id, version, removed) rows from the DB."""
+        versions: Dict[int, int] = {}
+        removed = set()
+        for user_id, version, is_removed in rows:
+            versions[int(user_id)] = int(version or 0)
+            if is_removed:
+                removed.add(int(user_id))
+        with self._lock:
+            self._versions = versions
+            self._removed = removed
+
+    def merge(self, rows: Iterable[Tuple[int, int, bool]]):
+        for user_id, version, is_removed in rows:
+            self.set_version(int(user_id), int(version or 0), bool(is_removed))
+
+    def configure_refresh(self, loader: Callable[[], Iterable[Tuple[int, int, bool]]], interval: float):
+        """Re-read changed rows via loader at most every `interval` seconds (0 disables)."""
+        self._loader = loader
+        self._refresh_interval = interval
+        self._next_refresh = time.monotonic() + interval
+
+    def _maybe_refresh(self):
+        if not self._refresh_interval or time.monotonic() < self._next_refresh:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_refresh = time.monotonic() + self._refresh_interval
+            self.merge(self._loader())
+        except Exception:
+            # keep serving from the last known state; retried on the next interval
+            pass
+        finally:
+            self._refresh_lock.release()
+
+    def current_version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def set_version(self, user_id: int, version: int, removed: bool = False):
+        with self._lock:
+            self._versions[user_id] = version
+            if removed:
+                self._removed.add(user_id)
+            else:
+                self._removed.discard(user_id)
+
+    def is_valid(self, user_id: int, version: Optional[int]) -> bool:
+        self._maybe_refresh()
+        if user_id in self._removed:
+            return False
+        return int(version or 0) >= self._versions.get(user_id, 0)
+
+
+revocations = TokenRevocationCache()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Local stand-in webhook receiver for trying the outbox end to end.
+
+    python webhook_receiver.py --port 9009 --fail-rate 0.2
+    WEBHOOK_ALLOW_PRIVATE=1 uvicorn main:app   # then set webhook_url to http://127.0.0.1:9009/hook
+
+Prints each batch and a running events/second figure; --fail-rate answers that share of
+requests with 503 to exercise retries, --status forces a fixed status (e.g. 410 -> dead letter).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+stats = {"requests": 0, "events": 0, "started": time.time()}
+lock = threading.Lock()
+
+
+def make_handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like real receivers
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            status = args.status
+            if status == 200 and random.random() < args.fail_rate:
+                status = 503
+            if status == 200:
+                events = json.loads(body or b"{}").get("events", [])
+                with lock:
+                    stats["requests"] += 1
+                    stats["events"] += len(events)
+                    rate = stats["events"] / max(time.time() - stats["started"], 1e-6)
+                if not args.quiet:
+                    for e in events:
+                        print(json.dumps(e, ensure_ascii=False))
+                print(f"batch of {len(events)} | total {stats['events']} events, {rate:.0f}/s")
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *a):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9009)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--status", type=int, default=200)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    print(f"listening on http://127.0.0.1:{args.port}/")
+    ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args)).serve_forever()
@@ -0,0 +1,293 @@
+"""
+Outbound webhooks (逆ギレ notifications and friends) through a transactional outbox.
+
+enqueue() adds a WebhookDelivery row in the caller's transaction; the WebhookDispatcher thread
+claims due rows in bulk, groups them per destination and POSTs up to WEBHOOK_BATCH_MAX events
+per request from an asyncio loop with one pooled keep-alive httpx client. Request handlers never
+wait on a receiver.
+
+Body sent to the receiver: {"events": [{"id": <delivery id>, "created_at": ..., ...event}, ...]}
+
+Failures retry with exponential backoff and full jitter; permanent failures (4xx other than
+408/429) and rows that exhaust WEBHOOK_MAX_ATTEMPTS become status "dead" (dead letters), which
+can be listed and retried through the API. Claiming pushes next_attempt_at forward by a lease
+under FOR UPDATE SKIP LOCKED, so several workers share the outbox and a crashed worker's rows
+come back after the lease.
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from sqlalchemy import event as sa_event
+from sqlmodel import Session, select
+
+from db import engine
+from models import WebhookDelivery
+
+logger = logging.getLogger("sista.webhooks")
+
+WEBHOOKS_ENABLED = os.environ.get("WEBHOOKS", "1").lower() in ("1", "true", "yes")
+WEBHOOK_CONCURRENCY = int(os.environ.get("WEBHOOK_CONCURRENCY", "64"))
+WEBHOOK_PER_DESTINATION = int(os.environ.get("WEBHOOK_PER_DESTINATION", "4"))
+WEBHOOK_BATCH_MAX = int(os.environ.get("WEBHOOK_BATCH_MAX", "50"))
+WEBHOOK_TIMEOUT = float(os.environ.get("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE = float(os.environ.get("WEBHOOK_BACKOFF_BASE", "2"))
+WEBHOOK_BACKOFF_MAX = float(os.environ.get("WEBHOOK_BACKOFF_MAX", "3600"))
+WEBHOOK_POLL_SECONDS = float(os.environ.get("WEBHOOK_POLL_SECONDS", "1"))
+# loopback/private receivers are refused unless explicitly allowed (local testing)
+WEBHOOK_ALLOW_PRIVATE = os.environ.get("WEBHOOK_ALLOW_PRIVATE", "0").lower() in ("1", "true", "yes")
+_LEASE_SECONDS = WEBHOOK_TIMEOUT * 3 + 30
+_CLAIM_LIMIT = 1000
+
+
+class PermanentError(Exception):
+    pass
+
+
+async def _public_addresses(host: str, port: int) -> List[str]:
+    """Resolve host; PermanentError if any address is loopback, private, link-local or otherwise internal."""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    addrs: List[str] = []
+    for info in infos:
+        addr = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        if addr.is_private or addr.is_loopback or addr.is_link_local or addr.is_reserved or addr.is_multicast or addr.is_unspecified:
+            raise PermanentError(f"refusing private address {addr} (set WEBHOOK_ALLOW_PRIVATE=1 for local receivers)")
+        if str(addr) not in addrs:
+            addrs.append(str(addr))
+    return addrs
+
+
+def _transport(limits):
+    """
+    httpx transport whose connections only go to public addresses. The host is resolved once per
+    connection and the socket is opened to the address that was checked, so a DNS answer that
+    changes between check and connect (rebinding) can't reach an internal service. TLS still
+    verifies the certificate against the hostname.
+    """
+    import httpcore
+    import httpx
+
+    class PublicOnlyBackend(httpcore.AsyncNetworkBackend):
+        def __init__(self):
+            self._inner = httpcore.AnyIOBackend()
+
+        async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+            error: Optional[Exception] = None
+            for addr in await _public_addresses(host, port):
+                try:
+                    return await self._inner.connect_tcp(addr, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+                except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                    error = e
+            raise error or httpcore.ConnectError(f"no address for {host}")
+
+        async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+            raise PermanentError("unix sockets are not webhook receivers")
+
+        async def sleep(self, seconds):
+            await self._inner.sleep(seconds)
+
+    transport = httpx.AsyncHTTPTransport(limits=limits)
+    if not WEBHOOK_ALLOW_PRIVATE:
+        # httpx has no network_backend option; same pool settings, checked connects
+        transport._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(), max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections, keepalive_expiry=limits.keepalive_expiry,
+            network_backend=PublicOnlyBackend(),
+        )
+    return transport
+
+
+def destination_of(url: str) -> str:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("webhook URL must be http(s)://host/...")
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}"
+
+
+def enqueue(session: Session, user_id: int, url: str, event: Dict[str, Any]) -> WebhookDelivery:
+    """Add a delivery to the outbox in the caller's transaction; the dispatcher is woken on commit."""
+    delivery = WebhookDelivery(user_id=user_id, url=url, destination=destination_of(url),
+                               payload=json.dumps(event, ensure_ascii=False, default=str))
+    session.add(delivery)
+    if not session.info.get("webhooks_hooked"):
+        sa_event.listen(session, "after_commit", lambda s: dispatcher.wake())
+        session.info["webhooks_hooked"] = True
+    return delivery
+
+
+def backoff_seconds(attempts: int) -> float:
+    # full jitter: uniform in [0, base * 2^attempts], capped
+    return random.uniform(0, min(WEBHOOK_BACKOFF_MAX, WEBHOOK_BACKOFF_BASE * (2 ** attempts)))
+
+
+class WebhookDispatcher:
+    def __init__(self, concurrency: int = WEBHOOK_CONCURRENCY, per_destination: int = WEBHOOK_PER_DESTINATION,
+                 batch_max: int = WEBHOOK_BATCH_MAX):
+        self.concurrency = concurrency
+        self.per_destination = per_destination
+        self.batch_max = batch_max
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.delivered = 0
+        self.failed = 0
+        self.dead = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), name="webhooks", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = WEBHOOK_TIMEOUT + 5):
+        """Stop claiming, let in-flight deliveries finish (up to WEBHOOK_TIMEOUT) and join the thread."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    # --- DB side (runs in worker threads via asyncio.to_thread) ---
+
+    def _claim(self, limit: int) -> List[Tuple[int, str, str, str, datetime]]:
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            rows = session.exec(
+                select(WebhookDelivery)
+                .where(WebhookDelivery.status == "pending", WebhookDelivery.next_attempt_at <= now)
+                .order_by(WebhookDelivery.next_attempt_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            ).all()
+            lease = now + timedelta(seconds=_LEASE_SECONDS)
+            claimed = []
+            for row in rows:
+                row.next_attempt_at = lease
+                session.add(row)
+                claimed.append((row.id, row.url, row.destination, row.payload, row.created_at))
+            session.commit()
+        return claimed
+
+    def _record(self, ids: List[int], error: Optional[str], permanent: bool = False, retry_after: Optional[float] = None) -> int:
+        """Store the outcome of one attempt; returns how many rows were dead-lettered."""
+        now = datetime.utcnow()
+        dead = 0
+        with Session(engine) as session:
+            for row in session.exec(select(WebhookDelivery).where(WebhookDelivery.id.in_(ids))).all():
+                row.attempts += 1
+                row.last_error = error
+                if error is None:
+                    row.status = "delivered"
+                    row.delivered_at = now
+                elif permanent or row.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                    row.status = "dead"
+                    dead += 1
+                else:
+                    delay = max(retry_after or 0, backoff_seconds(row.attempts))
+                    row.next_attempt_at = now + timedelta(seconds=delay)
+                session.add(row)
+            session.commit()
+        return dead
+
+    # --- delivery side (asyncio loop in the dispatcher thread) ---
+
+    async def _deliver(self, client, semaphore: asyncio.Semaphore, url: str, rows):
+        ids = [r[0] for r in rows]
+        body = {"events": [dict(json.loads(r[3]), id=r[0], created_at=r[4].isoformat()) for r in rows]}
+        error, permanent, retry_after = None, False, None
+        async with semaphore:
+            try:
+                resp = await client.post(url, json=body)
+                if resp.status_code >= 300:
+                    error = f"HTTP {resp.status_code}"
+                    permanent = 400 <= resp.status_code < 500 and resp.status_code not in (408, 429)
+                    try:
+                        retry_after = float(resp.headers.get("retry-after", ""))
+                    except ValueError:
+                        retry_after = None
+            except PermanentError as e:
+                error, permanent = str(e), True
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        dead = await asyncio.to_thread(self._record, ids, error, permanent, retry_after)
+        if error is None:
+            self.delivered += len(ids)
+        else:
+            self.failed += len(ids)
+            self.dead += dead
+
+    async def _main(self):
+        import httpx
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        semaphores: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(self.per_destination))
+        inflight: set = set()
+        # no proxies from the environment: the address check must see the receiver, not the proxy
+        async with httpx.AsyncClient(transport=_transport(limits), timeout=WEBHOOK_TIMEOUT, trust_env=WEBHOOK_ALLOW_PRIVATE,
+                                     headers={"User-Agent": "Sista-Webhooks/1"}) as client:
+            while not self._stop.is_set():
+                try:
+                    # keep at most ~2x concurrency requests' worth of rows claimed
+                    capacity = max(0, self.concurrency * 2 - len(inflight)) * self.batch_max
+                    claimed = await asyncio.to_thread(self._claim, min(_CLAIM_LIMIT, capacity)) if capacity else []
+                except Exception:
+                    logger.exception("webhook claim failed")
+                    claimed = []
+                groups: Dict[Tuple[str, str], list] = defaultdict(list)
+                for row in claimed:
+                    groups[(row[2], row[1])].append(row)
+                for (destination, url), rows in groups.items():
+                    for i in range(0, len(rows), self.batch_max):
+                        task = asyncio.ensure_future(self._deliver(client, semaphores[destination], url, rows[i:i + self.batch_max]))
+                        inflight.add(task)
+                        task.add_done_callback(inflight.discard)
+                if claimed and capacity:
+                    await asyncio.sleep(0)
+                    continue
+                if inflight and not capacity:
+                    await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                # idle: sleep until enqueue() wakes us or the next retry may be due
+                await asyncio.to_thread(self._wake.wait, WEBHOOK_POLL_SECONDS)
+                self._wake.clear()
+            if inflight:
+                await asyncio.wait(inflight, timeout=WEBHOOK_TIMEOUT)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"delivered": self.delivered, "failed_attempts": self.failed, "dead": self.dead}
+
+
+dispatcher = WebhookDispatcher()
+
+
+def gyakugire_event(title: str, neglected_days: int, task_id: Optional[int] = None) -> Dict[str, Any]:
+    return {"type": "sista.gyakugire", "task_id": task_id, "title": title, "neglected_days": neglected_days,
+            "text": f"『{title}』、{neglected_days}日も放置してるんだけど！？ いい加減やってよね！"}
+
+
+def on_reminder(user_id: int, payload: Dict[str, Any]):
+    """reminders.scheduler handler: a fired neglect reminder goes out to the user's webhook, if set."""
+    if payload.get("type") != "reminder.neglect":
+        return
+    from models import ReminderSettings
+    with Session(engine) as session:
+        settings = session.get(ReminderSettings, user_id)
+        if settings is None or not settings.webhook_url:
+            return
+        enqueue(session, user_id, settings.webhook_url,
+                gyakugire_event(payload.get("title") or "", payload.get("neglected_days") or 0, payload.get("task_id")))
+        session.commit()
@@ -1,6 +1,12 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,21 +16,44 @@ load_dotenv()
 API_BASE = os.getenv('API_BASE', 'http://localhost:8030')
 # 最大待機時間（秒）。環境変数で上書きできます。
 API_TIMEOUT = int(os.getenv('API_TIMEOUT', '120'))
+# タスク/チャット一覧のキャッシュ有効期間（秒）。変更操作後は明示的に無効化されます。
+CACHE_TTL = int(os.getenv('CACHE_TTL', '30'))
+# チャット履歴: セッションに保持する最大件数、1回に取得/表示を広げる件数
+CHAT_HISTORY_MAX = int(os.getenv('CHAT_HISTORY_MAX', '200'))
+CHAT_PAGE_SIZE = int(os.getenv('CHAT_PAGE_SIZE', '30'))
+# 並行してバックエンドへ投げるリクエスト数と、1回の再実行あたりのリクエスト上限
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '8'))
+RERUN_REQUEST_BUDGET = int(os.getenv('RERUN_REQUEST_BUDGET', '40'))
 st.set_page_config(page_title='Sista', layout='centered', initial_sidebar_state="collapsed")
 
 # Ensure session fields
 if 'token' not in st.session_state:
     st.session_state.token = None
+if 'refresh_token' not in st.session_state:
+    st.session_state.refresh_token = None
 if 'username' not in st.session_state:
     st.session_state.username = None
 if 'auth_rerun_done' not in st.session_state:
     st.session_state.auth_rerun_done = False
 if 'tasks_cache' not in st.session_state:
     st.session_state.tasks_cache = None
+if 'local_tasks' not in st.session_state:
+    st.session_state.local_tasks = []
+if 'cache_gen' not in st.session_state:
+    # bumped per resource to invalidate this session's cached fetches without touching other users
+    st.session_state.cache_gen = {'tasks': 0, 'chats': 0}
+# ring buffers: long sessions keep only the newest CHAT_HISTORY_MAX entries
 if 'local_chats' not in st.session_state:
-    st.session_state.local_chats = []
+    st.session_state.local_chats = deque(maxlen=CHAT_HISTORY_MAX)
 if 'messages' not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = deque(maxlen=CHAT_HISTORY_MAX)
+if 'older_chats' not in st.session_state:
+    # server chats paged in with "load older", oldest first
+    st.session_state.older_chats = []
+if 'chats_has_more' not in st.session_state:
+    st.session_state.chats_has_more = None
+if 'chat_window' not in st.session_state:
+    st.session_state.chat_window = CHAT_PAGE_SIZE
 if 'server_history' not in st.session_state:
     st.session_state.server_history = []
 if 'compressed_memory' not in st.session_state:
@@ -88,25 +117,181 @@ st.markdown(_DEV_GUARD, unsafe_allow_html=True)
 
 
 # ---------- API helpers ----------
-def _auth_headers():
+@st.cache_resource
+def _http_session():
+    """One pooled keep-alive session shared by all reruns and users of this Streamlit process."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _auth_headers(timeout=None):
     h = {'Content-Type': 'application/json'}
     if st.session_state.token:
         h['Authorization'] = f"Bearer {st.session_state.token}"
+    if timeout:
+        # tell the backend how long we will wait so it can shed work we'd abandon anyway
+        h['X-Request-Timeout'] = str(timeout)
     return h
 
-def api_post(path, data=None, timeout=5):
+def _overloaded_message(r):
+    retry = r.headers.get('Retry-After', '数')
+    return f'サーバーが混み合っています。{retry}秒ほど待ってから再度お試しください。'
+
+def _refresh_access_token():
+    """Exchange the stored refresh token for a new access token. Returns True on success."""
+    if not st.session_state.get('refresh_token'):
+        return False
     try:
-        return requests.post(f"{API_BASE}{path}", json=data, headers=_auth_headers(), timeout=timeout)
+        r = _http_session().post(f"{API_BASE}/auth/refresh", json={'refresh_token': st.session_state.refresh_token}, timeout=5)
+    except Exception:
+        return False
+    if r.status_code != 200:
+        st.session_state.refresh_token = None
+        return False
+    data = r.json()
+    st.session_state.token = data.get('access_token')
+    st.session_state.refresh_token = data.get('refresh_token') or st.session_state.refresh_token
+    return True
+
+def api_request(method, path, data=None, timeout=5):
+    # access tokens are short-lived: on 401 refresh once and retry
+    try:
+        url = path if path.startswith('http') else f"{API_BASE}{path}"
+        r = _http_session().request(method, url, json=data, headers=_auth_headers(), timeout=timeout)
+        if r.status_code == 401 and not path.startswith('/auth/') and _refresh_access_token():
+            r = _http_session().request(method, url, json=data, headers=_auth_headers(), timeout=timeout)
+        return r
     except Exception as e:
         st.error(f"Network error: {e}")
         return None
 
+def api_post(path, data=None, timeout=5):
+    return api_request('POST', path, data, timeout)
+
 def api_get(path, timeout=5):
+    return api_request('GET', path, timeout=timeout)
+
+
+class _FetchError(Exception):
+    # raised from cached fetchers so failures are never cached
+    def __init__(self, status_code, text=''):
+        super().__init__(f'{status_code} {text}')
+        self.status_code = status_code
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False, max_entries=1000)
+def _cached_get_json(path, token, generation):
+    """GET path as JSON. Keyed by token (per user) and generation (per-session invalidation)."""
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    r = _http_session().get(f"{API_BASE}{path}", headers=headers, timeout=5)
+    if r.status_code != 200:
+        raise _FetchError(r.status_code, r.text)
+    return r.json()
+
+def cached_get_json(path, resource):
+    """Returns (data, status_code). status_code is None on network errors."""
+    gen = st.session_state.cache_gen.get(resource, 0)
     try:
-        return requests.get(f"{API_BASE}{path}", headers=_auth_headers(), timeout=timeout)
+        try:
+            return _cached_get_json(path, st.session_state.token, gen), 200
+        except _FetchError as e:
+            if e.status_code == 401 and _refresh_access_token():
+                return _cached_get_json(path, st.session_state.token, gen), 200
+            raise
+    except _FetchError as e:
+        return None, e.status_code
     except Exception as e:
         st.error(f"Network error: {e}")
-        return None
+        return None, None
+
+def invalidate(*resources):
+    for res in resources:
+        st.session_state.cache_gen[res] = st.session_state.cache_gen.get(res, 0) + 1
+
+
+# ---------- Concurrent fetches ----------
+@st.cache_resource
+def _fetch_pool():
+    """Worker threads shared by the whole process; they use the same pooled _http_session()."""
+    return ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='sista-fetch')
+
+def begin_rerun():
+    """Reset the per-rerun request budget and timings (call once at the top of main())."""
+    st.session_state.rerun_fetches = {'started': time.perf_counter(), 'requests': 0, 'calls': []}
+
+def _timed(label, fn, args):
+    # runs in a pool thread: no st.session_state access here
+    started = time.perf_counter()
+    try:
+        result = fn(*args)
+        status = getattr(result, 'status_code', 200)
+    except Exception as e:
+        result, status = e, getattr(e, 'status_code', type(e).__name__)
+    return result, {'call': label, 'ms': round((time.perf_counter() - started) * 1000), 'status': status}
+
+def run_concurrently(jobs):
+    """
+    Run [(label, fn, args), ...] in parallel on the fetch pool; returns one result per job, in order.
+    An exception is returned in place of its result. Jobs beyond this rerun's RERUN_REQUEST_BUDGET
+    are not run and get None.
+    """
+    stats = st.session_state.setdefault('rerun_fetches', {'started': time.perf_counter(), 'requests': 0, 'calls': []})
+    allowed = max(0, min(len(jobs), RERUN_REQUEST_BUDGET - stats['requests']))
+    if allowed < len(jobs):
+        st.warning(f'リクエストが多すぎるため {len(jobs) - allowed} 件を保留しました。もう一度実行してください。')
+    stats['requests'] += allowed
+    ctx = get_script_run_ctx()
+    pool = _fetch_pool()
+
+    def submit(label, fn, args):
+        def task():
+            # st.cache_data needs the script context in worker threads
+            add_script_run_ctx(threading.current_thread(), ctx)
+            return _timed(label, fn, args)
+        return pool.submit(task)
+
+    futures = [submit(*job) for job in jobs[:allowed]]
+    results = []
+    for fut in futures:
+        result, timing = fut.result()
+        stats['calls'].append(timing)
+        results.append(result)
+    return results + [None] * (len(jobs) - allowed)
+
+def prefetch(*fetches):
+    """
+    Warm the cache for several (path, resource) GETs at once, so the fetch_* calls that follow are
+    cache hits and the page waits for the slowest call instead of the sum. Errors are left to them.
+    """
+    token = st.session_state.token
+    run_concurrently([(f'GET {path}', _cached_get_json, (path, token, st.session_state.cache_gen.get(res, 0)))
+                      for path, res in fetches])
+
+def _post_json(path, data, headers):
+    return _http_session().post(f"{API_BASE}{path}", json=data, headers=headers, timeout=5)
+
+def post_concurrently(path, bodies):
+    """
+    POST each body to path in parallel (see run_concurrently). Like api_request, a 401 refreshes the
+    access token once, here on the script thread, and the rejected POSTs are sent again.
+    """
+    results = run_concurrently([(f'POST {path}', _post_json, (path, body, _auth_headers())) for body in bodies])
+    retry = [i for i, r in enumerate(results) if getattr(r, 'status_code', None) == 401]
+    if retry and _refresh_access_token():
+        headers = _auth_headers()
+        for i, r in zip(retry, run_concurrently([(f'POST {path}', _post_json, (path, bodies[i], headers)) for i in retry])):
+            results[i] = r
+    return results
+
+def render_fetch_timings():
+    stats = st.session_state.get('rerun_fetches')
+    if not stats or not st.session_state.get('developer_mode'):
+        return
+    total = round((time.perf_counter() - stats['started']) * 1000)
+    with st.expander(f"バックエンド通信 {stats['requests']}/{RERUN_REQUEST_BUDGET} 件・描画 {total}ms"):
+        st.table(stats['calls'] or [{'call': '-', 'ms': 0, 'status': '-'}])
 
 
 # ---------- Auth ----------
@@ -116,6 +301,7 @@ def register(username, password):
         return False
     if r.status_code in (200, 201):
         st.session_state.token = r.json().get('access_token')
+        st.session_state.refresh_token = r.json().get('refresh_token')
         st.session_state.username = username
         st.success('Registered and logged in')
         if not st.session_state.auth_rerun_done:
@@ -131,6 +317,7 @@ def login(username, password):
         return False
     if r.status_code == 200:
         st.session_state.token = r.json().get('access_token')
+        st.session_state.refresh_token = r.json().get('refresh_token')
         st.session_state.username = username
         st.success('Logged in')
         if not st.session_state.auth_rerun_done:
@@ -141,47 +328,74 @@ def login(username, password):
     return False
 
 def logout():
+    if st.session_state.token:
+        api_post('/auth/logout')
     st.session_state.token = None
+    st.session_state.refresh_token = None
     st.session_state.username = None
     st.session_state.auth_rerun_done = False
+    for key in ('reminder_settings', 'alarm_enabled', 'webhook_url', 'neglect_days', 'older_chats', 'chats_has_more', 'chat_window', 'conversation_id'):
+        st.session_state.pop(key, None)
     st.rerun()
 
 
 # ---------- Domain ops ----------
 def fetch_tasks():
-    r = api_get('/tasks')
+    data, status = cached_get_json('/tasks', 'tasks')
     tasks = []
-    if r and r.status_code == 200:
-        try:
-            tasks = r.json()
-        except Exception:
-            tasks = []
-    elif r and r.status_code == 401:
+    if status == 200:
+        tasks = list(data or [])
+    elif status == 401:
         st.warning('Unauthorized. Please login.')
-        tasks = []
-    elif not r:
-        tasks = []
-    else:
-        st.error(f'Error fetching tasks: {r.status_code}')
-        tasks = []
+    elif status is not None:
+        st.error(f'Error fetching tasks: {status}')
+    # local fallback tasks (created while the backend was unreachable) come first
+    tasks = list(st.session_state.local_tasks) + tasks
     st.session_state.tasks_cache = tasks
     return tasks
 
+def fetch_task_stats():
+    """Counts and oldest open task from /tasks/stats; shares the 'tasks' cache generation."""
+    data, status = cached_get_json('/tasks/stats', 'tasks')
+    return data if status == 200 else None
+
+def fetch_task_plans():
+    """Precomputed first steps keyed by task id (str); filled in by the backend shortly after a task is added."""
+    data, status = cached_get_json('/tasks/plans', 'tasks')
+    return data if status == 200 and isinstance(data, dict) else {}
+
+def fetch_reminder_settings():
+    r = api_get('/reminders/settings')
+    if r is not None and r.status_code == 200:
+        return r.json()
+    return None
+
+def save_reminder_settings(changes):
+    r = api_request('PUT', '/reminders/settings', changes)
+    if r is not None and r.status_code == 200:
+        st.session_state.reminder_settings = r.json()
+    else:
+        st.warning('設定を保存できませんでした')
+
 def create_task(text):
     r = api_post('/tasks', {'title': text, 'completed': False})
-    if not r:
-        # fallback: append to local cache
-        now = __import__('datetime').datetime.now().isoformat()
-        local = {'id': f'local-{len(st.session_state.tasks_cache or [])+1}', 'title': text, 'completed': False, 'created_at': now}
-        if st.session_state.tasks_cache is None:
-            st.session_state.tasks_cache = []
-        st.session_state.tasks_cache.insert(0, local)
+    now = __import__('datetime').datetime.now().isoformat()
+    if r is None:
+        # fallback: keep a local task until the backend is reachable again
+        local = {'id': f'local-{len(st.session_state.local_tasks)+1}', 'title': text, 'completed': False, 'created_at': now}
+        st.session_state.local_tasks.insert(0, local)
+        st.session_state.tasks_cache = [local] + list(st.session_state.tasks_cache or [])
         st.success('Task created (local fallback)')
         return True
     if r.status_code in (200,201):
         st.success('Task created')
-        # refresh cache
-        st.session_state.tasks_cache = None
+        # optimistic: show the created row right away, refetch on the next render
+        try:
+            created = r.json()
+        except Exception:
+            created = {'title': text, 'created_at': now}
+        st.session_state.tasks_cache = list(st.session_state.tasks_cache or []) + [created]
+        invalidate('tasks')
         return True
     if r.status_code == 401:
         st.warning('Unauthorized. Please login.')
@@ -190,43 +404,66 @@ def create_task(text):
     return False
 
 def update_task(task_id, patch):
-    try:
-        r = requests.patch(f"{API_BASE}/tasks/{task_id}", json=patch, headers=_auth_headers(), timeout=5)
-    except Exception as e:
-        st.error(f"Network error: {e}"); return False
-    if r.status_code == 200: return True
+    r = api_request('PATCH', f"/tasks/{task_id}", patch)
+    if r is None: return False
+    if r.status_code == 200:
+        for t in st.session_state.tasks_cache or []:
+            if t.get('id') == task_id: t.update(patch)
+        invalidate('tasks')
+        return True
     if r.status_code == 401: st.warning('Unauthorized. Please login.'); return False
     st.error(f'Update failed: {r.status_code}'); return False
 
 def delete_task(task_id):
-    try:
-        r = requests.delete(f"{API_BASE}/tasks/{task_id}", headers=_auth_headers(), timeout=5)
-    except Exception as e:
-        st.error(f"Network error: {e}"); return False
-    if r.status_code == 200: st.success('Deleted'); return True
+    r = api_request('DELETE', f"/tasks/{task_id}")
+    if r is None: return False
+    if r.status_code == 200:
+        st.session_state.tasks_cache = [t for t in st.session_state.tasks_cache or [] if t.get('id') != task_id]
+        invalidate('tasks')
+        st.success('Deleted'); return True
     if r.status_code == 401: st.warning('Unauthorized. Please login.'); return False
     st.error(f'Delete failed: {r.status_code}'); return False
 
+CHATS_LATEST = f'/chats?limit={CHAT_PAGE_SIZE}'
+
 def fetch_chats():
-    r = api_get('/chats')
+    """The newest page of server chats, preceded by any older pages loaded with load_older_chats()."""
+    data, status = cached_get_json(CHATS_LATEST, 'chats')
     server = []
-    if r and r.status_code == 200:
-        try:
-            server = r.json()
-        except Exception:
-            server = []
-    elif r and r.status_code == 401:
+    if status == 200:
+        server = list(data or [])
+        if not st.session_state.older_chats:
+            st.session_state.chats_has_more = len(server) >= CHAT_PAGE_SIZE
+    elif status == 401:
         st.warning('Unauthorized. Please login.')
-        server = []
-    elif not r:
-        server = []
-    else:
-        st.error(f'Error fetching chats: {r.status_code}')
-        server = []
+    elif status is not None:
+        st.error(f'Error fetching chats: {status}')
+    # the newest page moves as chats are added: drop loaded older rows it now overlaps
+    ids = {c.get('id') for c in server}
+    older = [c for c in st.session_state.older_chats if c.get('id') not in ids]
     # Merge server chats with any local fallback chats (local appended to end)
-    combined = (server or []) + list(st.session_state.local_chats)
+    combined = older + server + list(st.session_state.local_chats)
     return combined
 
+def load_older_chats(chats):
+    """Fetch the page of server chats before the oldest one in `chats`."""
+    ids = [c['id'] for c in chats if isinstance(c.get('id'), int)]
+    if not ids:
+        st.session_state.chats_has_more = False
+        return
+    # not cached: each older page is fetched once and kept in session_state, and a cached copy
+    # could be stale since the single 'chats' generation doesn't tell pages apart
+    r = api_get(f'/chats?limit={CHAT_PAGE_SIZE}&before={min(ids)}')
+    if r is None:
+        return
+    if r.status_code != 200:
+        st.error(f'Error fetching chats: {r.status_code}')
+        return
+    page = list(r.json() or [])
+    st.session_state.older_chats = page + st.session_state.older_chats
+    # stop paging once the session holds CHAT_HISTORY_MAX older rows
+    st.session_state.chats_has_more = len(page) >= CHAT_PAGE_SIZE and len(st.session_state.older_chats) < CHAT_HISTORY_MAX
+
 def post_chat(message):
     # Prefer calling the external LLM server at /chat following LLM_client.py format
     API_CHAT = os.getenv('API_CHAT', f"{API_BASE}/chat")
@@ -253,8 +490,11 @@ def post_chat(message):
         "history": history_messages,
         "compressed_memory": st.session_state.get('compressed_memory')
     }
+    # once the backend has a thread for this chat it assembles the context itself
+    if st.session_state.get('conversation_id'):
+        payload.update(conversation_id=st.session_state.conversation_id, history=None)
     try:
-        resp = requests.post(API_CHAT, json=payload, timeout=20, headers=_auth_headers())
+        resp = _http_session().post(API_CHAT, json=payload, timeout=20, headers=_auth_headers(timeout=20))
         # DEBUG: surface response status and body when in developer_mode for diagnosis
         if st.session_state.get('developer_mode'):
             try:
@@ -276,6 +516,9 @@ def post_chat(message):
         if resp.status_code == 401:
             st.warning('Unauthorized. Please login.')
             return False
+        if resp.status_code == 503:
+            st.warning(_overloaded_message(resp))
+            return False
         st.error(f'LLM server returned error: {resp.status_code} {resp.text}')
         return False
 
@@ -292,10 +535,14 @@ def post_chat(message):
     if not str(response_text).strip():
         response_text = '（空の応答）'
 
-    debug_info = data.get('debug_info')
+    # debug payloads (prompt, history, timings) are large: only kept while developer mode is on
+    debug_info = data.get('debug_info') if st.session_state.get('developer_mode') else None
     if isinstance(debug_info, dict) and 'history' in debug_info:
         st.session_state.server_history = debug_info.get('history')
 
+    if data.get('conversation_id'):
+        st.session_state.conversation_id = data['conversation_id']
+
     # store compressed memory if present
     if isinstance(data, dict) and data.get('compressed_memory'):
         st.session_state.compressed_memory = data.get('compressed_memory')
@@ -304,7 +551,11 @@ def post_chat(message):
     st.session_state.local_chats.append({'created_at': data.get('created_at') or now, 'message': f'You: {message}'})
     st.session_state.local_chats.append({'created_at': data.get('created_at') or now, 'message': response_text})
     st.session_state.messages.append({"role": "user", "content": message})
-    st.session_state.messages.append({"role": "assistant", "content": response_text, "debug_info": debug_info})
+    reply = {"role": "assistant", "content": response_text}
+    if debug_info:
+        reply["debug_info"] = debug_info
+    st.session_state.messages.append(reply)
+    invalidate('chats')
 
     return True
 
@@ -339,21 +590,35 @@ def render_tasks_section():
         new_task = st.text_input('新しいタスク', key='newtask', placeholder='やりたいことを入力...')
     with col_right:
         if st.button('更新', key='refresh_tasks'):
-            st.session_state.tasks_cache = None
-            # fetch now to update
-            fetch_tasks()
+            # explicit refresh bypasses the TTL cache
+            invalidate('tasks')
+    mutated = False
     if st.button('タスクを追加'):
-        if new_task.strip(): create_task(new_task.strip())
-    tasks = fetch_tasks()
+        if new_task.strip(): mutated = create_task(new_task.strip())
+    # right after a mutation the optimistic local list is already current
+    tasks = st.session_state.tasks_cache if mutated and st.session_state.tasks_cache is not None else fetch_tasks()
+    stats = fetch_task_stats()
+    if stats:
+        m = st.columns(3)
+        m[0].metric('タスク', stats.get('total', 0))
+        m[1].metric('未完了', stats.get('open', 0))
+        oldest = stats.get('oldest_open')
+        m[2].metric('最長放置', f"{oldest['neglected_days']}日" if oldest else '-')
+        if oldest and oldest['neglected_days'] >= st.session_state.get('neglect_days', 3):
+            st.warning(f"『{oldest['title']}』を{oldest['neglected_days']}日放置してるよ！")
     if not tasks:
         st.markdown('<div>タスクがありません</div>', unsafe_allow_html=True)
         return
+    plans = fetch_task_plans()
     for t in tasks:
         st.markdown('<div class="task-card">', unsafe_allow_html=True)
         cols = st.columns([5,1,1,1])
         title = t.get('title','')
         if t.get('completed'): title = f"✓ {title}"
         cols[0].write(title)
+        plan = plans.get(str(t.get('id'))) or {}
+        if plan.get('first_step'):
+            cols[0].caption(f"最初の一歩: {plan['first_step']}")
         if cols[1].button('完了', key=f'toggle-{t.get("id")}'):
             completed = t.get('completed')
             update_task(t.get('id'), {'completed': not completed})
@@ -362,13 +627,18 @@ def render_tasks_section():
         # Execute first step for this task (calls backend /api/execute)
         if cols[3].button('最初の一歩を実行', key=f'exec-{t.get("id")}'):
             # call API
-            res = api_post('/api/execute', {'task': t.get('title')})
-            if res and res.status_code == 200:
+            res = api_post('/api/execute', {'task': t.get('title'), 'task_id': t.get('id')})
+            if res is not None and res.status_code in (200, 202):
                 try:
                     data = res.json()
                     st.info(data.get('result') or str(data))
+                    link = ((data.get('run') or {}).get('result') or {}).get('open_url')
+                    if link:
+                        st.markdown(f'[開く]({link})')
                 except Exception:
                     st.info('実行リクエストを送信しました')
+            elif res is not None and res.status_code in (429, 503):
+                st.warning('いま実行中のことが多すぎるみたい。少し待ってからもう一回押してね')
             else:
                 st.warning('実行リクエストを送信できませんでした（ローカル実行を行います）')
                 # fallback message
@@ -387,13 +657,15 @@ def render_ai_todos_dashboard():
                 st.warning('プロンプトを入力してください')
             else:
                 try:
-                    r = requests.post(f"{API_BASE}/ai/todos", json={"prompt": prompt}, headers=_auth_headers(), timeout=API_TIMEOUT)
+                    r = _http_session().post(f"{API_BASE}/ai/todos", json={"prompt": prompt}, headers=_auth_headers(timeout=API_TIMEOUT), timeout=API_TIMEOUT)
                 except Exception as e:
                     # capture the exception in the UI
                     st.error(f"ネットワークエラー: {e}")
                     r = None
                 if not r:
                     st.warning('バックエンドに接続できません')
+                elif r.status_code == 503:
+                    st.warning(_overloaded_message(r))
                 elif r.status_code != 200:
                     # If the request timed out on the server side, guide the user to retry
                     if 'Read timed out' in getattr(r, 'text', ''):
@@ -458,6 +730,9 @@ def render_chat_ai():
     chat_col, ai_col = st.columns([1,1])
     with chat_col:
         st.markdown('**チャット**')
+        if st.session_state.get('conversation_id') and st.button('新しい会話', key='new_conversation'):
+            st.session_state.conversation_id = None
+            st.session_state.messages.clear()
         # If there is pending input, display it and process
         if st.session_state.get('chat_pending'):
             prompt = st.session_state.pop('chat_pending')
@@ -468,7 +743,7 @@ def render_chat_ai():
                     ok = post_chat(prompt)
                     if ok:
                         # display latest assistant reply if present
-                        for c in reversed(st.session_state.local_chats[-6:]):
+                        for c in reversed(list(st.session_state.local_chats)[-6:]):
                             if c.get('message') and not c.get('message').startswith('You:'):
                                 st.markdown(c.get('message'))
                                 break
@@ -476,8 +751,16 @@ def render_chat_ai():
                         st.markdown('（送信失敗）')
         chats = fetch_chats()
         if chats:
+            # only the newest chat_window rows are rendered; "load older" widens the window and pages in as needed
+            window = st.session_state.chat_window
+            if len(chats) > window or st.session_state.chats_has_more:
+                if st.button('古い履歴を読み込む', key='load_older_chats'):
+                    window = st.session_state.chat_window = min(window + CHAT_PAGE_SIZE, CHAT_HISTORY_MAX)
+                    if len(chats) < window and st.session_state.chats_has_more:
+                        load_older_chats(chats)
+                        chats = fetch_chats()
             st.markdown('<div style="max-height:300px;overflow-y:auto">', unsafe_allow_html=True)
-            for c in chats:
+            for c in chats[-window:]:
                 st.markdown(f'<div class="chat-card">{c.get("created_at","")}: {c.get("message","")}</div>', unsafe_allow_html=True)
             st.markdown('</div>', unsafe_allow_html=True)
         else:
@@ -495,16 +778,29 @@ def render_sidebar():
     # simple role sheet as JSON-ish key/value
     rs = st.text_input('ロールシート（tone など、簡易）', value=st.session_state.get('role_sheet', {}).get('tone', ''))
     st.session_state.role_sheet = {'tone': rs} if rs else {}
-    if 'alarm_enabled' not in st.session_state: st.session_state.alarm_enabled = False
-    if 'webhook_url' not in st.session_state: st.session_state.webhook_url = ''
-    if 'neglect_days' not in st.session_state: st.session_state.neglect_days = 3
+    # reminder settings live on the server (the backend schedules the alarms); load once per session
+    if 'reminder_settings' not in st.session_state:
+        st.session_state.reminder_settings = fetch_reminder_settings()
+    saved = st.session_state.reminder_settings or {}
+    if 'alarm_enabled' not in st.session_state: st.session_state.alarm_enabled = bool(saved.get('alarm_enabled', False))
+    if 'webhook_url' not in st.session_state: st.session_state.webhook_url = saved.get('webhook_url') or ''
+    if 'neglect_days' not in st.session_state: st.session_state.neglect_days = int(saved.get('neglect_days', 3))
     st.session_state.alarm_enabled = st.checkbox('鬼電モード（アラーム）', value=st.session_state.alarm_enabled)
     st.session_state.webhook_url = st.text_input('逆ギレ時のwebhook URL', value=st.session_state.webhook_url)
     st.session_state.neglect_days = st.number_input('放置日数で逆ギレ', min_value=1, max_value=30, value=st.session_state.neglect_days)
+    if st.session_state.reminder_settings is not None:
+        current = {'alarm_enabled': st.session_state.alarm_enabled, 'webhook_url': st.session_state.webhook_url or None,
+                   'neglect_days': int(st.session_state.neglect_days)}
+        changed = {k: v for k, v in current.items() if saved.get(k) != v}
+        if changed:
+            save_reminder_settings(changed)
     if st.button('鬼電シミュレート'): st.info('アラームを鳴らしました（モック）')
     if st.button('逆ギレ送信'):
-        if st.session_state.webhook_url: st.info('Webhook呼び出し（モック）')
-        else: st.warning('Webhook URL未設定')
+        if not st.session_state.webhook_url: st.warning('Webhook URL未設定')
+        else:
+            r = api_post('/reminders/notify')
+            if r is not None and r.status_code == 200: st.info('逆ギレを送信キューに入れました')
+            elif r is not None: st.error(f'送信できませんでした: {r.status_code} {r.text}')
     st.markdown('---')
     st.markdown(f'**API Base:** {API_BASE}')
 
@@ -522,6 +818,9 @@ def main():
     if user_input:
         st.session_state.chat_pending = user_input
         st.session_state.local_chats.append({'created_at': __import__('datetime').datetime.now().isoformat(), 'message': f'You: {user_input}'})
+    begin_rerun()
+    # independent list fetches run in parallel; the sections below then read them from the cache
+    prefetch(('/tasks', 'tasks'), ('/tasks/stats', 'tasks'), ('/tasks/plans', 'tasks'), (CHATS_LATEST, 'chats'))
     # logged-in header and logout
     cols = st.columns([4,1])
     with cols[0]: st.markdown(f'<div class="user-status">ログイン中: {st.session_state.username}</div>', unsafe_allow_html=True)
@@ -548,7 +847,7 @@ def main():
             r_json = None
             error_detail = None
             try:
-                r = requests.post(f"{API_BASE}/ai/todos", json={"prompt": prompt}, headers=_auth_headers(), timeout=API_TIMEOUT)
+                r = _http_session().post(f"{API_BASE}/ai/todos", json={"prompt": prompt}, headers=_auth_headers(timeout=API_TIMEOUT), timeout=API_TIMEOUT)
                 server_response = r
                 if r.status_code == 200:
                     try:
@@ -556,6 +855,8 @@ def main():
                         todos = r_json.get('todos', [])
                     except Exception as e:
                         error_detail = f"JSON decode error: {e}"
+                elif r.status_code == 503:
+                    error_detail = _overloaded_message(r)
                 else:
                     error_detail = f"Status: {r.status_code}, Body: {r.text}"
             except Exception as e:
@@ -628,18 +929,20 @@ def main():
                         st.write(f"{i+1}. {t.get('title')}")
                     st.markdown('</div>', unsafe_allow_html=True)
 
-                # Create tasks on server and show concise result
+                # Create tasks on server (in parallel) and show concise result
+                # explicit created_at keeps the steps in order even though the requests race
+                base = __import__('datetime').datetime.utcnow()
+                step = __import__('datetime').timedelta(milliseconds=1)
+                bodies = [{'title': t.get('title'), 'created_at': (base + i * step).isoformat()} for i, t in enumerate(todos)]
                 created = []
-                for t in todos:
+                for t, resp in zip(todos, post_concurrently('/tasks', bodies)):
                     title = t.get('title')
-                    payload = {'title': title}
-                    url = f"{API_BASE}/tasks"
-                    try:
-                        resp = requests.post(url, json=payload, headers=_auth_headers(), timeout=5)
-                        success = resp.status_code in (200,201)
-                        created.append({'title': title, 'ok': success, 'status_code': resp.status_code if hasattr(resp, 'status_code') else None})
-                    except Exception as e:
-                        created.append({'title': title, 'ok': False, 'error': str(e)})
+                    if resp is None:
+                        created.append({'title': title, 'ok': False, 'error': 'skipped'})
+                    elif isinstance(resp, Exception):
+                        created.append({'title': title, 'ok': False, 'error': str(resp)})
+                    else:
+                        created.append({'title': title, 'ok': resp.status_code in (200,201), 'status_code': resp.status_code})
 
                 # Show concise summary inside an expander
                 with st.expander('作成結果（簡潔表示）', expanded=True):
@@ -650,12 +953,13 @@ def main():
                             st.error(f"作成失敗: {c.get('title')} - {c.get('error', c.get('status_code'))}")
 
                 # 分解したタスクをダッシュボードのタスク一覧に自動で反映
-                st.session_state.tasks_cache = None
+                invalidate('tasks')
                 fetch_tasks()
                 st.success('分解したタスクをダッシュボードに追加しました')
     with t4:
         st.markdown('## 設定')
         render_sidebar()
+    render_fetch_timings()
 
 
 if __name__ == '__main__':